@@ -0,0 +1,124 @@
+# bench_engine.py
+# 試行ロジックのスループットのベンチマーク: シミュレータでセッションを仮想時間で回し、
+#  - 1秒あたりのセッション数
+#  - 各ハンドラ (run_next_trial, display_stimulus, handle_response, handle_timeout, clear_feedback_and_proceed) の1回あたりの処理時間
+#  - 終了時の保存 (セッションJSON組み立て + 書き込み) とグラフPNG出力の時間
+# を計測する。使い方: python bench_engine.py [-n セッション数] [--trials 試行数] [--no-plot]
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from pvt_session import build_session_data, write_session_json
+from pvt_simulator import ParticipantModel, build_simulated_session
+
+HANDLERS = ("run_next_trial", "display_stimulus", "handle_response", "handle_timeout", "clear_feedback_and_proceed")
+
+
+def _instrument(engine, samples):
+    # スケジューラは登録時にバインドメソッドを取るので、開始前にインスタンス属性で包む
+    for name in HANDLERS:
+        method = getattr(engine, name)
+
+        def timed(*args, _method=method, _samples=samples.setdefault(name, []), **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                _samples.append(time.perf_counter_ns() - start)
+
+        setattr(engine, name, timed)
+
+
+def _handler_summary(samples):
+    summary = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        values.sort()
+        summary[name] = {
+            "calls": len(values),
+            "mean_us": round(statistics.fmean(values) / 1000, 2),
+            "p95_us": round(values[int(0.95 * (len(values) - 1))] / 1000, 2)
+        }
+    return summary
+
+
+def bench_throughput(sessions, trials, model):
+    start = time.perf_counter()
+    for seed in range(sessions):
+        engine, clock = build_simulated_session(model, seed, max_trials=trials, target_trials=trials // 4)
+        engine.start()
+        clock.run()
+    elapsed = time.perf_counter() - start
+    return {"sessions": sessions, "trials_per_session": trials, "sessions_per_s": round(sessions / elapsed, 1),
+            "trials_per_s": round(sessions * trials / elapsed)}
+
+
+def bench_handlers(sessions, trials, model):
+    # 計測用のラッパー分だけ遅くなるので、スループットとは別に回す
+    samples = {}
+    for seed in range(sessions):
+        engine, clock = build_simulated_session(model, seed, max_trials=trials, target_trials=trials // 4)
+        _instrument(engine, samples)
+        engine.start()
+        clock.run()
+    return _handler_summary(samples)
+
+
+def bench_end_of_test(trials, model, repeats, plot=True):
+    engine, clock = build_simulated_session(model, 0, max_trials=trials, target_trials=trials // 4)
+    engine.start()
+    clock.run()
+    settings = {"target_number": engine.target_number, "response_limit_ms": engine.response_limit_ms,
+                "response_outlier_ms": engine.response_outlier_ms, "feedback_duration_ms": engine.feedback_duration_ms}
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        save_ms = []
+        for i in range(repeats):
+            start = time.perf_counter()
+            data = build_session_data("2025-01-01T00:00:00", settings, engine.all_trial_data, rt_values=engine.rt_summary())
+            write_session_json(os.path.join(tmp_dir, f"{i}.json"), data)
+            save_ms.append((time.perf_counter() - start) * 1000)
+        result["save_ms_median"] = round(statistics.median(save_ms), 2)
+
+        if plot:
+            from pvt_plot import GraphExporter
+            exporter = GraphExporter()
+            plot_ms = []
+            for i in range(repeats):
+                start = time.perf_counter()
+                exporter.export(engine.reaction_times, os.path.join(tmp_dir, f"{i}.png"))
+                plot_ms.append((time.perf_counter() - start) * 1000)
+            result["plot_first_ms"] = round(plot_ms[0], 2) # Figure の生成を含む
+            result["plot_ms_median"] = round(statistics.median(plot_ms[1:] or plot_ms), 2)
+    return result
+
+
+def run_benchmarks(sessions=200, trials=100, repeats=5, plot=True, model=None):
+    model = model or ParticipantModel()
+    return {
+        "throughput": bench_throughput(sessions, trials, model),
+        "handlers": bench_handlers(max(1, sessions // 10), trials, model),
+        "end_of_test": bench_end_of_test(trials, model, repeats, plot)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="試行ロジックと終了時処理のベンチマーク")
+    parser.add_argument("-n", "--sessions", type=int, default=200)
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-plot", action="store_true", help="グラフPNG出力を計測しない")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sessions, args.trials, args.repeats, plot=not args.no_plot)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
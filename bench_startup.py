@@ -0,0 +1,59 @@
+# bench_startup.py
+# 起動時間のベンチマーク: プロセス開始 → import gng_pvt → 最初の画面の描画完了 までを計測する。
+# 使い方: python bench_startup.py [-n 回数]
+# ディスプレイが無い環境では import までの時間だけを計測する。
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import gng_pvt
+t_import = time.perf_counter()
+result = {"import_ms": (t_import - t0) * 1000,
+          "heavy_modules_loaded": sorted(m for m in ("numpy", "matplotlib", "PIL") if m in sys.modules)}
+try:
+    root = gng_pvt.tk.Tk()
+except gng_pvt.tk.TclError:
+    root = None
+if root is not None:
+    root.attributes = lambda *args, **kwargs: None # 計測中は全画面にしない
+    app = gng_pvt.PVTApp(root)
+    root.update_idletasks()
+    root.update()
+    result["first_frame_ms"] = (time.perf_counter() - t0) * 1000
+    root.destroy()
+print(json.dumps(result))
+"""
+
+
+def run_probe():
+    completed = subprocess.run([sys.executable, "-c", PROBE], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="import から最初の画面描画までの時間を計測する")
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = [run_probe() for _ in range(args.runs)]
+    summary = {
+        "runs": args.runs,
+        "import_ms_median": round(statistics.median(r["import_ms"] for r in results), 1),
+        "heavy_modules_loaded_at_import": results[0]["heavy_modules_loaded"]
+    }
+    first_frames = [r["first_frame_ms"] for r in results if "first_frame_ms" in r]
+    summary["first_frame_ms_median"] = round(statistics.median(first_frames), 1) if first_frames else None
+    print(json.dumps(summary, ensure_ascii=False))
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,198 @@
 # pvt_app.py
 
+import argparse
 import tkinter as tk
 from tkinter import ttk, font, messagebox # messagebox はここでインポートされる
-import random
-import time
 import datetime
 import os
-import json
-import statistics
-
-try:
-    import matplotlib
-    matplotlib.use('Agg') # GUIなしで実行するために重要
-    import matplotlib.pyplot as plt
-    MATPLOTLIB_AVAILABLE = True
-except ImportError:
-    MATPLOTLIB_AVAILABLE = False
-    print("警告: matplotlibライブラリが見つかりません。グラフ機能は無効になります。`pip install matplotlib`でインストールしてください。")
-
-try:
-    from PIL import Image, ImageTk
-    PILLOW_AVAILABLE = True
-except ImportError:
-    PILLOW_AVAILABLE = False
-    print("警告: Pillowライブラリが見つかりません。グラフ表示機能は無効になります。`pip install Pillow`でインストールしてください。")
+import socket
+import threading
+import uuid
+
+from pvt_engine import PVTEngine
+from pvt_fatigue import FatigueMonitor
+from pvt_plot import GraphExporter, draw_line_plot
+from pvt_persist import PersistenceWorker
+from pvt_precision import PrecisionSession
+from pvt_profile import PROFILE_SUFFIX, SessionProfiler, write_profile
+from pvt_render import StimulusCanvas
+from pvt_session import build_session_data, session_base_filename, write_session_json
+from pvt_store import STORE_FILENAME, SessionStore
+from pvt_stream import COMPLETED_DIRNAME, STREAM_DIRNAME, STREAM_SUFFIX, TrialStream, read_stream, recover_interrupted_sessions
+
+GRAPH_FROM_TRIALS = "trials" # session_save_job: グラフの値を保存ジョブで組み立てた試行記録から取る
+
+# matplotlib/NumPy は結果画面でしか使わないため起動時には読み込まない。
+# 利用可否は初めて必要になった時点で判定し、結果はキャッシュする。
+_optional_module_available = {}
+_optional_module_lock = threading.Lock()
+
+
+def matplotlib_available():
+    with _optional_module_lock:
+        if "matplotlib" not in _optional_module_available:
+            try:
+                import matplotlib # PNG保存にのみ使用 (画面表示は Canvas に直接描く)
+                _optional_module_available["matplotlib"] = True
+            except ImportError:
+                _optional_module_available["matplotlib"] = False
+                print("警告: matplotlibライブラリが見つかりません。グラフのPNG保存は無効になります。`pip install matplotlib`でインストールしてください。")
+        return _optional_module_available["matplotlib"]
+
+
+def prewarm_heavy_modules():
+    # 参加者が説明文を読んでいる間に、結果画面で使う重いモジュールをバックグラウンドで読み込んでおく
+    def run():
+        try:
+            import pvt_analytics # NumPy
+        except ImportError:
+            pass
+        if matplotlib_available():
+            try:
+                from matplotlib.figure import Figure
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+            except ImportError:
+                pass
+
+    thread = threading.Thread(target=run, name="prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def __getattr__(name):
+    # 互換用: gng_pvt.MATPLOTLIB_AVAILABLE は参照された時点で判定する
+    if name == "MATPLOTLIB_AVAILABLE":
+        return matplotlib_available()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class KeyDispatchTimer:
+    # event.time はOS(Xサーバー)側のミリ秒時刻で、perf_counter とは基準が異なる。
+    # 「受信時刻 - event.time」の最小値を遅延ゼロの基準とみなし、それとの差をディスパッチ遅延とする。
+    # 基準がセッション中に下がることもある相対的な推定値なので、RT の補正には既定では使わない (correct_dispatch_latency)。
+    EVENT_TIME_WRAP_MS = 2 ** 32
+
+    def __init__(self):
+        self.base_offset_ms = None
+        self.last_event_time_ms = None
+
+    def reset(self):
+        self.base_offset_ms = None
+        self.last_event_time_ms = None
+
+    def observe(self, event_time_ms, received_ns):
+        # 戻り値: ディスパッチ遅延 (ns)。event.time が無いイベントでは None
+        if not event_time_ms:
+            return None
+        event_time_ms %= self.EVENT_TIME_WRAP_MS
+        if self.last_event_time_ms is not None and event_time_ms < self.last_event_time_ms:
+            self.base_offset_ms = None # OS側の時刻が一周した
+        self.last_event_time_ms = event_time_ms
+
+        offset_ms = received_ns / 1_000_000 - event_time_ms
+        if self.base_offset_ms is None or offset_ms < self.base_offset_ms:
+            self.base_offset_ms = offset_ms
+        return round((offset_ms - self.base_offset_ms) * 1_000_000)
+
+
+class _EngineAttribute:
+    # PVTAppの状態・設定はPVTEngineが持つ。既存の属性名でそのまま読み書きできるように委譲する
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance.engine, self.name)
+
+    def __set__(self, instance, value):
+        setattr(instance.engine, self.name, value)
 
 
 class PVTApp:
+    # 設定可能変数 (PVTEngine に委譲)
+    target_number = _EngineAttribute()
+    target_trials = _EngineAttribute()
+    max_trials = _EngineAttribute()
+    min_interval_s = _EngineAttribute()
+    max_interval_s = _EngineAttribute()
+    response_limit_ms = _EngineAttribute()
+    response_outlier_ms = _EngineAttribute()
+    feedback_duration_ms = _EngineAttribute()
+    precise_onset = _EngineAttribute()
+    correct_dispatch_latency = _EngineAttribute()
+    schedule_seed = _EngineAttribute()
+    max_consecutive_targets = _EngineAttribute()
+    balance_digits = _EngineAttribute()
+    isi_distribution = _EngineAttribute()
+    duration_s = _EngineAttribute()
+
+    # 試行状態 (PVTEngine に委譲)
+    sequence = _EngineAttribute()
+    current_stimulus = _EngineAttribute()
+    previous_stimulus = _EngineAttribute()
+    number_counts = _EngineAttribute()
+    total_trials_conducted = _EngineAttribute()
+    correct_go_responses = _EngineAttribute()
+    correct_no_go_responses = _EngineAttribute()
+    commission_errors = _EngineAttribute()
+    commission_outliers = _EngineAttribute()
+    omission_outliers = _EngineAttribute()
+    reaction_times = _EngineAttribute()
+    all_trial_data = _EngineAttribute()
+    current_isi_ms = _EngineAttribute()
+    interval_timer_id = _EngineAttribute()
+    reaction_window_timer_id = _EngineAttribute()
+    feedback_clear_timer_id = _EngineAttribute()
+    test_in_progress = _EngineAttribute()
+    reaction_timer_start_time = _EngineAttribute()
+    stimulus_on_screen = _EngineAttribute()
+    accepting_response = _EngineAttribute()
+
     def __init__(self, root):
         self.root = root
         self.root.title("GNG-PVT")
         self.root.geometry("800x700")
         root.attributes('-fullscreen', True)
 
+        # 試行ロジックはTkに依存しないエンジンに置き、このクラスは表示だけを担当する
+        self.engine = PVTEngine(scheduler=self.root, view=self)
+
+        # 反応キーはセッション中一度だけ <KeyPress> にバインドし、受け付け可否はエンジンの状態で判定する
+        self.response_keys = {"Return", "KP_Enter", "space"}
+        self.key_dispatch_timer = KeyDispatchTimer()
+        self.response_key_binding = None
+
+        # True にするとテスト画面に試行ごとのオンライン統計を表示する (実験者用)
+        self.show_live_metrics = False
+        self.live_metrics_label = None
+        self.engine.trial_listeners.append(self.update_live_metrics)
+
+        # True: 試行ごとに反応時間とラプスの CUSUM を更新し、パフォーマンスの低下をアラートとしてセッションJSONに記録する
+        self.fatigue_monitoring = False
+        self.fatigue_monitor = None
+
+        # True にすると試行中はGCを止め、優先度を上げ、停止 (pause) を検出してセッションJSONに記録する
+        self.precision_mode = False
+        self.precision_session = None
+
+        # True にするとハンドラの処理時間とイベントループの遅れを計測し、セッションJSONの隣に <base>.profile を書き出す
+        self.profile_handlers = False
+        self.profiler = None
+        self.session_base_filename = None # 直近のセッションの保存先 (拡張子なし)
+
+        # True にすると JSON に加えてコンパクト形式 (pvt_compact: .npy + .meta) でも保存する
+        self.save_compact = False
+
+        # 終了時の保存はワーカースレッドで行い、結果画面はすぐに表示する (進捗は結果画面に表示)
+        self.persistence = PersistenceWorker()
+        self.persistence_poll_id = None
+        self.persistence_poll_ms = 50
+        self.save_job = None # 直近のセッションの保存ジョブ
+        self.trial_reload = None # 時間制: 保存ジョブがログから読み戻したセッションデータを受け取る dict (読み戻し待ちの間だけ)
+        self.results_filepaths = (None, None) # 結果画面に表示した (JSON, グラフ) の保存先
+        self.save_status_label = None
+
         self.data_dir = "recoded_data"
         if not os.path.exists(self.data_dir):
             try:
@@ -43,51 +203,38 @@ class PVTApp:
                 # messagebox.showerror("エラー", f"データ保存ディレクトリの作成に失敗しました: {e}\nデータは保存されません。")
                 self.data_dir = None
 
+        # 試行は記録した時点で追記ログに書き出す (クラッシュしても失われない)
+        self.trial_stream = None
+        self.engine.trial_listeners.append(self.stream_trial)
+        self.engine.trial_update_listeners.append(self.stream_trial_update)
+
+        # collector_url を設定すると試行とセッションを収集サーバー (pvt_collector) にも送る (送信はバックグラウンド)
+        self.collector_url = None
+        self.station_id = socket.gethostname()
+        self.collector_client = None
+        self.collector_session_key = None
+        self.engine.trial_listeners.append(self.collect_trial)
+        self.engine.trial_update_listeners.append(self.collect_trial_update)
+        self.recover_interrupted_sessions()
+
         self.setup_styles()
 
         self.start_frame = None
         self.test_frame = None
         self.results_frame = None
+        self.test_screen = None # 一度作ったテスト画面 (数字は Canvas 上に作り置き)
+        self.stimulus_canvas = None
+        self.stimulus_canvas_width = 600
+        self.stimulus_canvas_height = 360
 
-        # 設定可能変数
-        self.target_number = 0 # ターゲット数字(0はランダム)
-        self.target_trials = 25
-        self.max_trials = 100
-        self.min_interval_s = 0.5
-        self.max_interval_s = 5.0
-        self.response_limit_ms = 1500
-        self.response_outlier_ms = 100
-
-        # self.target_number = 0 # 初期化済み
-        self.sequence=[]
-        self.current_stimulus = 0
-        self.previous_stimulus = 0
-        self.number_counts = {i: 0 for i in range(1, 10)}
-        self.total_trials_conducted = 0
-
-        self.correct_go_responses = 0
-        self.correct_no_go_responses = 0
-        self.commission_errors = 0
-        self.commission_outliers = 0 # 早すぎる反応
-        self.omission_outliers = 0   # 遅すぎる反応(Go試行でのタイムアウト)
-        self.reaction_times = []
-        self.all_trial_data = []
         self.rt_std_dev_ms = None # 結果計算時に設定
+        self.prewarm_started = False
 
-        self.current_isi_ms = None
-        self.feedback_duration_ms = 1000
-
-        self.interval_timer_id = None
-        self.reaction_window_timer_id = None
-        self.feedback_clear_timer_id = None
-
-        self.test_in_progress = False
-        self.reaction_timer_start_time = 0
-        self.stimulus_on_screen = False
-        self.accepting_response = False
-
-        self.graph_image_tk = None # ImageTk.PhotoImage オブジェクトを保持
-        self.graph_label = None    # グラフを表示するラベルウィジェット
+        self.graph_exporter = GraphExporter() # PNG保存用 (Figure は再実行時も使い回す)
+        self.graph_canvas = None   # 結果画面でグラフを描く Canvas
+        self.graph_width = 400
+        self.graph_height = 220
+        self.history_graph_width = 600
 
         self.show_start_screen()
 
@@ -101,28 +248,19 @@ class PVTApp:
 
         s = ttk.Style()
         s.configure("TButton", font=self.button_font, padding=10)
-        s.configure("Large.TLabel", font=self.stimulus_font, padding=20)
-        s.configure("Feedback.TLabel", font=self.feedback_font, padding=10)
 
     def clear_current_frame(self):
         if self.start_frame and self.start_frame.winfo_exists():
             self.start_frame.destroy()
         if self.test_frame and self.test_frame.winfo_exists():
-            self.test_frame.destroy()
+            self.test_frame.pack_forget() # テスト画面は次のセッションでも使い回す
         if self.results_frame and self.results_frame.winfo_exists():
             self.results_frame.destroy()
         self.start_frame = self.test_frame = self.results_frame = None
+        self.save_status_label = None
 
         # Clear any pending timers
-        if self.interval_timer_id:
-            self.root.after_cancel(self.interval_timer_id)
-            self.interval_timer_id = None
-        if self.reaction_window_timer_id:
-            self.root.after_cancel(self.reaction_window_timer_id)
-            self.reaction_window_timer_id = None
-        if self.feedback_clear_timer_id:
-            self.root.after_cancel(self.feedback_clear_timer_id)
-            self.feedback_clear_timer_id = None
+        self.engine.cancel_timers()
 
     def show_start_screen(self):
         self.clear_current_frame()
@@ -131,11 +269,16 @@ class PVTApp:
         self.start_frame = ttk.Frame(self.root, padding="20")
         self.start_frame.pack(expand=True, fill=tk.BOTH)
 
+        if not self.prewarm_started: # 最初の画面が描かれてから読み込みを始める
+            self.prewarm_started = True
+            self.root.after_idle(prewarm_heavy_modules)
+
         ttk.Label(self.start_frame, text="GNG-PVT", font=self.title_font).pack(pady=20)
 
-        if self.target_number == 0: # Only set if not already set (e.g. for re-runs with same target)
-            self.target_number = random.randint(1, 9)
+        self.engine.choose_target_number()
         ttk.Label(self.start_frame, text=f"今回のターゲット数字: {self.target_number}", font=self.text_font).pack(pady=10)
+        if self.duration_s is not None:
+            ttk.Label(self.start_frame, text=f"テスト時間: {self.duration_s / 60:g} 分", font=self.text_font).pack(pady=5)
 
         self.generate_sequence()
 
@@ -155,327 +298,516 @@ class PVTApp:
         self.root.bind("<Return>", lambda event: start_button.invoke())
 
     def generate_sequence(self):
-        self.sequence = [self.target_number] * self.target_trials
-        number_range = range(1, 10)
-        remaining_count = self.max_trials - self.target_trials
-        other_numbers = [n for n in number_range if n != self.target_number]
-
-        self.sequence += [random.choice(other_numbers) for _ in range(remaining_count)]
-
-        random.shuffle(self.sequence)
+        self.engine.generate_sequence()
 
     def reset_test_variables(self):
-        # self.target_number remains unless explicitly reset (e.g. in show_start_screen if 0)
-        self.current_stimulus = 0
-        self.previous_stimulus = 0
-        self.number_counts = {i: 0 for i in range(1, 10)}
-        self.total_trials_conducted = 0
-        self.correct_go_responses = 0
-        self.correct_no_go_responses = 0
-        self.commission_errors = 0
-        self.commission_outliers = 0
-        self.omission_outliers = 0
-        self.reaction_times = []
-        self.all_trial_data = []
+        self.engine.reset()
         self.rt_std_dev_ms = None # Reset
-        self.current_isi_ms = None
-        self.test_in_progress = False
-        self.stimulus_on_screen = False
-        self.accepting_response = False
-        self.graph_image_tk = None # Clear previous graph image reference
 
     def start_test(self):
         self.root.unbind("<Return>") # Unbind from start button
-        self.test_in_progress = True
         self.show_test_screen()
-        self.run_next_trial()
-
-    def show_test_screen(self):
-        self.clear_current_frame()
-        self.test_frame = ttk.Frame(self.root, padding="20")
-        self.test_frame.pack(expand=True, fill=tk.BOTH)
-
-        center_frame = ttk.Frame(self.test_frame) # Frame to center content
-        center_frame.pack(expand=True) # This will center the frame
+        self.bind_response_keys()
+        self.open_trial_stream()
+        self.open_collector_session()
+        # 時間制モードでは試行を追記ログにだけ残し、長時間でもメモリを一定に保つ (終了時に読み戻す)
+        self.engine.retain_trials = not (self.engine.duration_mode and self.trial_stream is not None)
+        self.session_base_filename = None
+        self.profiler = SessionProfiler(self.engine, on_complete=self.save_profile).start() if self.profile_handlers else None
+        self.fatigue_monitor = FatigueMonitor(self.engine, on_alert=self.fatigue_alert).start() if self.fatigue_monitoring else None
+        self.engine.start()
+        self.precision_session = PrecisionSession(self.engine).start() if self.precision_mode else None
+
+    def test_settings(self):
+        return self.engine.test_settings()
+
+    def stream_dir(self):
+        return os.path.join(self.data_dir, STREAM_DIRNAME) if self.data_dir else None
+
+    def recover_interrupted_sessions(self):
+        if not self.data_dir:
+            return
+        try:
+            recovered = recover_interrupted_sessions(self.stream_dir(), self.data_dir)
+            for json_filepath in recovered:
+                print(f"中断されたセッションを復旧しました: {json_filepath}")
+        except Exception as e:
+            print(f"セッション復旧エラー: {e}")
+            return
+        if not recovered:
+            return
+        # 復旧したセッションも履歴・検索に出るようにストアに登録する (新規作成時は取り込み済み)
+        try:
+            store, is_new_store = self.open_session_store()
+            with store:
+                if not is_new_store:
+                    store.import_json_files(recovered)
+        except Exception as e:
+            print(f"セッションストアの更新エラー: {e}")
 
-        self.stimulus_label = ttk.Label(center_frame, text="", style="Large.TLabel", anchor=tk.CENTER)
-        self.stimulus_label.pack(pady=40, ipady=20) # ipady for vertical size of the label itself
+    def open_trial_stream(self):
+        self.close_trial_stream()
+        if not self.data_dir:
+            return
+        now = datetime.datetime.now()
+        try:
+            os.makedirs(self.stream_dir(), exist_ok=True)
+            # 同じ秒に続けて始めたセッションが前のログ (completed/ に移したものも) と同じ名前にならないように連番を付ける
+            stem = now.strftime("%Y-%m-%d_%H-%M-%S")
+            name = stem + STREAM_SUFFIX
+            suffix = 2
+            while any(os.path.exists(os.path.join(directory, name))
+                      for directory in (self.stream_dir(), os.path.join(self.stream_dir(), COMPLETED_DIRNAME))):
+                name = f"{stem}_{suffix}{STREAM_SUFFIX}"
+                suffix += 1
+            stream_path = os.path.join(self.stream_dir(), name)
+            self.trial_stream = TrialStream(stream_path)
+            self.trial_stream.open(now.isoformat(), self.test_settings())
+        except OSError as e:
+            print(f"試行ログを開けませんでした: {e}")
+            self.trial_stream = None
+
+    def close_trial_stream(self):
+        # ストリームを閉じ、閉じた (completed/ に移した) ログのパスを返す (ストリームが無ければ None)。
+        # 読み戻しはメインスレッドでは行わない (時間制では保存ジョブの中で読む)
+        if self.trial_stream is None:
+            return None
+        stream, self.trial_stream = self.trial_stream, None
+        try:
+            stream.close()
+            return stream.path
+        except OSError as e:
+            print(f"試行ログの書き込みエラー: {e}")
+            return None
 
-        self.feedback_label = ttk.Label(center_frame, text="", style="Feedback.TLabel", anchor=tk.CENTER)
-        self.feedback_label.pack(pady=20)
+    def stream_trial(self, trial_outcome):
+        if self.trial_stream is not None:
+            try:
+                self.trial_stream.append_trial(trial_outcome)
+            except OSError as e:
+                print(f"試行ログの書き込みエラー: {e}")
 
-        self.response_button = ttk.Button(center_frame, text="反応", command=self.handle_response_button, style="TButton")
-        self.response_button.pack(pady=20)
-        # Focus might be set in display_stimulus or here depending on flow
+    def stream_trial_update(self, trial_outcome, fields):
+        if self.trial_stream is not None:
+            try:
+                self.trial_stream.update_trial(trial_outcome["trial_number"], fields)
+            except OSError as e:
+                print(f"試行ログの書き込みエラー: {e}")
 
-    def run_next_trial(self):
-        if not self.test_in_progress:
+    def open_collector_session(self):
+        self.collector_session_key = None
+        if not self.collector_url:
             return
-
-        if self.total_trials_conducted >= self.max_trials:
-            self.end_test()
+        if self.collector_client is None:
+            from pvt_collector import CollectorClient
+            self.collector_client = CollectorClient(self.collector_url, self.station_id)
+        self.collector_session_key = uuid.uuid4().hex
+        self.collector_client.send({"type": "session_start", "session_key": self.collector_session_key,
+                                    "datetime_iso": datetime.datetime.now().isoformat(),
+                                    "test_settings": self.test_settings()})
+
+    def collect_trial(self, trial_outcome):
+        if self.collector_session_key is not None:
+            # 後から feedback_actual_ms が書き足されるので写しを送る
+            self.collector_client.send({"type": "trial", "session_key": self.collector_session_key,
+                                        "trial": dict(trial_outcome)})
+
+    def collect_trial_update(self, trial_outcome, fields):
+        if self.collector_session_key is not None:
+            self.collector_client.send({"type": "trial_update", "session_key": self.collector_session_key,
+                                        "trial_number": trial_outcome["trial_number"], **fields})
+
+    def bind_response_keys(self):
+        self.unbind_response_keys()
+        self.key_dispatch_timer.reset()
+        # Keep keyboard focus off the response button so its class bindings never double-handle a key
+        self.test_frame.focus_set()
+        self.response_key_binding = self.root.bind("<KeyPress>", self.handle_response_key, add="+")
+
+    def unbind_response_keys(self):
+        if self.response_key_binding:
+            self.root.unbind("<KeyPress>", self.response_key_binding)
+            self.response_key_binding = None
+
+    def handle_response_key(self, event):
+        received_ns = self.engine.clock.now_ns()
+        if event.keysym not in self.response_keys:
             return
+        dispatch_latency_ns = self.key_dispatch_timer.observe(getattr(event, "time", 0), received_ns)
+        self.engine.handle_response(dispatch_latency_ns)
+        return "break"
 
-        self.stimulus_label.config(text="") # Clear previous stimulus
-        self.stimulus_on_screen = False
-        self.accepting_response = False
-        self.root.unbind("<Return>") # Unbind from previous trial's response button if any
-
-        # ISI: Inter-Stimulus Interval
-        interval_ms = random.randint(int(self.min_interval_s * 1000), int(self.max_interval_s * 1000))
-        self.current_isi_ms = interval_ms
-        self.interval_timer_id = self.root.after(interval_ms, self.display_stimulus)
+    def show_test_screen(self):
+        self.clear_current_frame()
+        if self.test_screen is None or not self.test_screen.winfo_exists():
+            self.build_test_screen()
+        else:
+            self.stimulus_canvas.clear()
+            self.stimulus_canvas.reset_costs()
+        self.test_frame = self.test_screen
+        self.test_frame.pack(expand=True, fill=tk.BOTH)
+        if self.show_live_metrics and self.live_metrics_label is None:
+            self.live_metrics_label = ttk.Label(self.test_center_frame, text="", font=self.small_text_font, anchor=tk.CENTER)
+            self.live_metrics_label.pack(pady=10)
+        elif not self.show_live_metrics and self.live_metrics_label is not None:
+            self.live_metrics_label.destroy()
+            self.live_metrics_label = None
+        if self.live_metrics_label is not None:
+            self.live_metrics_label.config(text="")
+
+    def build_test_screen(self):
+        self.test_screen = ttk.Frame(self.root, padding="20")
+
+        center_frame = ttk.Frame(self.test_screen) # Frame to center content
+        center_frame.pack(expand=True) # This will center the frame
+        self.test_center_frame = center_frame
 
-    def select_stimulus(self):
-        if not self.sequence: # Check if sequence is empty
-            return None
-        # Pop from the end for efficiency with list.pop()
-        choiced_number = self.sequence.pop(-1)
-        return choiced_number
+        # 数字とフィードバックは Canvas 上の作り置きの項目を表示/非表示にする (pvt_render)
+        canvas = tk.Canvas(center_frame, width=self.stimulus_canvas_width, height=self.stimulus_canvas_height,
+                           highlightthickness=0)
+        canvas.pack(pady=20)
+        self.stimulus_canvas = StimulusCanvas(canvas, self.stimulus_canvas_width, self.stimulus_canvas_height,
+                                              self.stimulus_font, self.feedback_font)
 
-    def display_stimulus(self):
-        if not self.test_in_progress:
-            return
+        self.response_button = ttk.Button(center_frame, text="反応", command=self.handle_response_button, style="TButton")
+        self.response_button.pack(pady=20)
+        self.live_metrics_label = None # 表示するかは show_test_screen で決める
 
-        next_stimulus = self.select_stimulus()
-        if next_stimulus is None: # No more stimuli in sequence
-            self.end_test()
+    def update_live_metrics(self, trial_outcome):
+        if self.live_metrics_label is None:
             return
+        metrics = self.engine.live_metrics()
+        median_str = f"{round(metrics['median_go_rt_ms'])} ms" if metrics['median_go_rt_ms'] is not None else "N/A"
+        alert_str = f"  疲労アラート {self.fatigue_monitor.alert_count}" if self.fatigue_monitor is not None and self.fatigue_monitor.alert_count else ""
+        self.live_metrics_label.config(
+            text=f"試行 {metrics['trials']}  正答率 {metrics['accuracy_percentage']} %  中央RT {median_str}  ラプス {metrics['lapses']}{alert_str}")
 
-        self.current_stimulus = next_stimulus
-        self.stimulus_label.config(text=str(self.current_stimulus))
-        self.stimulus_on_screen = True
-        self.accepting_response = True # Start accepting response AFTER stimulus is on screen
+    def fatigue_alert(self, alert):
+        # FatigueMonitor から ISI の待ち時間に呼ばれる
+        detector = "反応時間の延長" if alert["detector"] == "rt" else "ラプスの増加"
+        print(f"疲労アラート: 試行 {alert['trial_number']} で{detector}を検出しました (試行 {alert['change_trial_number']} から)。")
+        self.update_live_metrics(None)
 
-        self.reaction_timer_start_time = time.perf_counter()
-        self.number_counts[self.current_stimulus] += 1
-        self.previous_stimulus = self.current_stimulus # Store for potential analysis
+    # --- PVTEngine から呼ばれるビュー側の処理 ---
 
-        self.response_button.focus_set() # Set focus to response button
-        self.root.bind("<Return>", lambda event: self.response_button.invoke()) # Bind Enter to response button
+    def show_stimulus(self, stimulus):
+        self.stimulus_canvas.show_digit(stimulus)
 
-        # Timer for response window (max reaction time)
-        self.reaction_window_timer_id = self.root.after(self.response_limit_ms, self.handle_timeout)
-
-    def handle_response_button(self, event=None):
-        if not self.test_in_progress or not self.stimulus_on_screen or not self.accepting_response:
-            return # Ignore premature or late presses
-
-        if self.reaction_window_timer_id: # Cancel timeout timer
-            self.root.after_cancel(self.reaction_window_timer_id)
-            self.reaction_window_timer_id = None
-
-        self.accepting_response = False # Stop accepting further responses for this trial
-        self.root.unbind("<Return>") # Unbind Enter from response button
-
-        rt_s = time.perf_counter() - self.reaction_timer_start_time
-        rt_ms = round(rt_s * 1000)
-
-        self.stimulus_label.config(text="") # Clear stimulus
-        self.stimulus_on_screen = False
-
-        is_target_stimulus = (self.current_stimulus == self.target_number)
-        trial_outcome = {
-            "trial_number": self.total_trials_conducted + 1,
-            "pre_stimulus_interval_ms": self.current_isi_ms,
-            "stimulus": self.current_stimulus,
-            "is_target": 1 if is_target_stimulus else 0,
-            "is_correct": 0, # Default to incorrect, update based on logic
-            "reaction_time_ms": rt_ms
-        }
-
-        self.reaction_times.append(rt_ms) # Record all RTs for potential analysis
-        if rt_ms < self.response_outlier_ms: # Response too fast
-            self.show_feedback("TooFast!", "orange")
-            self.commission_outliers += 1
-            trial_outcome["is_correct"] = 0 # Or a specific code for outlier
-        elif is_target_stimulus: # Pressed on target (NoGo trial) -> Commission Error
-            self.show_feedback("Bad!", "red")
-            self.commission_errors += 1
-            trial_outcome["is_correct"] = 0
-        else: # Pressed on non-target (Go trial) -> Correct Go
-            self.show_feedback("Good!", "green")
-            self.correct_go_responses += 1
-            trial_outcome["is_correct"] = 1
-        
-        self.all_trial_data.append(trial_outcome)
-        self.total_trials_conducted += 1
-        self.feedback_clear_timer_id = self.root.after(self.feedback_duration_ms, self.clear_feedback_and_proceed)
-
-    def handle_timeout(self):
-        if not self.test_in_progress or not self.stimulus_on_screen or not self.accepting_response:
-            return # Should not happen if logic is correct, but good safeguard
-
-        self.reaction_window_timer_id = None # Timer already fired
-        self.accepting_response = False
-        self.root.unbind("<Return>")
-
-        self.stimulus_label.config(text="")
-        self.stimulus_on_screen = False
-
-        is_target_stimulus = (self.current_stimulus == self.target_number)
-        trial_outcome = {
-            "trial_number": self.total_trials_conducted + 1,
-            "pre_stimulus_interval_ms": self.current_isi_ms,
-            "stimulus": self.current_stimulus,
-            "is_target": 1 if is_target_stimulus else 0,
-            "is_correct": 0,
-            "reaction_time_ms": None # Timeout means no RT
-        }
-
-        if is_target_stimulus: # Correctly did not press on target (NoGo trial)
-            self.show_feedback("Good!", "green")
-            self.correct_no_go_responses += 1
-            trial_outcome["is_correct"] = 1
-        else: # Did not press on non-target (Go trial) -> Omission Error/Outlier
-            self.show_feedback("TooLate!", "orange")
-            self.omission_outliers += 1 # This is an omission error for a Go trial
-            trial_outcome["is_correct"] = 0
-
-        self.all_trial_data.append(trial_outcome)
-        self.total_trials_conducted += 1
-        self.feedback_clear_timer_id = self.root.after(self.feedback_duration_ms, self.clear_feedback_and_proceed)
+    def clear_stimulus(self):
+        self.stimulus_canvas.hide_digit()
 
     def show_feedback(self, message, color):
-        self.feedback_label.config(text=message, foreground=color)
+        self.stimulus_canvas.show_feedback(message, color)
 
-    def clear_feedback_and_proceed(self):
-        self.feedback_label.config(text="")
-        if self.feedback_clear_timer_id: # Should always be true if called from timer
-            self.root.after_cancel(self.feedback_clear_timer_id)
-            self.feedback_clear_timer_id = None
-
-        # Check termination conditions again (e.g., if max_trials reached during feedback)
-        if self.total_trials_conducted < self.max_trials:
-            # This condition for early termination seems complex and might not be standard PVT/GNG
-            # For simplicity, standard PVT runs for a fixed number of trials or time.
-            # The "all_numbers_presented_max_times" logic is kept but might need review for GNG.
-            all_numbers_presented_max_times = True
-            # This check seems to try to ensure a certain distribution, but max_trials is the primary stop.
-            # For GNG, it's more about Go/NoGo counts.
-            # For now, let's assume self.max_trials is the main control.
-            # If you need complex balancing, that logic would be here.
-            # A simpler check:
-            if sum(self.number_counts.values()) >= self.max_trials: # Alternative stop if counts fill up
-                 self.end_test()
-            else:
-                 self.run_next_trial()
-        else:
-            self.end_test()
+    def clear_feedback(self):
+        self.stimulus_canvas.hide_feedback()
 
-    def end_test(self):
-        if not self.test_in_progress and self.total_trials_conducted > 0 : return # Avoid re-entry
-        self.test_in_progress = False
+    def flush_display(self):
+        # precise_onset: 保留中の再描画をここで処理させ、描画後に提示時刻を取る
+        self.stimulus_canvas.flush(self.root.update_idletasks)
+
+    def test_finished(self):
+        precision_report = self.precision_session.stop() if self.precision_session is not None else None
+        fatigue_report = None
+        if self.fatigue_monitor is not None:
+            fatigue_report = self.fatigue_monitor.report()
+            self.fatigue_monitor.stop()
         self.root.unbind("<Return>") # Clean up any lingering bindings
-        
-        # Cancel any active timers
-        if self.interval_timer_id: self.root.after_cancel(self.interval_timer_id); self.interval_timer_id = None
-        if self.reaction_window_timer_id: self.root.after_cancel(self.reaction_window_timer_id); self.reaction_window_timer_id = None
-        if self.feedback_clear_timer_id: self.root.after_cancel(self.feedback_clear_timer_id); self.feedback_clear_timer_id = None
+        self.unbind_response_keys()
+        stream_path = self.close_trial_stream()
+        collector_session_key, self.collector_session_key = self.collector_session_key, None
+        # 時間制では試行記録がメモリに無いので、保存ジョブの中でログから読み戻して保存し、終わったら結果画面に反映する
+        # (それまでは retain_trials を False のままにして、反応時間の集計はオンライン統計を使う)。
+        # 試行数制ではメモリ上の試行記録から組み立てる (ログは中断時の復旧用)
+        reload_path = None if self.engine.retain_trials else stream_path
+        self.trial_reload = None
 
         now = datetime.datetime.now()
-        timestamp_str = now.strftime("%Y-%m-%d_%H-%M")
-        base_filename = os.path.join(self.data_dir, timestamp_str) if self.data_dir else timestamp_str
+        self.rt_std_dev_ms = self.engine.rt_summary()[2]
+        has_reaction_times = self.engine.rt_summary()[0] is not None
 
         json_filepath = None
         graph_filepath = None
 
         if self.data_dir: # Proceed only if data_dir is valid
+            # 保存待ちのセッションと同じ名前にならないように予約済みの名前も避ける
+            base_filename = session_base_filename(self.data_dir, now, reserved=self.persistence.reserved())
+            self.session_base_filename = base_filename
             json_filepath = f"{base_filename}.json"
-            self.save_data_to_json(json_filepath, now)
-
-            if MATPLOTLIB_AVAILABLE:
+            if matplotlib_available() and has_reaction_times:
                 graph_filepath = f"{base_filename}.png"
-                self.create_and_save_reaction_time_graph(graph_filepath)
-            else:
+            elif not matplotlib_available():
                 print("Matplotlibが無いためグラフは作成・保存されません。")
+            else:
+                print("反応時間データがないため、グラフは作成されません。")
+            # 状態はここで写し取る (保存中に「もう一度行う」で次のセッションが始まっても影響しない)
+            if reload_path is not None:
+                self.trial_reload = {}
+                build_data = self.session_data_builder(now, precision_report=precision_report, fatigue_report=fatigue_report,
+                                                       stream_path=reload_path)
+                graph_values = GRAPH_FROM_TRIALS if graph_filepath else None
+            else:
+                build_data = self.session_data_builder(now, precision_report=precision_report, fatigue_report=fatigue_report)
+                graph_values = list(self.reaction_times) if graph_filepath else None
+            self.save_job = self.submit_persistence(
+                self.session_save_job(base_filename, build_data, graph_values, collector_session_key, self.trial_reload),
+                on_progress=self._save_progress, on_done=self._save_done, reserved=(base_filename,))
         else:
             print("データディレクトリが存在しないため、JSONとグラフは保存されません。")
+            if collector_session_key is not None: # 収集サーバーが受信済みの試行から組み立てる
+                self.collector_client.send({"type": "session_end", "session_key": collector_session_key})
 
         self.show_results_screen(json_filepath, graph_filepath)
 
-    def save_data_to_json(self, filepath, timestamp_obj):
-        total_correct_responses = self.correct_go_responses + self.correct_no_go_responses
-        accuracy_percent = round((total_correct_responses / self.total_trials_conducted) * 100, 2) if self.total_trials_conducted > 0 else 0.0
-
-        avg_rt = round(statistics.mean(self.reaction_times)) if self.reaction_times else None
-        worst_rt = round(max(self.reaction_times)) if self.reaction_times else None
-        self.rt_std_dev_ms = round(statistics.stdev(self.reaction_times)) if len(self.reaction_times) >= 2 else None
-
-        data_to_save = {
-            "datetime_iso": timestamp_obj.isoformat(),
-            "test_settings": {
-                "target_number": self.target_number,
-                "response_limit_ms": self.response_limit_ms,
-                "feedback_duration_ms": self.feedback_duration_ms,
-                "min_interval_s": self.min_interval_s,
-                "max_interval_s": self.max_interval_s,
-                "configured_max_trials": self.max_trials
-            },
-            "summary_results": {
+    # --- 試行の進行は PVTEngine に委譲 ---
+
+    def run_next_trial(self):
+        self.engine.run_next_trial()
+
+    def select_stimulus(self):
+        return self.engine.select_stimulus()
+
+    def display_stimulus(self):
+        self.engine.display_stimulus()
+
+    def handle_response_button(self, event=None):
+        self.engine.handle_response()
+
+    def handle_timeout(self):
+        self.engine.handle_timeout()
+
+    def clear_feedback_and_proceed(self):
+        self.engine.clear_feedback_and_proceed()
+
+    def end_test(self):
+        self.engine.end_test()
+
+    def session_data_builder(self, timestamp_obj, trials=None, precision_report=None, fatigue_report=None, stream_path=None):
+        # 保存するセッションデータを組み立てる関数を返す。アプリの状態はここ (メインスレッド) で写し取り、
+        # 集計 (NumPy) は返した関数を呼んだスレッドで行う
+        # trials: 試行記録。省略時はメモリ上のカウンタと試行記録を使う
+        # stream_path: 試行記録は返した関数の中で追記ログから読み戻す (時間制)
+        settings = self.test_settings()
+        rt_values = self.engine.rt_summary() # 反応時間の集計は試行中に更新したオンライン統計をそのまま使う
+        counts = None
+        if trials is None and stream_path is None:
+            trials = list(self.all_trial_data)
+            counts = {
                 "total_trials_conducted": self.total_trials_conducted,
                 "correct_go_responses": self.correct_go_responses,
                 "correct_no_go_responses": self.correct_no_go_responses,
                 "commission_errors": self.commission_errors, # Pressed on target
                 "outliers_commission_too_fast": self.commission_outliers, # Pressed too fast
-                "outliers_omission_too_late": self.omission_outliers, # Timed out on non-target
-                "accuracy_percentage": accuracy_percent,
-                "average_reaction_time_ms": avg_rt,
-                "worst_reaction_time_ms": worst_rt,
-                "reaction_time_std_dev_ms": self.rt_std_dev_ms
-            },
-            "trials": self.all_trial_data
-        }
-
+                "outliers_omission_too_late": self.omission_outliers # Timed out on non-target
+            }
+        # 数字ごとの表示切り替え/再描画の時間 (どの数字でも同じになっているかの確認用)
+        render_cost = self.stimulus_canvas.cost_summary() if self.stimulus_canvas is not None else None
+
+        def build():
+            session_trials = read_stream(stream_path)["trials"] if stream_path is not None else trials
+            data = build_session_data(timestamp_obj.isoformat(), settings, session_trials, counts=counts, rt_values=rt_values)
+            if render_cost is not None:
+                data["summary_results"]["stimulus_render_cost"] = render_cost
+            if precision_report is not None:
+                data["summary_results"]["precision_session"] = precision_report
+            if fatigue_report is not None:
+                data["summary_results"]["fatigue"] = fatigue_report
+            return data
+
+        return build
+
+    def save_data_to_json(self, filepath, timestamp_obj, trials=None, precision_report=None):
+        # 同期版 (その場で組み立てて書き込む)
+        data_to_save = self.session_data_builder(timestamp_obj, trials, precision_report)()
+        self.rt_std_dev_ms = data_to_save["summary_results"]["reaction_time_std_dev_ms"]
+        return self.write_session_data(filepath, data_to_save)
+
+    def write_session_data(self, filepath, data_to_save):
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data_to_save, f, ensure_ascii=False, indent=4)
+            write_session_json(filepath, data_to_save)
             print(f"データが {filepath} に保存されました。")
+            return data_to_save
         except Exception as e:
             # messagebox.showerror("JSON保存エラー", f"JSONファイルへの書き込み中にエラーが発生しました: {e}")
             print(f"JSON保存エラー: {e}")
 
-    def create_and_save_reaction_time_graph(self, filepath):
-        if not MATPLOTLIB_AVAILABLE or not self.reaction_times:
-            if not self.reaction_times:
-                print("反応時間データがないため、グラフは作成されません。")
+    def session_save_job(self, base_filename, build_data, graph_values=None, collector_session_key=None, built=None):
+        # ワーカースレッドで実行する保存処理 (Tk には触らない)。戻り値: 失敗した項目のリスト
+        # graph_values: GRAPH_FROM_TRIALS なら組み立てたデータの試行記録からグラフを作る
+        # built: 組み立てたセッションデータを "data" に入れて返す dict (メインスレッドは完了後に読む)
+        save_compact = self.save_compact
+        collector_client = self.collector_client
+
+        def run(progress):
+            failed = []
+            json_filepath = f"{base_filename}.json"
+            progress("JSON")
+            data = build_data()
+            if built is not None:
+                built["data"] = data
+            saved_data = self.write_session_data(json_filepath, data)
+            if saved_data is None:
+                failed.append("JSON")
+            if collector_session_key is not None: # 保存できなければ収集サーバーが受信済みの試行から組み立てる
+                collector_client.send({"type": "session_end", "session_key": collector_session_key, "data": saved_data})
+            if saved_data is not None:
+                progress("セッションストア")
+                if not self.index_session(json_filepath, saved_data):
+                    failed.append("セッションストア")
+                if save_compact:
+                    progress("コンパクト形式")
+                    if not self.save_compact_session(base_filename, saved_data):
+                        failed.append("コンパクト形式")
+            if graph_values is not None:
+                progress("グラフ")
+                values = graph_values
+                if values == GRAPH_FROM_TRIALS:
+                    values = [t["reaction_time_ms"] for t in data["trials"] if t["reaction_time_ms"] is not None]
+                if not self.save_reaction_time_graph(values, f"{base_filename}.png"):
+                    failed.append("グラフ")
+            return failed
+
+        return run
+
+    def submit_persistence(self, run, on_progress=None, on_done=None, reserved=()):
+        job = self.persistence.submit(run, on_progress=on_progress, on_done=on_done, reserved=reserved)
+        if self.persistence_poll_id is None:
+            self.persistence_poll_id = self.root.after(self.persistence_poll_ms, self._poll_persistence)
+        return job
+
+    def _poll_persistence(self):
+        # ワーカーからの進捗/完了をメインスレッドで受け取る
+        self.persistence_poll_id = None
+        self.persistence.drain()
+        if self.persistence.pending() or self.persistence.has_events():
+            self.persistence_poll_id = self.root.after(self.persistence_poll_ms, self._poll_persistence)
+
+    def save_status_text(self, job):
+        if job.error is not None:
+            return f"保存エラー: {job.error}"
+        if job.finished.is_set():
+            return "保存しました。" if not job.result else f"保存できなかった項目: {', '.join(job.result)}"
+        return f"保存中… ({job.progress_message})" if job.progress_message else "保存待ち…"
+
+    def _save_progress(self, job, message):
+        if job is self.save_job and self.save_status_label is not None:
+            self.save_status_label.config(text=self.save_status_text(job))
+
+    def _save_done(self, job):
+        if job.error is not None:
+            print(f"保存エラー: {job.error}")
+        if job is self.save_job and self.trial_reload is not None:
+            self.apply_reloaded_trials()
+        if job is self.save_job and self.save_status_label is not None:
+            self.save_status_label.config(text=self.save_status_text(job))
+
+    def apply_reloaded_trials(self):
+        # 時間制: 保存ジョブが読み戻した試行記録を結果画面に反映する (次のセッションが始まっていれば捨てる)
+        data = self.trial_reload.get("data")
+        self.trial_reload = None
+        if data is None or self.results_frame is None:
             return
+        self.all_trial_data = data["trials"]
+        self.reaction_times = [t["reaction_time_ms"] for t in self.all_trial_data if t["reaction_time_ms"] is not None]
+        self.engine.retain_trials = True
+        self.show_results_screen(*self.results_filepaths)
+
+    def open_session_store(self):
+        # ストアが初めて作られるときは既存のJSONもまとめて取り込む。戻り値: (store, 新規作成したか)
+        db_path = os.path.join(self.data_dir, STORE_FILENAME)
+        is_new_store = not os.path.exists(db_path)
+        store = SessionStore(db_path)
+        if is_new_store:
+            store.import_json_dir(self.data_dir)
+        return store, is_new_store
+
+    def index_session(self, json_filepath, data):
+        # セッションを SQLite ストアにも登録する (履歴画面の集計もここで1セッション分だけ更新される)
+        try:
+            store, is_new_store = self.open_session_store()
+            with store:
+                if not is_new_store:
+                    store.add_session(data, json_filepath)
+            return True
+        except Exception as e:
+            print(f"セッションストアの更新エラー: {e}")
+            return False
 
+    def show_history_window(self):
+        # 日ごとの中央反応時間・ラプス・正答率の推移。ストアの集計列だけを読む
+        if not self.data_dir:
+            return None
         try:
-            plt.figure(figsize=(8, 4))
-            # Plot only RTs from correct Go trials (where RT is meaningful for performance)
-            # For GNG, RTs are typically from correct Go responses.
-            # The self.reaction_times list currently stores RTs from *all* button presses.
-            # Filter for correct Go responses if needed, or plot all recorded RTs.
-            # Assuming self.reaction_times contains RTs primarily from intended Go responses (or all presses).
-            
-            # If you want to plot RTs only from correct Go responses:
-            # correct_go_rts = [t['reaction_time_ms'] for t in self.all_trial_data if t['is_target'] == 0 and t['is_correct'] == 1 and t['reaction_time_ms'] is not None]
-            # if not correct_go_rts:
-            #     print("正反応のRTデータがないため、グラフは作成されません。")
-            #     plt.close() # Close the figure if not used
-            #     return
-            # plt.plot(range(1, len(correct_go_rts) + 1), correct_go_rts, marker='o', linestyle='-')
-            # plt.title("Reaction Time Over Correct Go Trials")
-            # plt.xlabel("Correct Go Response Number")
-
-            # Current implementation plots all recorded self.reaction_times:
-            plt.plot(range(1, len(self.reaction_times) + 1), self.reaction_times, marker='o', linestyle='-')
-            plt.title("Reaction Time Over Trials (Button Presses)")
-            plt.xlabel("Button Press Number")
-
-            plt.ylabel("Reaction Time (ms)")
-            plt.grid(True)
-            plt.tight_layout()
-            plt.savefig(filepath)
-            plt.close() # Close the figure to free memory
+            store, _ = self.open_session_store()
+            with store:
+                days = store.daily_trends()
+        except Exception as e:
+            print(f"履歴の読み込みエラー: {e}")
+            return None
+
+        window = tk.Toplevel(self.root)
+        window.title("GNG-PVT 履歴")
+        if not days:
+            ttk.Label(window, text="保存されたセッションがありません。", font=self.text_font).pack(padx=20, pady=20)
+            return window
+        period = f"{days[0]['session_date']} 〜 {days[-1]['session_date']} ({len(days)} 日)"
+        ttk.Label(window, text=period, font=self.text_font).pack(pady=5)
+        for key, title, ylabel in (("median_rt_ms", "Daily Median RT", "Median RT (ms)"),
+                                   ("lapses", "Daily Lapses", "Lapses"),
+                                   ("accuracy_percentage", "Daily Accuracy", "Accuracy (%)")):
+            values = [day[key] for day in days if day[key] is not None]
+            if not values:
+                continue
+            canvas = tk.Canvas(window, width=self.history_graph_width, height=self.graph_height,
+                               background="white", highlightthickness=0)
+            canvas.pack(padx=10, pady=5)
+            draw_line_plot(canvas, values, self.history_graph_width, self.graph_height,
+                           title=title, xlabel="Day", ylabel=ylabel)
+        ttk.Button(window, text="閉じる", command=window.destroy).pack(pady=10)
+        return window
+
+    def save_compact_session(self, base_filename, data):
+        try:
+            from pvt_compact import ARRAY_SUFFIX, session_to_compact
+            session_to_compact(data, base_filename)
+            print(f"コンパクト形式のデータが {base_filename}{ARRAY_SUFFIX} に保存されました。")
+            return True
+        except Exception as e:
+            print(f"コンパクト形式の保存エラー: {e}")
+            return False
+
+    def save_profile(self, profiler):
+        # end_test を抜けた後に呼ばれる (保存処理も含めた end_test の時間を記録に含めるため)
+        if self.session_base_filename is None:
+            return
+        profile_path = self.session_base_filename + PROFILE_SUFFIX
+        profile = profiler.profile()
+
+        def run(progress):
+            try:
+                write_profile(profile_path, profile)
+                print(f"プロファイルが {profile_path} に保存されました。")
+            except OSError as e:
+                print(f"プロファイル保存エラー: {e}")
+
+        self.submit_persistence(run)
+
+    def save_reaction_time_graph(self, values, filepath):
+        # Current implementation plots all recorded reaction times (button presses).
+        # 保存ワーカーから呼ばれる (Figure は使い回し)
+        try:
+            self.graph_exporter.export(values, filepath)
             print(f"グラフが {filepath} に保存されました。")
+            return True
         except Exception as e:
             # messagebox.showerror("グラフ作成エラー", f"グラフの作成または保存中にエラーが発生しました: {e}")
             print(f"グラフ作成エラー: {e}")
+            return False
 
     def show_results_screen(self, data_filepath=None, graph_filepath=None):
         self.clear_current_frame()
+        self.results_filepaths = (data_filepath, graph_filepath)
+        reloading = self.trial_reload is not None # 時間制で試行記録を読み戻している間は試行中のオンライン統計で表示する
         self.results_frame = ttk.Frame(self.root, padding="10")
         self.results_frame.pack(expand=True, fill=tk.BOTH)
 
@@ -494,19 +826,29 @@ class PVTApp:
         avg_rt_str = "N/A"; worst_rt_str = "N/A"; rt_std_dev_str = "N/A"
         # Use reaction_times from correct Go trials for meaningful stats, if desired
         # For now, using all recorded RTs as per save_data_to_json
-        if self.reaction_times:
-            avg_rt_val = round(statistics.mean(self.reaction_times))
-            worst_rt_val = round(max(self.reaction_times))
+        # (時間制で読み戻し中でも試行中のオンライン統計にある)
+        avg_rt_val, worst_rt_val, std_dev_val = self.engine.rt_summary()
+        if avg_rt_val is not None:
             avg_rt_str = f"{avg_rt_val} ms"
             worst_rt_str = f"{worst_rt_val} ms"
             
             # self.rt_std_dev_ms should be calculated in end_test/save_data_to_json
             if self.rt_std_dev_ms is not None:
                 rt_std_dev_str = f"{self.rt_std_dev_ms} ms"
-            elif len(self.reaction_times) >= 2: # Fallback if not pre-calculated
-                rt_std_dev_str = f"{round(statistics.stdev(self.reaction_times))} ms"
+            elif std_dev_val is not None: # Fallback if not pre-calculated
+                rt_std_dev_str = f"{std_dev_val} ms"
             else:
                 rt_std_dev_str = "N/A (データ不足)"
+
+        # 正反応 (Go) のRTだけを使った標準指標
+        from pvt_analytics import summarize_trials
+        if reloading:
+            live = self.engine.live_metrics()
+            metrics = {"median_rt_ms": live["median_go_rt_ms"], "lapses": live["lapses"], "d_prime": None}
+        else:
+            metrics = summarize_trials(self.all_trial_data)
+        median_rt_str = f"{round(metrics['median_rt_ms'])} ms" if metrics['median_rt_ms'] is not None else "N/A"
+        d_prime_str = f"{metrics['d_prime']:.2f}" if metrics['d_prime'] is not None else "N/A"
         
         results_text = (
             f"総試行数: {self.total_trials_conducted}\n\n"
@@ -517,36 +859,41 @@ class PVTApp:
             f"外れ値 (遅すぎ/見逃し): {self.omission_outliers}\n\n"
             f"平均反応時間 : {avg_rt_str}\n"
             f"最悪反応時間 : {worst_rt_str}\n"
-            f"反応時間標準偏差: {rt_std_dev_str}\n"
+            f"反応時間標準偏差: {rt_std_dev_str}\n\n"
+            f"中央反応時間 (正反応): {median_rt_str}\n"
+            f"ラプス (>500ms/見逃し): {metrics['lapses']}\n"
+            f"d′: {d_prime_str}\n"
         )
+        if self.fatigue_monitor is not None:
+            alerts = self.fatigue_monitor.alerts
+            first_str = f" (最初: 試行 {alerts[0]['trial_number']})" if alerts else ""
+            results_text += f"疲労アラート: {self.fatigue_monitor.alert_count} 件{first_str}\n"
+
         ttk.Label(main_results_frame, text=results_text, font=self.text_font, justify=tk.LEFT).pack(pady=10, anchor='nw')
 
         if data_filepath:
             ttk.Label(main_results_frame, text=f"データ保存先: {os.path.abspath(data_filepath)}", font=self.small_text_font).pack(pady=5, anchor='nw')
         
-        if graph_filepath and PILLOW_AVAILABLE and MATPLOTLIB_AVAILABLE and os.path.exists(graph_filepath):
+        if graph_filepath:
             ttk.Label(main_results_frame, text=f"グラフ保存先: {os.path.abspath(graph_filepath)}", font=self.small_text_font).pack(pady=5, anchor='nw')
+
+        if data_filepath and self.save_job is not None:
+            self.save_status_label = ttk.Label(main_results_frame, text=self.save_status_text(self.save_job), font=self.small_text_font)
+            self.save_status_label.pack(pady=5, anchor='nw')
+
+        if reloading:
+            ttk.Label(graph_display_frame, text="試行記録を読み込んでいます…", font=self.text_font, justify=tk.CENTER).pack(pady=10, expand=True, anchor=tk.CENTER)
+        elif self.reaction_times:
+            self.graph_canvas = tk.Canvas(graph_display_frame, width=self.graph_width, height=self.graph_height,
+                                          background="white", highlightthickness=0)
+            self.graph_canvas.pack(pady=10, expand=True, anchor=tk.CENTER) # Center graph
             try:
-                img = Image.open(graph_filepath)
-                basewidth = 400 # Desired width for the graph display
-                wpercent = (basewidth / float(img.size[0]))
-                hsize = int((float(img.size[1]) * float(wpercent)))
-                img_resized = img.resize((basewidth, hsize), Image.LANCZOS if hasattr(Image, 'LANCZOS') else Image.Resampling.LANCZOS)
-                self.graph_image_tk = ImageTk.PhotoImage(img_resized)
-                
-                if self.graph_label and self.graph_label.winfo_exists():
-                    self.graph_label.config(image=self.graph_image_tk)
-                else:
-                    self.graph_label = ttk.Label(graph_display_frame, image=self.graph_image_tk)
-                    self.graph_label.pack(pady=10, expand=True, anchor=tk.CENTER) # Center graph
+                draw_line_plot(self.graph_canvas, self.reaction_times, self.graph_width, self.graph_height)
             except Exception as e:
-                print(f"グラフ画像の表示エラー: {e}")
+                print(f"グラフの表示エラー: {e}")
                 ttk.Label(graph_display_frame, text="グラフの表示に失敗しました。", font=self.text_font).pack(pady=10, expand=True, anchor=tk.CENTER)
-        elif MATPLOTLIB_AVAILABLE and (not self.reaction_times or not graph_filepath or not os.path.exists(graph_filepath)):
-             ttk.Label(graph_display_frame, text="反応時間データがないかグラフファイルが\n見つからないため表示されません。", font=self.text_font, justify=tk.CENTER).pack(pady=10, expand=True, anchor=tk.CENTER)
-        elif not PILLOW_AVAILABLE or not MATPLOTLIB_AVAILABLE:
-             ttk.Label(graph_display_frame, text="グラフ表示に必要なライブラリが\nないため表示できません。", font=self.text_font, justify=tk.CENTER).pack(pady=10, expand=True, anchor=tk.CENTER)
-
+        else:
+            ttk.Label(graph_display_frame, text="反応時間データがないため\nグラフは表示されません。", font=self.text_font, justify=tk.CENTER).pack(pady=10, expand=True, anchor=tk.CENTER)
 
         button_frame = ttk.Frame(main_results_frame)
         button_frame.pack(pady=20, anchor='s') # Anchor south for bottom placement
@@ -554,6 +901,9 @@ class PVTApp:
         restart_button = ttk.Button(button_frame, text="もう一度行う", command=self.show_start_screen, style="TButton")
         restart_button.pack(side=tk.LEFT, padx=10)
         
+        history_button = ttk.Button(button_frame, text="履歴を見る", command=self.show_history_window, style="TButton")
+        history_button.pack(side=tk.LEFT, padx=10)
+
         quit_button = ttk.Button(button_frame, text="終了する", command=self.quit_app, style="TButton")
         quit_button.pack(side=tk.LEFT, padx=10)
 
@@ -574,9 +924,13 @@ class PVTApp:
 
     def _cleanup_timers_and_quit(self):
         # Ensure all timers are cancelled before quitting
-        if self.interval_timer_id: self.root.after_cancel(self.interval_timer_id); self.interval_timer_id = None
-        if self.reaction_window_timer_id: self.root.after_cancel(self.reaction_window_timer_id); self.reaction_window_timer_id = None
-        if self.feedback_clear_timer_id: self.root.after_cancel(self.feedback_clear_timer_id); self.feedback_clear_timer_id = None
+        self.engine.cancel_timers()
+        if self.persistence_poll_id is not None:
+            self.root.after_cancel(self.persistence_poll_id)
+            self.persistence_poll_id = None
+        self.persistence.close() # 保存待ちのセッションは書き終えてから終了する
+        if self.collector_client is not None:
+            self.collector_client.close(timeout=5)
         
         if self.root and self.root.winfo_exists(): # Check if root window still exists
             self.root.quit()
@@ -584,11 +938,21 @@ class PVTApp:
 
 
 if __name__ == "__main__":
-    if not MATPLOTLIB_AVAILABLE:
-        print("--- Matplotlibが利用できないため、グラフ関連機能は動作しません。 ---")
-    if not PILLOW_AVAILABLE:
-        print("--- Pillowが利用できないため、グラフ表示機能は動作しません。 ---")
-        
+    parser = argparse.ArgumentParser(description="GNG-PVT")
+    parser.add_argument("--profile", action="store_true",
+                        help="ハンドラの処理時間とイベントループの遅れを計測して <保存名>.profile に書き出す")
+    parser.add_argument("--collector", help="試行とセッションを送る収集サーバーの URL (例: http://192.168.0.10:8765)")
+    parser.add_argument("--station", help="収集サーバーでのこの端末の名前 (既定: ホスト名)")
+    parser.add_argument("--fatigue-monitor", action="store_true", help="セッション中の疲労 (パフォーマンス低下) を検出してアラートを記録する")
+    parser.add_argument("--correct-dispatch-latency", action="store_true",
+                        help="キー入力のディスパッチ遅延 (推定値) を反応時間から差し引く (test_settings に記録する)")
+    args = parser.parse_args()
     root = tk.Tk()
     app = PVTApp(root)
+    app.profile_handlers = args.profile
+    app.collector_url = args.collector
+    app.fatigue_monitoring = args.fatigue_monitor
+    app.correct_dispatch_latency = args.correct_dispatch_latency
+    if args.station:
+        app.station_id = args.station
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,204 @@
+# pvt_analytics.py
+# 試行データを列ごとの NumPy 配列に展開し、PVT/GNG の標準指標を全セッション分まとめてベクトル計算する。
+# 反応時間系の指標は正反応 (Go試行で早すぎない反応) のRTだけを対象にする。
+
+import numpy as np
+
+from pvt_stats import LAPSE_THRESHOLD_MS
+
+EXTREME_FRACTION = 0.1 # fastest/slowest 10%
+
+
+class TrialColumns:
+    # 全セッションの試行を連結した列データ。session_index で元のセッションを識別する
+    def __init__(self, session_index, trial_number, isi_ms, stimulus, is_target, is_correct, rt_ms, n_sessions):
+        self.session_index = session_index
+        self.trial_number = trial_number
+        self.isi_ms = isi_ms
+        self.stimulus = stimulus
+        self.is_target = is_target
+        self.is_correct = is_correct
+        self.rt_ms = rt_ms # 無反応は NaN
+        self.n_sessions = n_sessions
+
+    def __len__(self):
+        return len(self.rt_ms)
+
+    @classmethod
+    def from_trials(cls, trials):
+        return cls.from_sessions([trials])
+
+    @classmethod
+    def from_trial_arrays(cls, arrays):
+        # pvt_compact の構造化配列 (メモリマップ可) のリストから。試行の dict を作らずに列を連結する
+        lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+
+        def column(name, dtype):
+            if not arrays:
+                return np.empty(0, dtype=dtype)
+            return np.concatenate([np.asarray(a[name], dtype=dtype) for a in arrays])
+
+        return cls(
+            session_index=np.repeat(np.arange(len(arrays), dtype=np.int64), lengths),
+            trial_number=column("trial_number", np.int64),
+            isi_ms=column("pre_stimulus_interval_ms", np.float64),
+            stimulus=column("stimulus", np.int8),
+            is_target=column("is_target", bool),
+            is_correct=column("is_correct", bool),
+            rt_ms=column("reaction_time_ms", np.float64),
+            n_sessions=len(arrays)
+        )
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        # sessions: 試行リスト、またはセッションJSON (dict, "trials" を含む) のリスト
+        trial_lists = [s["trials"] if isinstance(s, dict) else s for s in sessions]
+        lengths = np.fromiter((len(t) for t in trial_lists), dtype=np.int64, count=len(trial_lists))
+        flat = [trial for trials in trial_lists for trial in trials]
+        n = len(flat)
+        return cls(
+            session_index=np.repeat(np.arange(len(trial_lists), dtype=np.int64), lengths),
+            trial_number=np.fromiter((t["trial_number"] for t in flat), dtype=np.int64, count=n),
+            isi_ms=np.fromiter((np.nan if t["pre_stimulus_interval_ms"] is None else t["pre_stimulus_interval_ms"] for t in flat), dtype=np.float64, count=n),
+            stimulus=np.fromiter((t["stimulus"] for t in flat), dtype=np.int8, count=n),
+            is_target=np.fromiter((t["is_target"] for t in flat), dtype=bool, count=n),
+            is_correct=np.fromiter((t["is_correct"] for t in flat), dtype=bool, count=n),
+            rt_ms=np.fromiter((np.nan if t["reaction_time_ms"] is None else t["reaction_time_ms"] for t in flat), dtype=np.float64, count=n),
+            n_sessions=len(trial_lists)
+        )
+
+
+def norm_ppf(p):
+    # 標準正規分布の逆関数 (Acklam の有理近似, 相対誤差 < 1.2e-9)。scipy に依存しないため
+    a = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549732539343734e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00, 3.754408661907416e+00)
+
+    p = np.asarray(p, dtype=np.float64)
+    result = np.full(p.shape, np.nan)
+    p_low = 0.02425
+
+    low = (p > 0) & (p < p_low)
+    q = np.sqrt(-2 * np.log(p[low]))
+    result[low] = (((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+
+    central = (p >= p_low) & (p <= 1 - p_low)
+    q = p[central] - 0.5
+    r = q * q
+    result[central] = (((((a[0]*r + a[1])*r + a[2])*r + a[3])*r + a[4])*r + a[5])*q / (((((b[0]*r + b[1])*r + b[2])*r + b[3])*r + b[4])*r + 1)
+
+    high = (p > 1 - p_low) & (p < 1)
+    q = np.sqrt(-2 * np.log(1 - p[high]))
+    result[high] = -(((((c[0]*q + c[1])*q + c[2])*q + c[3])*q + c[4])*q + c[5]) / ((((d[0]*q + d[1])*q + d[2])*q + d[3])*q + 1)
+    return result
+
+
+def _grouped_mean(values, groups, n_groups):
+    counts = np.bincount(groups, minlength=n_groups)
+    sums = np.bincount(groups, weights=values, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan), counts
+
+
+def session_metrics(columns, lapse_threshold_ms=LAPSE_THRESHOLD_MS):
+    # 戻り値: 指標名 -> 長さ n_sessions の配列
+    n = columns.n_sessions
+    session = columns.session_index
+    rt = columns.rt_ms
+    responded = ~np.isnan(rt)
+    is_go = ~columns.is_target
+    valid = is_go & responded & columns.is_correct # 正反応のRT
+
+    go_trials = np.bincount(session, weights=is_go, minlength=n)
+    nogo_trials = np.bincount(session, weights=columns.is_target, minlength=n)
+    hits = np.bincount(session, weights=valid, minlength=n)
+    false_alarms = np.bincount(session, weights=columns.is_target & responded, minlength=n)
+    omissions = np.bincount(session, weights=is_go & ~responded, minlength=n)
+    anticipations = np.bincount(session, weights=responded & ~columns.is_correct & is_go, minlength=n)
+    slow = np.bincount(session, weights=valid & (rt > lapse_threshold_ms), minlength=n)
+
+    # セッション内でRTを昇順に並べ、各セッションの開始位置から中央値と上下10%を取る
+    valid_session = session[valid]
+    valid_rt = rt[valid]
+    order = np.lexsort((valid_rt, valid_session))
+    sorted_rt = valid_rt[order]
+    sorted_session = valid_session[order]
+    counts = np.bincount(valid_session, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    has_rt = counts > 0
+
+    median_rt = np.full(n, np.nan)
+    lower = starts[has_rt] + (counts[has_rt] - 1) // 2
+    upper = starts[has_rt] + counts[has_rt] // 2
+    median_rt[has_rt] = (sorted_rt[lower] + sorted_rt[upper]) / 2
+
+    rank = np.arange(len(sorted_rt)) - starts[sorted_session]
+    k = np.maximum(1, np.round(counts * EXTREME_FRACTION)).astype(np.int64)
+    fastest = rank < k[sorted_session]
+    slowest = rank >= (counts - k)[sorted_session]
+    fastest_10_rt, _ = _grouped_mean(sorted_rt[fastest], sorted_session[fastest], n)
+    slowest_10_reciprocal, _ = _grouped_mean(1000 / sorted_rt[slowest], sorted_session[slowest], n)
+    mean_rt, _ = _grouped_mean(valid_rt, valid_session, n)
+    mean_reciprocal, _ = _grouped_mean(1000 / valid_rt, valid_session, n)
+
+    # 信号検出: Hit = Go試行での正反応, FA = NoGo試行での反応。log-linear 補正で 0/1 を避ける
+    hit_rate = (hits + 0.5) / (go_trials + 1)
+    fa_rate_corrected = (false_alarms + 0.5) / (nogo_trials + 1)
+    d_prime = norm_ppf(hit_rate) - norm_ppf(fa_rate_corrected)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        false_alarm_rate = np.where(nogo_trials > 0, false_alarms / np.maximum(nogo_trials, 1), np.nan)
+
+    # Post-error slowing: 誤り直後の正反応RT平均 - 正答直後の正反応RT平均 (同一セッション内)
+    same_session_prev = np.zeros(len(rt), dtype=bool)
+    same_session_prev[1:] = session[1:] == session[:-1]
+    prev_correct = np.zeros(len(rt), dtype=bool)
+    prev_correct[1:] = columns.is_correct[:-1]
+    after_error = valid & same_session_prev & ~prev_correct
+    after_correct = valid & same_session_prev & prev_correct
+    rt_after_error, _ = _grouped_mean(rt[after_error], session[after_error], n)
+    rt_after_correct, _ = _grouped_mean(rt[after_correct], session[after_correct], n)
+
+    return {
+        "go_trials": go_trials.astype(np.int64),
+        "nogo_trials": nogo_trials.astype(np.int64),
+        "valid_go_responses": hits.astype(np.int64),
+        "mean_rt_ms": mean_rt,
+        "median_rt_ms": median_rt,
+        "mean_reciprocal_rt": mean_reciprocal, # 1/s
+        "fastest_10pct_rt_ms": fastest_10_rt,
+        "slowest_10pct_reciprocal_rt": slowest_10_reciprocal, # 1/s
+        "lapses": (slow + omissions).astype(np.int64), # RT > 500ms と Go試行の見逃し
+        "omissions": omissions.astype(np.int64),
+        "anticipations": anticipations.astype(np.int64),
+        "false_alarm_rate": false_alarm_rate,
+        "d_prime": d_prime,
+        "post_error_slowing_ms": rt_after_error - rt_after_correct
+    }
+
+
+def _json_value(value):
+    if isinstance(value, (np.integer, int)):
+        return int(value)
+    value = float(value)
+    return None if np.isnan(value) else round(value, 3)
+
+
+def summarize_trials(trials, lapse_threshold_ms=LAPSE_THRESHOLD_MS):
+    # 1セッション分の指標を JSON に書ける値 (NaN -> None) で返す
+    metrics = session_metrics(TrialColumns.from_trials(trials), lapse_threshold_ms)
+    return {name: _json_value(values[0]) for name, values in metrics.items()}
+
+
+def rt_summary(reaction_times):
+    # 既存の summary_results / 結果画面の 平均・最悪・標準偏差 (ms, 整数に丸め)
+    if not reaction_times:
+        return None, None, None
+    rts = np.asarray(reaction_times, dtype=np.float64)
+    avg_rt = round(float(rts.mean()))
+    worst_rt = round(float(rts.max()))
+    std_dev = round(float(rts.std(ddof=1))) if len(rts) >= 2 else None
+    return avg_rt, worst_rt, std_dev
@@ -0,0 +1,178 @@
+# pvt_batch.py
+# 複数参加者の recoded_data を一括で再解析する CLI。ディレクトリツリーからセッションJSONを集め、
+# summary_results と拡張指標をプロセスプールで再計算して、1つの列形式ファイル (NPZ) にまとめる。
+# 内容のハッシュが前回と同じファイルはキャッシュの結果を使い、読み直さない。
+# 使い方: python pvt_batch.py ROOT [ROOT ...] -o analysis.npz [-j プロセス数] [--force]
+
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pvt_session import build_session_data
+
+ANALYSIS_VERSION = 1 # 指標の定義を変えたら上げる (キャッシュが無効になる)
+CACHE_SUFFIX = ".cache.json"
+# 古いJSONには記録されていない設定 (当時の既定値)
+LEGACY_SETTINGS = {"response_limit_ms": 1500, "response_outlier_ms": 100, "feedback_duration_ms": 1000}
+
+SUMMARY_FIELDS = (
+    "total_trials_conducted", "correct_go_responses", "correct_no_go_responses", "commission_errors",
+    "outliers_commission_too_fast", "outliers_omission_too_late", "accuracy_percentage",
+    "average_reaction_time_ms", "worst_reaction_time_ms", "reaction_time_std_dev_ms"
+)
+EXTENDED_FIELDS = (
+    "go_trials", "nogo_trials", "valid_go_responses", "mean_rt_ms", "median_rt_ms", "mean_reciprocal_rt",
+    "fastest_10pct_rt_ms", "slowest_10pct_reciprocal_rt", "lapses", "omissions", "anticipations",
+    "false_alarm_rate", "d_prime", "post_error_slowing_ms"
+)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_session_files(roots):
+    # 戻り値: (参加者ID, パス) のリスト。参加者IDは ROOT 直下のディレクトリ名 (直下のファイルは ROOT の名前)
+    found = []
+    for root in roots:
+        root = os.path.abspath(root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            relative = os.path.relpath(dirpath, root)
+            participant = os.path.basename(root) if relative == "." else relative.split(os.sep)[0]
+            for name in sorted(filenames):
+                if name.endswith(".json") and not name.endswith(CACHE_SUFFIX):
+                    found.append((participant, os.path.join(dirpath, name)))
+    return found
+
+
+def analyze_file(path):
+    # ワーカープロセスで実行する。戻り値: (パス, ハッシュ, 行 dict, エラー) / 解析できなければ行は None
+    # (読めなければハッシュも None。一覧の後に消えたファイルなどで一括処理全体を止めない)
+    sha256 = None
+    try:
+        sha256 = file_sha256(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        settings = {**LEGACY_SETTINGS, **data.get("test_settings", {})}
+        session = build_session_data(data["datetime_iso"], settings, data["trials"])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return path, sha256, None, f"{type(e).__name__}: {e}"
+    summary = session["summary_results"]
+    row = {
+        "datetime_iso": data["datetime_iso"],
+        "target_number": settings.get("target_number"),
+        **{field: summary[field] for field in SUMMARY_FIELDS},
+        **{field: summary["extended_metrics"][field] for field in EXTENDED_FIELDS}
+    }
+    return path, sha256, row, None
+
+
+def load_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache["files"] if cache.get("analysis_version") == ANALYSIS_VERSION else {}
+
+
+def save_cache(cache_path, files):
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"analysis_version": ANALYSIS_VERSION, "files": files}, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+
+def to_columns(rows):
+    # 行 dict のリストを NPZ に書ける列配列にする。None は数値列では NaN
+    columns = {
+        "participant": np.array([r["participant"] for r in rows], dtype=str),
+        "source_path": np.array([r["source_path"] for r in rows], dtype=str),
+        "datetime_iso": np.array([r["datetime_iso"] for r in rows], dtype=str)
+    }
+    for field in ("target_number",) + SUMMARY_FIELDS + EXTENDED_FIELDS:
+        columns[field] = np.array([np.nan if r[field] is None else r[field] for r in rows], dtype=np.float64)
+    return columns
+
+
+def run_batch(roots, output_path, jobs=None, force=False):
+    cache_path = output_path + CACHE_SUFFIX
+    cached = {} if force else load_cache(cache_path)
+    files = find_session_files(roots)
+
+    results = {}
+    stale = []
+    errors = {}
+    for participant, path in files:
+        entry = cached.get(path)
+        if entry is None:
+            stale.append(path)
+            continue
+        try:
+            sha256 = file_sha256(path)
+        except OSError as e:
+            errors[path] = f"{type(e).__name__}: {e}"
+            print(f"解析できませんでした: {path}: {errors[path]}")
+            continue
+        if entry["sha256"] == sha256:
+            results[path] = entry
+        else:
+            stale.append(path)
+    cached_count = len(results)
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunksize = max(1, len(stale) // ((jobs or os.cpu_count() or 1) * 4))
+            for path, sha256, row, error in pool.map(analyze_file, stale, chunksize=chunksize):
+                if row is None:
+                    errors[path] = error
+                    print(f"解析できませんでした: {path}: {error}")
+                    continue
+                results[path] = {"sha256": sha256, "row": row}
+
+    rows = []
+    for participant, path in files:
+        if path in results:
+            rows.append({"participant": participant, "source_path": path, **results[path]["row"]})
+    rows.sort(key=lambda r: (r["participant"], r["datetime_iso"]))
+    # NPZ を一時ファイルに書いて置き換えてから、キャッシュを保存する (途中で止まっても、壊れた NPZ と
+    # 「全て最新」のキャッシュが組で残らないように)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **to_columns(rows))
+    os.replace(tmp_path, output_path)
+    save_cache(cache_path, results)
+    return {"files": len(files), "analyzed": len(results) - cached_count, "cached": cached_count,
+            "failed": len(errors), "sessions": len(rows)}
+
+
+def load_batch(output_path):
+    with np.load(output_path) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="セッションJSONのツリーを一括再解析して NPZ にまとめる")
+    parser.add_argument("roots", nargs="+", help="参加者ごとのディレクトリを含むルート")
+    parser.add_argument("-o", "--output", default="analysis.npz")
+    parser.add_argument("-j", "--jobs", type=int, help="ワーカープロセス数 (既定: CPU数)")
+    parser.add_argument("--force", action="store_true", help="キャッシュを使わずに全ファイルを再解析する")
+    args = parser.parse_args(argv)
+
+    stats = run_batch(args.roots, args.output, args.jobs, args.force)
+    print(f"{stats['sessions']} 件のセッションを {args.output} に書き出しました "
+          f"(再解析 {stats['analyzed']} 件, キャッシュ {stats['cached']} 件, 失敗 {stats['failed']} 件)。")
+    return stats
+
+
+if __name__ == "__main__":
+    main()
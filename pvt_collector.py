@@ -0,0 +1,414 @@
+# pvt_collector.py
+# 複数の計測端末 (station) からセッションを集める収集サーバーと、PVTApp から使う送信クライアント。
+# 端末は試行ログ (pvt_stream) と同じ種類のレコード (session_start / trial / trial_update / session_end) を
+# まとめて POST し、サーバーは1つの SQLite ストア (pvt_store) に端末名付きで登録する。
+# 同じレコードを再送しても結果は変わらない (通信エラー時はクライアントが再送する)。
+# 使い方:
+#   python pvt_collector.py serve [--db collector.sqlite3] [--host 127.0.0.1] [--port 8765]
+#   python gng_pvt.py --collector http://127.0.0.1:8765 [--station lab-1]
+# 集計の参照: GET /stations, /sessions?station=&start=&end=, /aggregates?by=station|date, /live
+
+import argparse
+import collections
+import json
+import queue
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pvt_session import build_session_data
+from pvt_store import SessionStore
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 8 * 1024 * 1024
+RECORD_TYPES = ("session_start", "trial", "trial_update", "session_end")
+
+COLLECTOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS station_sessions (
+    station TEXT NOT NULL,
+    session_key TEXT NOT NULL,
+    datetime_iso TEXT,
+    test_settings_json TEXT,
+    status TEXT NOT NULL,
+    last_received REAL,
+    session_id INTEGER REFERENCES sessions(id) ON DELETE SET NULL,
+    PRIMARY KEY (station, session_key)
+);
+CREATE INDEX IF NOT EXISTS idx_station_sessions_status ON station_sessions(status, last_received);
+
+CREATE TABLE IF NOT EXISTS station_trials (
+    station TEXT NOT NULL,
+    session_key TEXT NOT NULL,
+    trial_number INTEGER NOT NULL,
+    trial_json TEXT NOT NULL,
+    PRIMARY KEY (station, session_key, trial_number)
+) WITHOUT ROWID;
+"""
+
+
+class CollectorStore:
+    # 受信したレコードをストアに反映する。HTTP のリクエストは並行に来るので書き込みはロックで1つずつ行う
+    def __init__(self, db_path):
+        self.store = SessionStore(db_path, check_same_thread=False)
+        self.conn = self.store.conn
+        self.conn.executescript(COLLECTOR_SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            self.store.close()
+
+    def ingest(self, station, records):
+        # 1回の POST (バッチ) をまとめて反映する (途中で失敗しても再送すれば同じ結果になる)。戻り値: 反映したレコード数
+        # session_end はバッチの他のレコードを反映した後に、セッションデータの組み立て (集計) をロックの外で済ませてから
+        # 1つのトランザクションでまとめて登録する
+        for record in records:
+            if not isinstance(record, dict) or record.get("type") not in RECORD_TYPES or not record.get("session_key"):
+                raise ValueError(f"不正なレコードです: {record!r}")
+        now = time.time()
+        ends = []
+        with self.lock, self.conn:
+            for record in records:
+                if record["type"] == "session_end":
+                    received = None if record.get("data") is not None else self._received_session(station, record["session_key"])
+                    ends.append((record, received))
+                else:
+                    getattr(self, "_" + record["type"])(station, record, now)
+        sessions = []
+        for record, received in ends:
+            # 端末が保存したセッションデータがあればそれを、無ければ受信済みの試行から組み立てる
+            data = record.get("data")
+            if data is None and received is not None:
+                data = build_session_data(*received)
+            if data is not None:
+                sessions.append((record, data))
+        if sessions:
+            with self.lock, self.conn:
+                for record, data in sessions:
+                    self._session_end(station, record["session_key"], data, now)
+        return len(records)
+
+    def _session_row(self, station, session_key):
+        return self.conn.execute("SELECT * FROM station_sessions WHERE station = ? AND session_key = ?",
+                                 (station, session_key)).fetchone()
+
+    def _session_start(self, station, record, now):
+        self.conn.execute(
+            "INSERT INTO station_sessions (station, session_key, datetime_iso, test_settings_json, status, last_received) "
+            "VALUES (?, ?, ?, ?, 'running', ?) ON CONFLICT (station, session_key) DO UPDATE SET "
+            "datetime_iso = excluded.datetime_iso, test_settings_json = excluded.test_settings_json, "
+            "last_received = excluded.last_received",
+            (station, record["session_key"], record.get("datetime_iso"),
+             json.dumps(record.get("test_settings", {}), ensure_ascii=False), now))
+
+    def _trial(self, station, record, now):
+        row = self._session_row(station, record["session_key"])
+        if row is not None and row["status"] == "completed":
+            return # 終了後に届いた再送は無視する
+        trial = record["trial"]
+        self.conn.execute("INSERT OR REPLACE INTO station_trials (station, session_key, trial_number, trial_json) "
+                          "VALUES (?, ?, ?, ?)",
+                          (station, record["session_key"], trial["trial_number"], json.dumps(trial, ensure_ascii=False)))
+        self._touch(station, record["session_key"], now)
+
+    def _trial_update(self, station, record, now):
+        fields = {k: v for k, v in record.items() if k not in ("type", "session_key", "trial_number")}
+        row = self.conn.execute("SELECT trial_json FROM station_trials WHERE station = ? AND session_key = ? AND trial_number = ?",
+                                (station, record["session_key"], record["trial_number"])).fetchone()
+        if row is None:
+            return
+        trial = {**json.loads(row["trial_json"]), **fields}
+        self.conn.execute("UPDATE station_trials SET trial_json = ? WHERE station = ? AND session_key = ? AND trial_number = ?",
+                          (json.dumps(trial, ensure_ascii=False), station, record["session_key"], record["trial_number"]))
+        self._touch(station, record["session_key"], now)
+
+    def _received_session(self, station, session_key):
+        # 受信済みの試行から build_session_data の引数 (開始時刻, 設定, 試行記録) を読む。
+        # セッションが不明か、登録済み (受信用の試行は消してある) なら None
+        row = self._session_row(station, session_key)
+        if row is None or row["datetime_iso"] is None or row["status"] == "completed":
+            return None
+        trials = [json.loads(r["trial_json"]) for r in self.conn.execute(
+            "SELECT trial_json FROM station_trials WHERE station = ? AND session_key = ? ORDER BY trial_number",
+            (station, session_key))]
+        return row["datetime_iso"], json.loads(row["test_settings_json"]), trials
+
+    def _session_end(self, station, session_key, data, now):
+        # ingest のトランザクションの中で呼ぶ (途中でコミットしないように add_session ではなく _insert_session を使う)
+        row = self._session_row(station, session_key)
+        if row is None:
+            self._session_start(station, {"session_key": session_key, "datetime_iso": data["datetime_iso"],
+                                          "test_settings": data.get("test_settings", {})}, now)
+        elif row["session_id"] is not None:
+            self.conn.execute("DELETE FROM sessions WHERE id = ?", (row["session_id"],)) # 再送: 置き換える
+        session_id = self.store._insert_session(data, None, station)
+        self.conn.execute("UPDATE station_sessions SET status = 'completed', session_id = ?, last_received = ? "
+                          "WHERE station = ? AND session_key = ?", (session_id, now, station, session_key))
+        # 試行はストアの trials 表に入ったので受信用の行は消す
+        self.conn.execute("DELETE FROM station_trials WHERE station = ? AND session_key = ?", (station, session_key))
+
+    def _touch(self, station, session_key, now):
+        self.conn.execute("UPDATE station_sessions SET last_received = ? WHERE station = ? AND session_key = ?",
+                          (now, station, session_key))
+
+    # --- 参照 ---
+
+    def stations(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT station, COUNT(*) AS sessions, SUM(status = 'completed') AS completed, "
+                "SUM(status = 'running') AS running, MAX(last_received) AS last_received "
+                "FROM station_sessions GROUP BY station ORDER BY station")
+            return [dict(row) for row in rows]
+
+    def sessions(self, station=None, start=None, end=None):
+        with self.lock:
+            return self.store.query_sessions(start=start, end=end, station=station)
+
+    def live_sessions(self):
+        # 進行中のセッションと受信済みの試行数
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT s.station, s.session_key, s.datetime_iso, s.last_received, COUNT(t.trial_number) AS trials "
+                "FROM station_sessions s LEFT JOIN station_trials t "
+                "ON t.station = s.station AND t.session_key = s.session_key "
+                "WHERE s.status = 'running' GROUP BY s.station, s.session_key ORDER BY s.datetime_iso")
+            return [dict(row) for row in rows]
+
+    def aggregates(self, by="station", start=None, end=None):
+        if by == "date":
+            with self.lock:
+                return self.store.daily_trends(start, end)
+        if by != "station":
+            raise ValueError(f"未対応の集計単位です: {by}")
+        # 端末ごと: セッション数・中央反応時間 (セッション中央値の中央値)・ラプス合計・平均正答率
+        summary = collections.OrderedDict()
+        for session in self.sessions(start=start, end=end):
+            entry = summary.setdefault(session["station"], {"station": session["station"], "sessions": 0,
+                                                            "_medians": [], "_accuracies": [], "lapses": 0})
+            entry["sessions"] += 1
+            if session["median_rt_ms"] is not None:
+                entry["_medians"].append(session["median_rt_ms"])
+            if session["accuracy_percentage"] is not None:
+                entry["_accuracies"].append(session["accuracy_percentage"])
+            entry["lapses"] += session["lapses"] or 0
+        for entry in summary.values():
+            medians = entry.pop("_medians")
+            accuracies = entry.pop("_accuracies")
+            entry["median_rt_ms"] = round(statistics.median(medians), 3) if medians else None
+            entry["accuracy_percentage"] = round(statistics.mean(accuracies), 2) if accuracies else None
+        return list(summary.values())
+
+
+class CollectorRequestHandler(BaseHTTPRequestHandler):
+    server_version = "PVTCollector/1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != "/ingest":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise ValueError(f"不正な Content-Length です: {length}")
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": "too large"})
+            return
+        try:
+            batch = json.loads(self.rfile.read(length))
+            # 形が違うバッチは ingest に渡す前に 400 で拒否する (クライアントは 4xx なら再送しない)
+            if not isinstance(batch, dict) or not isinstance(batch.get("records"), list):
+                raise ValueError("バッチは station と records (リスト) を持つオブジェクトにしてください")
+            if not all(isinstance(record, dict) for record in batch["records"]):
+                raise ValueError("records の要素はオブジェクトにしてください")
+            accepted = self.server.collector.ingest(batch["station"], batch["records"])
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, {"accepted": accepted})
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+        collector = self.server.collector
+        try:
+            if url.path == "/health":
+                payload = {"status": "ok"}
+            elif url.path == "/stations":
+                payload = collector.stations()
+            elif url.path == "/sessions":
+                payload = collector.sessions(params.get("station"), params.get("start"), params.get("end"))
+            elif url.path == "/aggregates":
+                payload = collector.aggregates(params.get("by", "station"), params.get("start"), params.get("end"))
+            elif url.path == "/live":
+                payload = collector.live_sessions()
+            else:
+                self._send_json(404, {"error": "not found"})
+                return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(200, payload)
+
+
+class CollectorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, db_path, verbose=False):
+        self.collector = CollectorStore(db_path)
+        self.verbose = verbose
+        super().__init__(address, CollectorRequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.collector.close()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_collector(db_path, host="127.0.0.1", port=0, verbose=False):
+    # バックグラウンドスレッドでサーバーを動かす (テスト・組み込み用)。port=0 なら空いているポート
+    server = CollectorServer((host, port), db_path, verbose)
+    thread = threading.Thread(target=server.serve_forever, name="collector", daemon=True)
+    thread.start()
+    return server, thread
+
+
+_CLOSE = object()
+
+
+class CollectorClient:
+    # レコードを溜めて batch_size 件ごと、または最初のレコードから flush_interval_s 経ったら POST する。
+    # 送信はワーカースレッドで行い、send() は待たない。失敗したら順序を保ったまま指数バックオフで再送する
+    def __init__(self, url, station, batch_size=100, flush_interval_s=1.0, timeout_s=5.0,
+                 initial_backoff_s=0.5, max_backoff_s=30.0, max_buffered=10000):
+        self.url = url.rstrip("/") + "/ingest"
+        self.station = station
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.timeout_s = timeout_s
+        self.initial_backoff_s = initial_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.max_buffered = max_buffered # 送れないまま溜まったら古いものから捨てる
+        self.sent_records = 0
+        self.failed_attempts = 0
+        self.dropped_records = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="collector-client", daemon=True)
+        self._thread.start()
+
+    def send(self, record):
+        self._queue.put(record)
+
+    def close(self, timeout=None):
+        # 溜まっているレコードを送ってから止める (送れなければ諦める)
+        self._queue.put(_CLOSE)
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _run(self):
+        pending = collections.deque()
+        flush_at = None
+        backoff_s = 0.0
+        closing = False
+        while True:
+            timeout = None if flush_at is None else max(0.0, flush_at - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                closing = True
+            elif item is not None:
+                pending.append(item)
+                if len(pending) > self.max_buffered:
+                    pending.popleft()
+                    self.dropped_records += 1
+                if flush_at is None:
+                    flush_at = time.monotonic() + self.flush_interval_s
+
+            due = flush_at is not None and time.monotonic() >= flush_at
+            if pending and (due or closing or (len(pending) >= self.batch_size and not backoff_s)):
+                if self._post_pending(pending):
+                    backoff_s = 0.0
+                    flush_at = None
+                else:
+                    if closing:
+                        return
+                    backoff_s = min(self.max_backoff_s, backoff_s * 2 or self.initial_backoff_s)
+                    flush_at = time.monotonic() + backoff_s
+            if closing and not pending:
+                return
+
+    def _post_pending(self, pending):
+        # 先頭から batch_size 件ずつ送る。戻り値: 全て送れたら True
+        while pending:
+            batch = [pending[i] for i in range(min(self.batch_size, len(pending)))]
+            body = json.dumps({"station": self.station, "records": batch}, ensure_ascii=False).encode("utf-8")
+            request = urllib.request.Request(self.url, data=body, method="POST",
+                                             headers={"Content-Type": "application/json"})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout_s) as response:
+                    response.read()
+            except urllib.error.HTTPError as e:
+                if 400 <= e.code < 500: # 再送しても受け付けられない
+                    print(f"収集サーバーがレコードを拒否しました ({e.code})。{len(batch)} 件を破棄します。")
+                    for _ in batch:
+                        pending.popleft()
+                    self.dropped_records += len(batch)
+                    continue
+                self.failed_attempts += 1
+                return False
+            except OSError: # URLError・接続拒否・タイムアウト
+                self.failed_attempts += 1
+                return False
+            for _ in batch:
+                pending.popleft()
+            self.sent_records += len(batch)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数端末のセッションを集める収集サーバー")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve")
+    serve_parser.add_argument("--db", default="collector.sqlite3")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = CollectorServer((args.host, args.port), args.db, args.verbose)
+    print(f"収集サーバーを {server.url} で起動しました (データベース: {args.db})。Ctrl+C で停止します。")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# pvt_compact.py
+# セッションJSONのコンパクトなバイナリ形式。試行の列を固定幅の構造化配列として <base>.npy に置き
+# (np.load(mmap_mode='r') でコピーせずに読める)、それ以外 (日時・設定・集計・列にできない値) を
+# <base>.meta に JSON で置く。JSON とは相互に損失なく変換できる。
+# 使い方: python pvt_compact.py to-compact FILE.json [...] / python pvt_compact.py to-json BASE.npy [...]
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from pvt_session import write_session_json
+
+COMPACT_FORMAT_VERSION = 1
+ARRAY_SUFFIX = ".npy"
+META_SUFFIX = ".meta" # .json にしない (recoded_data/*.json を読む処理に拾われないように)
+
+# 試行の列と格納型。None は浮動小数点列では NaN、整数列では格納できないので列にしない
+TRIAL_DTYPE = np.dtype([
+    ("trial_number", "<i4"),
+    ("pre_stimulus_interval_ms", "<f8"),
+    ("stimulus", "i1"),
+    ("is_target", "i1"),
+    ("is_correct", "i1"),
+    ("reaction_time_ms", "<f8"),
+    ("isi_actual_ms", "<f8"),
+    ("response_window_actual_ms", "<f8"),
+    ("feedback_actual_ms", "<f8")
+])
+
+
+def _column_kind(values, is_float_column):
+    # "int": 全て int, "float": 全て float (浮動小数点列では None 可), None: 列にできない
+    # int と float が混在する列は JSON に戻すときに区別できないので列にしない
+    if not is_float_column and any(value is None for value in values):
+        return None
+    kinds = {type(value) for value in values if value is not None}
+    if kinds <= {int}:
+        return "int"
+    if kinds == {float} and is_float_column:
+        return "float"
+    return None
+
+
+def _split_trials(trials):
+    # 列に格納するフィールドとその型。それ以外は試行ごとに meta の extras に残す
+    columns = {}
+    for name in TRIAL_DTYPE.names:
+        if not all(name in trial for trial in trials):
+            continue
+        kind = _column_kind([trial[name] for trial in trials], TRIAL_DTYPE[name].kind == "f")
+        if kind is not None:
+            columns[name] = kind
+    return columns
+
+
+def session_to_compact(data, base_path):
+    trials = data.get("trials", [])
+    columns = _split_trials(trials)
+    array = np.zeros(len(trials), dtype=TRIAL_DTYPE)
+    for name in TRIAL_DTYPE.names:
+        if TRIAL_DTYPE[name].kind == "f":
+            array[name] = np.nan # 列にしなかったフィールドは欠損として読めるように
+    for name in columns:
+        array[name] = [np.nan if trial[name] is None else trial[name] for trial in trials]
+    extras = {}
+    for index, trial in enumerate(trials):
+        extra = {k: v for k, v in trial.items() if k not in columns}
+        if extra:
+            extras[str(index)] = extra
+
+    meta = {
+        "format_version": COMPACT_FORMAT_VERSION,
+        "session": {k: v for k, v in data.items() if k != "trials"},
+        "columns": columns,
+        "key_order": list(trials[0].keys()) if trials else [],
+        "extras": extras
+    }
+    # どちらも一時ファイルに書いて fsync してから置き換える。.npy は最後に置き換えて、新しい配列が古い .meta と
+    # 組になって読まれないようにする
+    array_tmp = base_path + ARRAY_SUFFIX + ".tmp"
+    meta_tmp = base_path + META_SUFFIX + ".tmp"
+    with open(array_tmp, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+        f.flush()
+        os.fsync(f.fileno())
+    with open(meta_tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(meta_tmp, base_path + META_SUFFIX)
+    os.replace(array_tmp, base_path + ARRAY_SUFFIX)
+
+
+def compact_base_path(path):
+    for suffix in (ARRAY_SUFFIX, META_SUFFIX, ".json"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def load_trial_array(base_path, mmap=True):
+    # 試行の構造化配列。mmap=True ならファイルをメモリマップして返す (読み取り専用)
+    return np.load(base_path + ARRAY_SUFFIX, mmap_mode="r" if mmap else None, allow_pickle=False)
+
+
+def load_meta(base_path):
+    with open(base_path + META_SUFFIX, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compact_to_session(base_path):
+    meta = load_meta(base_path)
+    array = load_trial_array(base_path)
+    columns = meta["columns"]
+    values = {}
+    for name, kind in columns.items():
+        column = array[name].tolist()
+        if kind == "int":
+            values[name] = [None if v != v else int(v) for v in column] # NaN -> None
+        else:
+            values[name] = [None if v != v else v for v in column]
+
+    trials = []
+    key_order = meta["key_order"]
+    for index in range(len(array)):
+        extra = meta["extras"].get(str(index), {})
+        trial = {}
+        for key in key_order:
+            if key in columns:
+                trial[key] = values[key][index]
+            elif key in extra:
+                trial[key] = extra[key]
+        for key, value in extra.items():
+            trial.setdefault(key, value)
+        trials.append(trial)
+    return {**meta["session"], "trials": trials}
+
+
+def convert_json_to_compact(json_path):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    base_path = compact_base_path(json_path)
+    session_to_compact(data, base_path)
+    return base_path
+
+
+def convert_compact_to_json(base_path, json_path=None):
+    json_path = json_path or base_path + ".json"
+    write_session_json(json_path, compact_to_session(base_path))
+    return json_path
+
+
+def find_compact_sessions(data_dir):
+    return sorted(os.path.join(data_dir, name[:-len(ARRAY_SUFFIX)]) for name in os.listdir(data_dir)
+                  if name.endswith(ARRAY_SUFFIX) and os.path.exists(os.path.join(data_dir, name[:-len(ARRAY_SUFFIX)] + META_SUFFIX)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="セッションJSONとコンパクト形式 (.npy + .meta) を相互に変換する")
+    parser.add_argument("direction", choices=("to-compact", "to-json"))
+    parser.add_argument("paths", nargs="+")
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        if args.direction == "to-compact":
+            base_path = convert_json_to_compact(path)
+            print(f"{path} -> {base_path}{ARRAY_SUFFIX}")
+        else:
+            json_path = convert_compact_to_json(compact_base_path(path))
+            print(f"{path} -> {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,547 @@
+# pvt_engine.py
+# Tkに依存しない試行ステートマシン。時計とスケジューラは注入可能で、
+# PVTApp(実機)でもVirtualClock(ヘッドレス/CI)でも同じロジックで動作する。
+
+import heapq
+import itertools
+import random
+import time
+
+from pvt_schedule import generate_schedule, stimulus_stream
+from pvt_stats import LiveSessionStats, RunningStats
+
+
+TIMER_DRIFT_PERCENTILES = (50, 95, 99)
+
+
+def _percentile(sorted_values, q):
+    # 線形補間のパーセンタイル (sorted_values は昇順)
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def timer_drift_summary(trials, response_limit_ms, feedback_duration_ms):
+    # 各タイマーの (実際の遅延 - 要求した遅延) をパーセンタイルで要約する
+    drifts = {"isi": [], "response_window": [], "feedback": []}
+    for trial in trials:
+        if trial.get("isi_actual_ms") is not None and trial.get("pre_stimulus_interval_ms") is not None:
+            drifts["isi"].append(trial["isi_actual_ms"] - trial["pre_stimulus_interval_ms"])
+        if trial.get("response_window_actual_ms") is not None:
+            drifts["response_window"].append(trial["response_window_actual_ms"] - response_limit_ms)
+        if trial.get("feedback_actual_ms") is not None:
+            drifts["feedback"].append(trial["feedback_actual_ms"] - feedback_duration_ms)
+
+    summary = {}
+    for timer_name, values in drifts.items():
+        values.sort()
+        timer_summary = {"count": len(values)}
+        for q in TIMER_DRIFT_PERCENTILES:
+            value = _percentile(values, q)
+            timer_summary[f"p{q}_drift_ms"] = round(value, 3) if value is not None else None
+        timer_summary["max_drift_ms"] = round(values[-1], 3) if values else None
+        summary[timer_name] = timer_summary
+    return summary
+
+
+class PerfCounterClock:
+    # time.perf_counter は呼び出し時に参照する (テストでの monkeypatch に対応するため)
+    def now(self):
+        return time.perf_counter()
+
+    def now_ns(self):
+        return time.perf_counter_ns()
+
+
+class VirtualClock:
+    # 時計とスケジューラを兼ねる仮想時間。tk.Tk の after/after_cancel と同じ呼び出し形式。
+    # 時間は advance()/run() でタイマーを消化したときだけ進むので、実時間より速くセッションを回せる。
+    def __init__(self, start_s=0.0):
+        self._now_ns = int(start_s * 1_000_000_000)
+        self._queue = [] # (due_ns, seq, timer_id, callback, args)
+        self._counter = itertools.count()
+        self._cancelled = set()
+
+    def now(self):
+        return self._now_ns / 1_000_000_000
+
+    def now_ns(self):
+        return self._now_ns
+
+    def after(self, delay_ms, callback, *args):
+        seq = next(self._counter)
+        timer_id = f"virtual#{seq}"
+        due_ns = self._now_ns + int(delay_ms * 1_000_000)
+        heapq.heappush(self._queue, (due_ns, seq, timer_id, callback, args))
+        return timer_id
+
+    def after_cancel(self, timer_id):
+        self._cancelled.add(timer_id)
+
+    def pending(self):
+        return sum(1 for entry in self._queue if entry[2] not in self._cancelled)
+
+    def next_due_ns(self):
+        self._drop_cancelled()
+        return self._queue[0][0] if self._queue else None
+
+    def step(self):
+        # 次のタイマーまで時間を進めて実行する。実行するものがなければ False
+        self._drop_cancelled()
+        if not self._queue:
+            return False
+        due_ns, _, _, callback, args = heapq.heappop(self._queue)
+        if due_ns > self._now_ns:
+            self._now_ns = due_ns
+        callback(*args)
+        return True
+
+    def advance(self, delay_ms):
+        # delay_ms だけ時間を進め、その間に期限を迎えたタイマーを順に実行する
+        deadline_ns = self._now_ns + int(delay_ms * 1_000_000)
+        while True:
+            due_ns = self.next_due_ns()
+            if due_ns is None or due_ns > deadline_ns:
+                break
+            self.step()
+        self._now_ns = max(self._now_ns, deadline_ns)
+
+    def run(self, max_steps=None):
+        steps = 0
+        while (max_steps is None or steps < max_steps) and self.step():
+            steps += 1
+        return steps
+
+    def _drop_cancelled(self):
+        while self._queue and self._queue[0][2] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._queue)[2])
+
+
+class NullView:
+    # ヘッドレス実行用の何もしないビュー
+    def show_stimulus(self, stimulus):
+        pass
+
+    def clear_stimulus(self):
+        pass
+
+    def show_feedback(self, message, color):
+        pass
+
+    def clear_feedback(self):
+        pass
+
+    def flush_display(self):
+        pass
+
+    def test_finished(self):
+        pass
+
+
+class PVTEngine:
+    def __init__(self, scheduler, clock=None, view=None, rng=None):
+        self.scheduler = scheduler # after(ms, callback) / after_cancel(id) を持つもの (tk.Tk, VirtualClock)
+        self.clock = clock if clock is not None else PerfCounterClock()
+        self.view = view if view is not None else NullView()
+        self.rng = rng if rng is not None else random.Random()
+
+        # 設定可能変数
+        self.target_number = 0 # ターゲット数字(0はランダム)
+        self.target_trials = 25
+        self.max_trials = 100
+        self.min_interval_s = 0.5
+        self.max_interval_s = 5.0
+        self.response_limit_ms = 1500
+        self.response_outlier_ms = 100
+        self.feedback_duration_ms = 1000
+        self.precise_onset = False # True: 描画を強制してから提示時刻を取り、ns単位の時刻と描画遅延を記録する
+        # True: 提示時刻とすべての押下 (無視した押下も) を試行記録に残し、後から別のしきい値で採点し直せるようにする (pvt_replay)
+        self.record_raw_events = True
+        # True: 入力イベントのディスパッチ遅延 (推定値) を反応時刻から差し引く。既定では RT は補正せず、
+        # 遅延は試行ごとの dispatch_latency_ms に別に残す
+        self.correct_dispatch_latency = False
+        # 試行計画 (pvt_schedule)。schedule_seed が None なら rng から毎回新しいシードを引く
+        self.schedule_seed = None
+        self.max_consecutive_targets = None
+        self.balance_digits = False
+        self.isi_distribution = "uniform"
+        self.schedule = None
+        self.plan_seed = None # 直近の計画 (試行数制・時間制とも) に使ったシード
+        # 時間制モード: duration_s を設定すると試行数ではなく経過時間で終了し、刺激は stimulus_stream から1つずつ作る
+        self.duration_s = None
+        self.retain_trials = True # False: 試行記録と反応時間をメモリに溜めない (オンライン統計とリスナーだけ)
+        self.stimulus_stream = None
+        self.pending_stimulus = None
+        self.session_deadline_ns = None
+
+        self.trial_listeners = [] # 試行記録ごとに trial_outcome を受け取る callable
+        self.trial_update_listeners = [] # 記録後に確定した値を (trial_outcome, fields) で受け取る callable
+        self.isi_listeners = [] # ISI の待ち時間に入った直後に呼ぶ callable (引数は ISI の ms)
+        # True: リスナー呼び出し (ログ書き込みなど) を反応/タイムアウト処理から外し、次の ISI の待ち時間にまとめて行う
+        self.defer_listeners = False
+        self._deferred_calls = []
+
+        self._sequence = []
+        self.interval_timer_id = None
+        self.reaction_window_timer_id = None
+        self.feedback_clear_timer_id = None
+        # タイマーを登録した時刻 (ns)。発火時に実際の遅延を求める
+        self.isi_scheduled_ns = None
+        self.response_window_scheduled_ns = None
+        self.feedback_scheduled_ns = None
+        self.reset()
+
+    def reset(self):
+        # self.target_number remains unless explicitly reset
+        self.current_stimulus = 0
+        self.previous_stimulus = 0
+        self.number_counts = {i: 0 for i in range(1, 10)}
+        self.total_trials_conducted = 0
+        self.correct_go_responses = 0
+        self.correct_no_go_responses = 0
+        self.commission_errors = 0
+        self.commission_outliers = 0 # 早すぎる反応
+        self.omission_outliers = 0   # 遅すぎる反応(Go試行でのタイムアウト)
+        self.live_stats = LiveSessionStats() # 試行ごとに O(1) で更新する統計
+        self.reaction_times = []
+        self.all_trial_data = []
+        self.current_isi_ms = None
+        self.test_in_progress = False
+        self.reaction_timer_start_time = 0
+        self.stimulus_onset_ns = None
+        self.paint_latency_ns = None
+        self.session_start_ns = None
+        self.raw_onset_ns = None # 提示時刻 (precise_onset でなくても記録する)
+        self._presses_ns = [] # この試行 (ISI の開始からフィードバック消去まで) の押下時刻
+        self.isi_actual_ms = None
+        self.last_trial_outcome = None
+        self.stimulus_on_screen = False
+        self.accepting_response = False
+
+    @property
+    def reaction_times(self):
+        return self._reaction_times
+
+    @reaction_times.setter
+    def reaction_times(self, values):
+        # 外部から差し替えられた場合もオンライン統計を合わせておく
+        self._reaction_times = values
+        self.live_stats.all_rt = RunningStats(values)
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self, values):
+        # 外部から刺激列を差し替えた場合は計画の ISI も使わない (従来どおり試行ごとに rng で決める)
+        self._sequence = values
+        self.schedule = None
+
+    def test_settings(self):
+        # セッションJSONの test_settings (デスクトップ版・ブラウザ版 (pvt_web) 共通)
+        return {
+            "target_number": self.target_number,
+            "response_limit_ms": self.response_limit_ms,
+            "response_outlier_ms": self.response_outlier_ms,
+            "feedback_duration_ms": self.feedback_duration_ms,
+            "min_interval_s": self.min_interval_s,
+            "max_interval_s": self.max_interval_s,
+            "configured_max_trials": self.max_trials,
+            "duration_s": self.duration_s, # None: 試行数制
+            "precise_onset": self.precise_onset,
+            "correct_dispatch_latency": self.correct_dispatch_latency,
+            # 同じシードと制約で generate_schedule (時間制では stimulus_stream) を呼べば同じ刺激列とISIが再現できる
+            "schedule_seed": self.plan_seed,
+            "max_consecutive_targets": self.max_consecutive_targets,
+            "balance_digits": self.balance_digits,
+            "isi_distribution": self.isi_distribution
+        }
+
+    def rt_summary(self):
+        # (平均, 最悪, 標準偏差)。reaction_times が直接書き換えられていた場合だけ再集計する
+        if self.retain_trials and self.live_stats.all_rt.count != len(self._reaction_times):
+            self.live_stats.all_rt = RunningStats(self._reaction_times)
+        return self.live_stats.rt_summary()
+
+    def live_metrics(self):
+        return self.live_stats.snapshot()
+
+    def choose_target_number(self):
+        if self.target_number == 0: # Only set if not already set (e.g. for re-runs with same target)
+            self.target_number = self.rng.randint(1, 9)
+        return self.target_number
+
+    def generate_sequence(self):
+        seed = self.schedule_seed if self.schedule_seed is not None else self.rng.getrandbits(32)
+        self.plan_seed = seed
+        if self.duration_s is not None:
+            # 時間制では試行数が決まらないので、設定の比率でターゲットを出す
+            self.stimulus_stream = stimulus_stream(
+                seed, self.target_number, self.target_trials / self.max_trials,
+                int(self.min_interval_s * 1000), int(self.max_interval_s * 1000),
+                self.max_consecutive_targets, self.balance_digits, self.isi_distribution)
+            self.sequence = []
+            return
+        self.stimulus_stream = None
+        schedule = generate_schedule(
+            seed, self.target_number, self.max_trials, self.target_trials,
+            int(self.min_interval_s * 1000), int(self.max_interval_s * 1000),
+            self.max_consecutive_targets, self.balance_digits, self.isi_distribution)
+        self.sequence = schedule.stimuli[::-1] # select_stimulus は末尾から取り出す
+        self.schedule = schedule
+
+    @property
+    def duration_mode(self):
+        return self.duration_s is not None and self.stimulus_stream is not None
+
+    def start(self):
+        self.test_in_progress = True
+        self.session_start_ns = self.clock.now_ns()
+        if self.duration_mode:
+            self.session_deadline_ns = self.clock.now_ns() + int(self.duration_s * 1_000_000_000)
+        self.run_next_trial()
+
+    def session_complete(self):
+        if self.duration_mode:
+            return self.clock.now_ns() >= self.session_deadline_ns
+        return self.total_trials_conducted >= self.max_trials
+
+    def cancel_timers(self):
+        if self.interval_timer_id:
+            self.scheduler.after_cancel(self.interval_timer_id)
+            self.interval_timer_id = None
+        if self.reaction_window_timer_id:
+            self.scheduler.after_cancel(self.reaction_window_timer_id)
+            self.reaction_window_timer_id = None
+        if self.feedback_clear_timer_id:
+            self.scheduler.after_cancel(self.feedback_clear_timer_id)
+            self.feedback_clear_timer_id = None
+
+    def run_next_trial(self):
+        if not self.test_in_progress:
+            return
+
+        if self.session_complete():
+            self.end_test()
+            return
+
+        self.stimulus_on_screen = False
+        self.accepting_response = False
+        self.raw_onset_ns = None
+        self._presses_ns = []
+        self.view.clear_stimulus() # Clear previous stimulus
+
+        # ISI: Inter-Stimulus Interval
+        if self.duration_mode:
+            interval_ms, self.pending_stimulus = next(self.stimulus_stream)
+        elif self.schedule is not None and self.total_trials_conducted < len(self.schedule.isi_ms):
+            interval_ms = self.schedule.isi_ms[self.total_trials_conducted]
+        else:
+            interval_ms = self.rng.randint(int(self.min_interval_s * 1000), int(self.max_interval_s * 1000))
+        self.current_isi_ms = interval_ms
+        self.isi_scheduled_ns = self.clock.now_ns()
+        self.interval_timer_id = self.scheduler.after(interval_ms, self.display_stimulus)
+        # ここから刺激までは時間に余裕があるので、後回しにした処理を行う
+        self.flush_deferred_listeners()
+        for listener in self.isi_listeners:
+            listener(interval_ms)
+
+    def select_stimulus(self):
+        if self.duration_mode:
+            stimulus, self.pending_stimulus = self.pending_stimulus, None
+            return stimulus
+        if not self.sequence: # Check if sequence is empty
+            return None
+        # Pop from the end for efficiency with list.pop()
+        return self.sequence.pop(-1)
+
+    def display_stimulus(self):
+        self.isi_actual_ms = self._elapsed_ms(self.isi_scheduled_ns)
+        self.isi_scheduled_ns = None
+        self.interval_timer_id = None
+        if not self.test_in_progress:
+            return
+        if self.duration_mode and self.session_complete(): # ISI 中に時間切れ
+            self.end_test()
+            return
+
+        next_stimulus = self.select_stimulus()
+        if next_stimulus is None: # No more stimuli in sequence
+            self.end_test()
+            return
+
+        self.current_stimulus = next_stimulus
+        if self.precise_onset:
+            # Force the redraw and timestamp only after the digit has been painted
+            paint_start_ns = self.clock.now_ns()
+            self.view.show_stimulus(self.current_stimulus)
+            self.view.flush_display()
+            self.stimulus_onset_ns = self.clock.now_ns()
+            self.paint_latency_ns = self.stimulus_onset_ns - paint_start_ns
+        else:
+            self.view.show_stimulus(self.current_stimulus)
+        self.stimulus_on_screen = True
+        self.accepting_response = True # Start accepting response AFTER stimulus is on screen
+
+        self.reaction_timer_start_time = self.clock.now()
+        self.number_counts[self.current_stimulus] += 1
+        self.previous_stimulus = self.current_stimulus # Store for potential analysis
+
+        # Timer for response window (max reaction time)
+        self.response_window_scheduled_ns = self.clock.now_ns()
+        self.raw_onset_ns = self.stimulus_onset_ns if self.precise_onset else self.response_window_scheduled_ns
+        self.reaction_window_timer_id = self.scheduler.after(self.response_limit_ms, self.handle_timeout)
+
+    def handle_response(self, dispatch_latency_ns=None):
+        # dispatch_latency_ns: 入力イベント発生からハンドラ実行までの遅延 (分かる場合)。
+        # 反応時刻から差し引くのは correct_dispatch_latency のときだけ
+        latency_ns = (dispatch_latency_ns or 0) if self.correct_dispatch_latency else 0
+        if self.record_raw_events and self.test_in_progress:
+            # 採点に使わない押下 (ISI 中・フィードバック中) も含めて記録する
+            self._presses_ns.append(self.clock.now_ns() - latency_ns)
+        if not self.test_in_progress or not self.stimulus_on_screen or not self.accepting_response:
+            return # Ignore premature or late presses
+
+        if self.reaction_window_timer_id: # Cancel timeout timer
+            self.scheduler.after_cancel(self.reaction_window_timer_id)
+            self.reaction_window_timer_id = None
+
+        self.accepting_response = False # Stop accepting further responses for this trial
+
+        if self.precise_onset:
+            response_ns = self.clock.now_ns() - latency_ns
+            rt_ms = round((response_ns - self.stimulus_onset_ns) / 1_000_000, 3) # sub-millisecond RT
+        else:
+            response_ns = None
+            rt_s = self.clock.now() - self.reaction_timer_start_time - latency_ns / 1_000_000_000
+            rt_ms = round(rt_s * 1000)
+
+        self.stimulus_on_screen = False
+        self.view.clear_stimulus()
+
+        is_target_stimulus = (self.current_stimulus == self.target_number)
+        trial_outcome = self._new_trial_outcome(is_target_stimulus, rt_ms, response_ns)
+        if dispatch_latency_ns is not None:
+            trial_outcome["dispatch_latency_ms"] = round(dispatch_latency_ns / 1_000_000, 3)
+
+        if self.retain_trials:
+            self._reaction_times.append(rt_ms) # Record all RTs for potential analysis
+        if rt_ms < self.response_outlier_ms: # Response too fast
+            self.view.show_feedback("TooFast!", "orange")
+            self.commission_outliers += 1
+        elif is_target_stimulus: # Pressed on target (NoGo trial) -> Commission Error
+            self.view.show_feedback("Bad!", "red")
+            self.commission_errors += 1
+        else: # Pressed on non-target (Go trial) -> Correct Go
+            self.view.show_feedback("Good!", "green")
+            self.correct_go_responses += 1
+            trial_outcome["is_correct"] = 1
+
+        self._record_trial(trial_outcome)
+
+    def handle_timeout(self):
+        if not self.test_in_progress or not self.stimulus_on_screen or not self.accepting_response:
+            return # Should not happen if logic is correct, but good safeguard
+
+        self.reaction_window_timer_id = None # Timer already fired
+        response_window_actual_ms = self._elapsed_ms(self.response_window_scheduled_ns)
+        self.accepting_response = False
+
+        self.stimulus_on_screen = False
+        self.view.clear_stimulus()
+
+        is_target_stimulus = (self.current_stimulus == self.target_number)
+        trial_outcome = self._new_trial_outcome(is_target_stimulus, None) # Timeout means no RT
+        trial_outcome["response_window_actual_ms"] = response_window_actual_ms
+
+        if is_target_stimulus: # Correctly did not press on target (NoGo trial)
+            self.view.show_feedback("Good!", "green")
+            self.correct_no_go_responses += 1
+            trial_outcome["is_correct"] = 1
+        else: # Did not press on non-target (Go trial) -> Omission Error/Outlier
+            self.view.show_feedback("TooLate!", "orange")
+            self.omission_outliers += 1 # This is an omission error for a Go trial
+
+        self._record_trial(trial_outcome)
+
+    def _new_trial_outcome(self, is_target_stimulus, rt_ms, response_ns=None):
+        trial_outcome = {
+            "trial_number": self.total_trials_conducted + 1,
+            "pre_stimulus_interval_ms": self.current_isi_ms,
+            "stimulus": self.current_stimulus,
+            "is_target": 1 if is_target_stimulus else 0,
+            "is_correct": 0, # Default to incorrect, update based on logic
+            "reaction_time_ms": rt_ms,
+            "isi_actual_ms": self.isi_actual_ms,
+            "response_window_actual_ms": None, # タイムアウトした試行のみ
+            "feedback_actual_ms": None # フィードバック消去時に記入
+        }
+        if self.record_raw_events and self.raw_onset_ns is not None and self.session_start_ns is not None:
+            trial_outcome["onset_ms"] = round((self.raw_onset_ns - self.session_start_ns) / 1_000_000, 3) # セッション開始から
+        if self.precise_onset:
+            trial_outcome["stimulus_onset_ns"] = self.stimulus_onset_ns
+            trial_outcome["response_ns"] = response_ns
+            trial_outcome["paint_latency_ns"] = self.paint_latency_ns
+        return trial_outcome
+
+    def _notify(self, listeners, *args):
+        if self.defer_listeners:
+            for listener in listeners:
+                self._deferred_calls.append((listener, args))
+        else:
+            for listener in listeners:
+                listener(*args)
+
+    def flush_deferred_listeners(self):
+        calls, self._deferred_calls = self._deferred_calls, []
+        for listener, args in calls:
+            listener(*args)
+
+    def _elapsed_ms(self, scheduled_ns):
+        if scheduled_ns is None:
+            return None
+        return round((self.clock.now_ns() - scheduled_ns) / 1_000_000, 3)
+
+    def _record_trial(self, trial_outcome):
+        if self.retain_trials:
+            self.all_trial_data.append(trial_outcome)
+        self.total_trials_conducted += 1
+        self.last_trial_outcome = trial_outcome
+        self.live_stats.add_trial(trial_outcome)
+        self._notify(self.trial_listeners, trial_outcome)
+        self.feedback_scheduled_ns = self.clock.now_ns()
+        self.feedback_clear_timer_id = self.scheduler.after(self.feedback_duration_ms, self.clear_feedback_and_proceed)
+
+    def clear_feedback_and_proceed(self):
+        self.feedback_clear_timer_id = None # Timer already fired
+        if self.last_trial_outcome is not None:
+            fields = {"feedback_actual_ms": self._elapsed_ms(self.feedback_scheduled_ns)}
+            if self.record_raw_events and self.raw_onset_ns is not None:
+                # 提示時刻からの押下時刻 (ms)。負の値は ISI 中の押下 (フライング)
+                fields["response_offsets_ms"] = [round((press_ns - self.raw_onset_ns) / 1_000_000, 3)
+                                                 for press_ns in self._presses_ns]
+            self.last_trial_outcome.update(fields)
+            self._notify(self.trial_update_listeners, self.last_trial_outcome, fields)
+        self.feedback_scheduled_ns = None
+        self.view.clear_feedback()
+
+        # Check termination conditions again (e.g., if max_trials reached during feedback)
+        if self.duration_mode:
+            self.run_next_trial() # 時間切れなら run_next_trial が終了させる
+        elif self.total_trials_conducted < self.max_trials and sum(self.number_counts.values()) < self.max_trials:
+            self.run_next_trial()
+        else:
+            self.end_test()
+
+    def end_test(self):
+        if not self.test_in_progress and self.total_trials_conducted > 0: return # Avoid re-entry
+        self.test_in_progress = False
+        self.stimulus_on_screen = False
+        self.accepting_response = False
+        self.cancel_timers()
+        self.flush_deferred_listeners()
+        self.view.test_finished()
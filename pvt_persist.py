@@ -0,0 +1,107 @@
+# pvt_persist.py
+# 終了時の保存 (セッションJSON・ストア登録・コンパクト形式・グラフPNG など) をバックグラウンドの
+# 1本のワーカースレッドで受け付け順に行う。Tk のメインスレッドはジョブを積むだけで、書き込みを待たない。
+# 進捗と完了はワーカーからイベントキューに積み、メインスレッドが drain() で取り出してコールバックを呼ぶ
+# (ワーカーから Tk のウィジェットに触らないため)。
+
+import queue
+import threading
+import time
+
+
+class PersistenceJob:
+    def __init__(self, run, on_progress=None, on_done=None, reserved=()):
+        self.run = run # run(progress) をワーカーで呼ぶ。progress(message) で進捗を知らせる
+        self.on_progress = on_progress # on_progress(job, message) (メインスレッド)
+        self.on_done = on_done # on_done(job) (メインスレッド)
+        self.reserved = frozenset(reserved) # 保存が終わるまで他のセッションに使わせないベース名
+        self.progress_message = None
+        self.result = None
+        self.error = None
+        self.finished = threading.Event()
+
+
+class PersistenceWorker:
+    def __init__(self, name="persistence"):
+        self.name = name
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+
+    def submit(self, run, on_progress=None, on_done=None, reserved=()):
+        job = PersistenceJob(run, on_progress, on_done, reserved)
+        with self._lock:
+            self._pending.append(job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name=self.name, daemon=True)
+                self._thread.start()
+        self._jobs.put(job)
+        return job
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def reserved(self):
+        with self._lock:
+            return frozenset().union(*(job.reserved for job in self._pending))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            def progress(message, _job=job):
+                _job.progress_message = message
+                self._events.put((_job, message))
+
+            try:
+                job.result = job.run(progress)
+            except Exception as e:
+                job.error = e
+            with self._lock:
+                self._pending.remove(job)
+            job.finished.set()
+            self._events.put((job, None))
+
+    def drain(self):
+        # 溜まった進捗/完了イベントのコールバックを呼び出し元 (メインスレッド) で実行する。戻り値: 処理したイベント数
+        handled = 0
+        while True:
+            try:
+                job, message = self._events.get_nowait()
+            except queue.Empty:
+                return handled
+            handled += 1
+            if message is not None:
+                if job.on_progress is not None:
+                    job.on_progress(job, message)
+            elif job.on_done is not None:
+                job.on_done(job)
+
+    def has_events(self):
+        return not self._events.empty()
+
+    def wait(self, timeout=None):
+        # 受け付け済みのジョブが終わるまで待ち、コールバックも実行する。全て終わっていれば True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            jobs = list(self._pending)
+        for job in jobs:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            job.finished.wait(remaining)
+        self.drain()
+        return self.pending() == 0
+
+    def close(self, timeout=None):
+        # 残りのジョブを書き終えてからワーカーを止める (終了時用)
+        finished = self.wait(timeout)
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join(timeout)
+        return finished
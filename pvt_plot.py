@@ -0,0 +1,110 @@
+# pvt_plot.py
+# 結果画面の反応時間グラフ。画面表示は Tk Canvas に直接描き (PNG→PIL の往復をしない)、
+# PNG の保存は使い回しの Figure/Axes で行う (保存ワーカー (pvt_persist) のスレッドから呼ばれる)。
+
+import math
+import os
+import threading
+
+GRAPH_TITLE = "Reaction Time Over Trials (Button Presses)"
+GRAPH_XLABEL = "Button Press Number"
+GRAPH_YLABEL = "Reaction Time (ms)"
+
+
+def nice_ticks(low, high, max_ticks=5):
+    # 目盛り用の切りのよい値 (1, 2, 5 × 10^n 刻み)
+    if high <= low:
+        high = low + 1
+    raw_step = (high - low) / max(1, max_ticks - 1)
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+    first = math.floor(low / step) * step
+    ticks = []
+    value = first
+    while value <= high + step * 1e-9:
+        ticks.append(value)
+        value += step
+    if ticks[-1] < high:
+        ticks.append(ticks[-1] + step)
+    return ticks
+
+
+def plot_layout(values, width, height, margin_left=50, margin_right=10, margin_top=28, margin_bottom=36):
+    # Canvas 上の座標を計算する (Tk に依存しない)。values は 1 始まりの試行順に並んだ値
+    y_ticks = nice_ticks(min(values), max(values))
+    y_low, y_high = y_ticks[0], y_ticks[-1]
+    x_high = max(2, len(values))
+    x_ticks = [int(t) for t in nice_ticks(1, x_high) if 1 <= t <= x_high]
+    plot_w = width - margin_left - margin_right
+    plot_h = height - margin_top - margin_bottom
+
+    def to_x(x):
+        return margin_left + (x - 1) / (x_high - 1) * plot_w
+
+    def to_y(y):
+        return margin_top + (1 - (y - y_low) / (y_high - y_low)) * plot_h
+
+    return {
+        "box": (margin_left, margin_top, margin_left + plot_w, margin_top + plot_h),
+        "points": [(to_x(i + 1), to_y(v)) for i, v in enumerate(values)],
+        "x_ticks": [(to_x(t), t) for t in x_ticks],
+        "y_ticks": [(to_y(t), t) for t in y_ticks]
+    }
+
+
+def draw_line_plot(canvas, values, width, height, title=GRAPH_TITLE, xlabel=GRAPH_XLABEL, ylabel=GRAPH_YLABEL,
+                   color="#1f77b4", font=None):
+    # matplotlib の plt.plot(marker='o') と同じ見た目の折れ線を Canvas に描く
+    canvas.delete("all")
+    layout = plot_layout(values, width, height)
+    left, top, right, bottom = layout["box"]
+    small_font = font or ("Helvetica", 8)
+
+    for x, label in layout["x_ticks"]:
+        canvas.create_line(x, top, x, bottom, fill="#e0e0e0")
+        canvas.create_text(x, bottom + 4, text=str(label), anchor="n", font=small_font)
+    for y, label in layout["y_ticks"]:
+        canvas.create_line(left, y, right, y, fill="#e0e0e0")
+        canvas.create_text(left - 4, y, text=f"{label:g}", anchor="e", font=small_font)
+    canvas.create_rectangle(left, top, right, bottom, outline="black")
+
+    points = layout["points"]
+    if len(points) >= 2:
+        canvas.create_line(*[c for point in points for c in point], fill=color, width=1.5)
+    for x, y in points:
+        canvas.create_oval(x - 2.5, y - 2.5, x + 2.5, y + 2.5, fill=color, outline=color)
+
+    canvas.create_text((left + right) / 2, 4, text=title, anchor="n", font=small_font)
+    canvas.create_text((left + right) / 2, height - 2, text=xlabel, anchor="s", font=small_font)
+    canvas.create_text(4, (top + bottom) / 2, text=ylabel, anchor="w", angle=90, font=small_font)
+
+
+class GraphExporter:
+    # PNG 保存用。Figure/Axes は初回に作って再実行 (もう一度行う) でも使い回す
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._figure = None
+        self._axes = None
+        self._line = None
+
+    def export(self, values, filepath):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        with self._lock:
+            if self._figure is None:
+                self._figure = Figure(figsize=(8, 4))
+                FigureCanvasAgg(self._figure)
+                self._axes = self._figure.add_subplot()
+                self._line, = self._axes.plot([], [], marker='o', linestyle='-')
+                self._axes.set_title(GRAPH_TITLE)
+                self._axes.set_xlabel(GRAPH_XLABEL)
+                self._axes.set_ylabel(GRAPH_YLABEL)
+                self._axes.grid(True)
+            self._line.set_data(range(1, len(values) + 1), values)
+            self._axes.relim()
+            self._axes.autoscale_view()
+            self._figure.tight_layout()
+            tmp_path = filepath + ".tmp"
+            self._figure.savefig(tmp_path, format="png")
+            os.replace(tmp_path, filepath)
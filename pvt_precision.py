@@ -0,0 +1,167 @@
+# pvt_precision.py
+# 精密セッションモード。試行中のGC停止 (ISI の待ち時間にだけ若い世代を回収)、プロセス優先度とCPUアフィニティの
+# 引き上げ (OS が許す範囲で)、リスナー処理の ISI への後回しを行い、しきい値を超える停止を検出して記録する。
+
+import gc
+import os
+import sys
+import time
+
+DEFAULT_PAUSE_THRESHOLD_MS = 15
+DEFAULT_HEARTBEAT_MS = 10
+MAX_RECORDED_PAUSES = 500 # 記録する停止の上限 (件数は別に数える)
+
+# Windows の優先度クラス
+_HIGH_PRIORITY_CLASS = 0x00000080
+_NORMAL_PRIORITY_CLASS = 0x00000020
+
+
+class PrecisionSession:
+    def __init__(self, engine, pause_threshold_ms=DEFAULT_PAUSE_THRESHOLD_MS, heartbeat_ms=DEFAULT_HEARTBEAT_MS,
+                 raise_priority=True, pin_cpu=True, nice_increment=-5):
+        self.engine = engine
+        self.pause_threshold_ms = pause_threshold_ms
+        self.heartbeat_ms = heartbeat_ms
+        self.raise_priority = raise_priority
+        self.pin_cpu = pin_cpu
+        self.nice_increment = nice_increment
+        self.active = False
+        self._restore = []
+        self._heartbeat_id = None
+        self._expected_ns = None
+        self.report = None
+
+    def start(self):
+        # engine.start() の後に呼ぶ。セッションが終わると自動的に stop() する
+        if self.active:
+            return self
+        self.active = True
+        self.start_ns = self.engine.clock.now_ns()
+        self.pauses = []
+        self.pause_count = 0
+        self.max_lag_ms = 0.0
+        self.gc_collections = 0
+        self.gc_total_ns = 0
+        self.report = {
+            "pause_threshold_ms": self.pause_threshold_ms,
+            "heartbeat_ms": self.heartbeat_ms,
+            "gc_disabled": False,
+            "priority": None,
+            "cpu_affinity": None
+        }
+
+        gc.collect()
+        if hasattr(gc, "freeze"): # 起動時からのオブジェクトを以後の回収対象から外す
+            gc.freeze()
+            self._restore.append(gc.unfreeze)
+        if gc.isenabled():
+            gc.disable()
+            self._restore.append(gc.enable)
+        self.report["gc_disabled"] = True
+        if self.raise_priority:
+            self.report["priority"] = self._raise_priority()
+        if self.pin_cpu:
+            self.report["cpu_affinity"] = self._pin_cpu()
+
+        self.engine.defer_listeners = True
+        self.engine.isi_listeners.append(self._collect_in_isi)
+        self._expected_ns = self.engine.clock.now_ns() + self.heartbeat_ms * 1_000_000
+        self._heartbeat_id = self.engine.scheduler.after(self.heartbeat_ms, self._heartbeat)
+        return self
+
+    def stop(self):
+        # 設定を元に戻し、セッションJSONに載せる記録を返す
+        if not self.active:
+            return self.report
+        self.active = False
+        if self._heartbeat_id is not None:
+            self.engine.scheduler.after_cancel(self._heartbeat_id)
+            self._heartbeat_id = None
+        self.engine.flush_deferred_listeners()
+        self.engine.defer_listeners = False
+        if self._collect_in_isi in self.engine.isi_listeners:
+            self.engine.isi_listeners.remove(self._collect_in_isi)
+        for restore in reversed(self._restore):
+            try:
+                restore()
+            except OSError:
+                pass
+        self._restore = []
+
+        self.report.update({
+            "pause_count": self.pause_count,
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "pauses": self.pauses,
+            "gc_collections_in_isi": self.gc_collections,
+            "gc_total_ms": round(self.gc_total_ns / 1_000_000, 3)
+        })
+        return self.report
+
+    def _collect_in_isi(self, interval_ms):
+        # 若い世代 (0, 1) だけを回収する。ISI は最短でも数百 ms あるので刺激提示には重ならない
+        start_ns = time.perf_counter_ns()
+        gc.collect(1)
+        self.gc_collections += 1
+        self.gc_total_ns += time.perf_counter_ns() - start_ns
+
+    def _heartbeat(self):
+        self._heartbeat_id = None
+        engine = self.engine
+        now_ns = engine.clock.now_ns()
+        lag_ms = (now_ns - self._expected_ns) / 1_000_000
+        if lag_ms > self.max_lag_ms:
+            self.max_lag_ms = lag_ms
+        if lag_ms >= self.pause_threshold_ms:
+            self.pause_count += 1
+            if len(self.pauses) < MAX_RECORDED_PAUSES:
+                if engine.stimulus_on_screen:
+                    phase = "stimulus"
+                else:
+                    phase = "feedback" if engine.feedback_clear_timer_id else "isi"
+                self.pauses.append({
+                    "at_ms": round((now_ns - self.start_ns) / 1_000_000, 3),
+                    "lag_ms": round(lag_ms, 3),
+                    # フィードバック中は記録済みの試行、それ以外はこれから (または今) 提示する試行
+                    "trial_number": engine.total_trials_conducted + (0 if phase == "feedback" else 1),
+                    "phase": phase
+                })
+        if not engine.test_in_progress:
+            self.stop()
+            return
+        self._expected_ns = now_ns + self.heartbeat_ms * 1_000_000
+        self._heartbeat_id = engine.scheduler.after(self.heartbeat_ms, self._heartbeat)
+
+    def _raise_priority(self):
+        if sys.platform == "win32":
+            try:
+                import ctypes
+                kernel32 = ctypes.windll.kernel32
+                process = kernel32.GetCurrentProcess()
+                if kernel32.SetPriorityClass(process, _HIGH_PRIORITY_CLASS):
+                    self._restore.append(lambda: kernel32.SetPriorityClass(process, _NORMAL_PRIORITY_CLASS))
+                    return "high"
+            except (AttributeError, OSError):
+                pass
+            return "unchanged"
+        if hasattr(os, "nice"):
+            try:
+                os.nice(self.nice_increment) # 負の値は権限が必要
+                self._restore.append(lambda: os.nice(-self.nice_increment))
+                return f"nice {self.nice_increment:+d}"
+            except OSError:
+                pass
+        return "unchanged"
+
+    def _pin_cpu(self):
+        # 実行中のCPU集合の最後の1つに固定する (コア間の移動とキャッシュの入れ替えを避ける)
+        if not hasattr(os, "sched_setaffinity"):
+            return None
+        try:
+            original = os.sched_getaffinity(0)
+            cpu = max(original)
+            if len(original) > 1:
+                os.sched_setaffinity(0, {cpu})
+                self._restore.append(lambda: os.sched_setaffinity(0, original))
+            return [cpu]
+        except OSError:
+            return None
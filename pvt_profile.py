@@ -0,0 +1,150 @@
+# pvt_profile.py
+# ハンドラの処理時間とイベントループの遅れの計測 (有効にしたときだけ)。
+# エンジンのハンドラをインスタンス属性のラッパーで包み、呼び出しごとの時間をヒストグラムと最悪値に集計する。
+# 定期的な after のハートビートで、予定時刻からの遅れ (イベントループの混み具合) も同じ形で集計する。
+# 無効時は何も包まないので、通常のセッションには計測の負担がかからない。
+
+import bisect
+import heapq
+import itertools
+import json
+import os
+
+from pvt_stats import RunningStats
+
+PROFILE_FORMAT_VERSION = 1
+PROFILE_SUFFIX = ".profile" # 中身は JSON。.json にしない (recoded_data/*.json を読む処理に拾われないように)
+HANDLERS = ("run_next_trial", "display_stimulus", "handle_response", "handle_timeout",
+            "clear_feedback_and_proceed", "end_test")
+DEFAULT_HEARTBEAT_MS = 20
+DEFAULT_WORST_CASES = 10
+# ヒストグラムの区切り (µs)。最後の区間は上限なし
+HISTOGRAM_EDGES_US = (10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000)
+
+
+class LatencyHistogram:
+    # 固定区間のヒストグラム + 平均/最大 + 大きい順の上位 worst_cases 件 (記録は O(log n))
+    def __init__(self, worst_cases=DEFAULT_WORST_CASES):
+        self.counts = [0] * (len(HISTOGRAM_EDGES_US) + 1)
+        self.stats = RunningStats()
+        self.worst_cases = worst_cases
+        self._worst = [] # (duration_ns, seq, context) の最小ヒープ
+        self._seq = itertools.count()
+
+    def add(self, duration_ns, context):
+        self.counts[bisect.bisect_right(HISTOGRAM_EDGES_US, duration_ns / 1000)] += 1
+        self.stats.add(duration_ns)
+        entry = (duration_ns, next(self._seq), context)
+        if len(self._worst) < self.worst_cases:
+            heapq.heappush(self._worst, entry)
+        elif duration_ns > self._worst[0][0]:
+            heapq.heapreplace(self._worst, entry)
+
+    def summary(self):
+        stats = self.stats
+        return {
+            "count": stats.count,
+            "mean_us": round(stats.mean / 1000, 3) if stats.count else None,
+            "max_us": round(stats.max / 1000, 3) if stats.count else None,
+            "total_ms": round(stats.mean * stats.count / 1_000_000, 3),
+            "histogram": {"edges_us": list(HISTOGRAM_EDGES_US), "counts": list(self.counts)},
+            "worst": [{"duration_us": round(duration_ns / 1000, 3), **context}
+                      for duration_ns, _, context in sorted(self._worst, reverse=True)]
+        }
+
+
+class SessionProfiler:
+    def __init__(self, engine, heartbeat_ms=DEFAULT_HEARTBEAT_MS, worst_cases=DEFAULT_WORST_CASES, on_complete=None):
+        self.engine = engine
+        self.heartbeat_ms = heartbeat_ms
+        self.worst_cases = worst_cases
+        self.on_complete = on_complete # セッション終了後 (end_test を抜けた後) に profiler を渡して呼ぶ
+        self.handlers = {name: LatencyHistogram(worst_cases) for name in HANDLERS}
+        self.event_loop_lag = LatencyHistogram(worst_cases)
+        self.active = False
+        self._depth = 0 # ハンドラの入れ子 (display_stimulus から end_test など)
+        self._heartbeat_id = None
+        self._expected_ns = None
+
+    def start(self):
+        # engine.start() の前に呼ぶ (スケジューラは登録時のメソッドを呼ぶので、最初の試行から包んでおく)
+        if self.active:
+            return self
+        self.active = True
+        self.start_ns = self.engine.clock.now_ns()
+        for name in HANDLERS:
+            setattr(self.engine, name, self._wrap(name, getattr(self.engine, name)))
+        self._expected_ns = self.start_ns + self.heartbeat_ms * 1_000_000
+        self._heartbeat_id = self.engine.scheduler.after(self.heartbeat_ms, self._heartbeat)
+        return self
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        for name in HANDLERS:
+            self.engine.__dict__.pop(name, None) # クラスのメソッドに戻す
+        if self._heartbeat_id is not None:
+            self.engine.scheduler.after_cancel(self._heartbeat_id)
+            self._heartbeat_id = None
+
+    def _context(self):
+        engine = self.engine
+        return {
+            "at_ms": round((engine.clock.now_ns() - self.start_ns) / 1_000_000, 3),
+            "trial_number": engine.total_trials_conducted
+        }
+
+    def _wrap(self, name, method):
+        histogram = self.handlers[name]
+        clock = self.engine.clock
+
+        def timed(*args, **kwargs):
+            start_ns = clock.now_ns()
+            self._depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                histogram.add(clock.now_ns() - start_ns, self._context())
+                # end_test は他のハンドラの中から呼ばれることもあるので、一番外側のハンドラを抜けた時点で終了処理をする
+                if self._depth == 0 and self.active and self.handlers["end_test"].stats.count \
+                        and not self.engine.test_in_progress:
+                    self._finish()
+
+        return timed
+
+    def _finish(self):
+        self.stop()
+        if self.on_complete is not None:
+            self.on_complete(self)
+
+    def _heartbeat(self):
+        self._heartbeat_id = None
+        now_ns = self.engine.clock.now_ns()
+        self.event_loop_lag.add(max(0, now_ns - self._expected_ns), self._context())
+        if not self.active:
+            return
+        self._expected_ns = now_ns + self.heartbeat_ms * 1_000_000
+        self._heartbeat_id = self.engine.scheduler.after(self.heartbeat_ms, self._heartbeat)
+
+    def profile(self):
+        return {
+            "format_version": PROFILE_FORMAT_VERSION,
+            "duration_ms": round((self.engine.clock.now_ns() - self.start_ns) / 1_000_000, 3),
+            "trials": self.engine.total_trials_conducted,
+            "handlers": {name: histogram.summary() for name, histogram in self.handlers.items()
+                         if histogram.stats.count},
+            "event_loop_lag": {"heartbeat_ms": self.heartbeat_ms, **self.event_loop_lag.summary()}
+        }
+
+    def write(self, path):
+        return write_profile(path, self.profile())
+
+
+def write_profile(path, profile):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,86 @@
+# pvt_render.py
+# テスト画面の描画層。数字 (1〜9) とフィードバックは Canvas のテキスト項目として画面を作るときに1回だけ作り、
+# 試行中は state (normal/hidden) を切り替えるだけで表示する。72pt の文字のレイアウトを試行ごとにやり直さない。
+# 切り替えと再描画にかかった時間を数字ごとに記録し、どの数字でも提示までの遅延が同じかを確かめられるようにする。
+
+import time
+
+from pvt_stats import RunningStats
+
+DIGITS = range(1, 10)
+FEEDBACK_STYLES = (("Good!", "green"), ("Bad!", "red"), ("TooFast!", "orange"), ("TooLate!", "orange"))
+
+
+class StimulusCanvas:
+    def __init__(self, canvas, width, height, stimulus_font, feedback_font, clock_ns=time.perf_counter_ns):
+        self.canvas = canvas
+        self.clock_ns = clock_ns
+        self.feedback_font = feedback_font
+        self.stimulus_position = (width / 2, height * 0.4)
+        self.feedback_position = (width / 2, height * 0.85)
+        self.digit_items = {digit: canvas.create_text(*self.stimulus_position, text=str(digit), font=stimulus_font,
+                                                      state="hidden")
+                            for digit in DIGITS}
+        self.feedback_items = {}
+        for message, color in FEEDBACK_STYLES:
+            self._feedback_item(message, color)
+        self.visible_digit = None
+        self.visible_feedback = None
+        self._painting_digit = None # 直前に表示した数字 (flush の時間をこの数字に計上する)
+        self.reset_costs()
+
+    def reset_costs(self):
+        self.update_cost_ns = {digit: RunningStats() for digit in DIGITS} # state 切り替え
+        self.paint_cost_ns = {digit: RunningStats() for digit in DIGITS} # 切り替え後の再描画 (flush)
+
+    def _feedback_item(self, message, color):
+        key = (message, color)
+        if key not in self.feedback_items: # 想定外の組み合わせは初回だけ作る
+            self.feedback_items[key] = self.canvas.create_text(*self.feedback_position, text=message, fill=color,
+                                                               font=self.feedback_font, state="hidden")
+        return self.feedback_items[key]
+
+    def show_digit(self, digit):
+        start_ns = self.clock_ns()
+        if self.visible_digit is not None and self.visible_digit != digit:
+            self.canvas.itemconfigure(self.digit_items[self.visible_digit], state="hidden")
+        self.canvas.itemconfigure(self.digit_items[digit], state="normal")
+        self.visible_digit = digit
+        self.update_cost_ns[digit].add(self.clock_ns() - start_ns)
+        self._painting_digit = digit
+
+    def hide_digit(self):
+        if self.visible_digit is not None:
+            self.canvas.itemconfigure(self.digit_items[self.visible_digit], state="hidden")
+            self.visible_digit = None
+
+    def show_feedback(self, message, color):
+        item = self._feedback_item(message, color)
+        if self.visible_feedback is not None and self.visible_feedback != item:
+            self.canvas.itemconfigure(self.visible_feedback, state="hidden")
+        self.canvas.itemconfigure(item, state="normal")
+        self.visible_feedback = item
+
+    def hide_feedback(self):
+        if self.visible_feedback is not None:
+            self.canvas.itemconfigure(self.visible_feedback, state="hidden")
+            self.visible_feedback = None
+
+    def clear(self):
+        self.hide_digit()
+        self.hide_feedback()
+
+    def flush(self, update_idletasks):
+        # 保留中の再描画を実行させ、数字を表示した直後ならその時間を記録する
+        digit, self._painting_digit = self._painting_digit, None
+        start_ns = self.clock_ns()
+        update_idletasks()
+        if digit is not None:
+            self.paint_cost_ns[digit].add(self.clock_ns() - start_ns)
+
+    def cost_summary(self):
+        # 数字ごとの {count, mean_us, max_us}。表示していない数字は含めない
+        def summarize(costs):
+            return {str(digit): {"count": stats.count, "mean_us": round(stats.mean / 1000, 3), "max_us": round(stats.max / 1000, 3)}
+                    for digit, stats in costs.items() if stats.count}
+        return {"update": summarize(self.update_cost_ns), "paint": summarize(self.paint_cost_ns)}
@@ -0,0 +1,304 @@
+# pvt_replay.py
+# 記録済みセッションを別のしきい値 (フライング判定・ラプス・反応窓) で採点し直す。
+# 試行をセッション × 試行の固定幅配列 (アーカイブ) に詰めておき、しきい値の組み合わせを NumPy でまとめて採点する。
+# しきい値ごとの比較はしきい値の「種類」の数だけ行い、組み合わせ (直積) は集計済みの件数の足し引きで作るので、
+# 数十通りの組み合わせでも全データを読み直したり試行を組み合わせの数だけ比べたりしない。
+# 使い方: python pvt_replay.py pack ROOT [ROOT ...] -o archive.npz [-j プロセス数]
+#         python pvt_replay.py sweep archive.npz --anticipation 100 150 --lapse 500 --limit 1500 [--csv out.csv]
+
+import argparse
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pvt_batch import LEGACY_SETTINGS, find_session_files
+from pvt_compact import ARRAY_SUFFIX, META_SUFFIX, compact_to_session
+from pvt_stats import LAPSE_THRESHOLD_MS
+
+ARCHIVE_FORMAT_VERSION = 1
+# セッションごとの採点結果 (count_outcomes と同じ名前 + ラプス・打ち切り・RT)
+SCORE_FIELDS = (
+    "correct_go_responses", "correct_no_go_responses", "commission_errors", "outliers_commission_too_fast",
+    "outliers_omission_too_late", "lapses", "censored_trials", "mean_rt_ms", "median_rt_ms"
+)
+
+
+def session_events(data):
+    # セッションJSON (dict) から採点に必要な列を取り出す
+    # observed_ms: 反応を待った時間。無反応の試行は反応窓が実際に開いていた時間 (より長い反応窓では採点できない)
+    settings = {**LEGACY_SETTINGS, **data.get("test_settings", {})}
+    trials = data["trials"]
+    n = len(trials)
+    rt = np.fromiter((np.nan if t["reaction_time_ms"] is None else t["reaction_time_ms"] for t in trials),
+                     dtype=np.float64, count=n)
+    window = np.fromiter((settings["response_limit_ms"] if t.get("response_window_actual_ms") is None
+                          else t["response_window_actual_ms"] for t in trials), dtype=np.float64, count=n)
+    offsets = [t.get("response_offsets_ms") for t in trials]
+    has_raw = n > 0 and all(o is not None for o in offsets)
+    return {
+        "is_target": np.fromiter((t["is_target"] for t in trials), dtype=bool, count=n),
+        "rt_ms": rt,
+        "observed_ms": np.where(np.isnan(rt), window, rt),
+        # ISI 中の押下 (提示前のフライング)。押下を記録していない古いセッションは -1
+        "false_starts": sum(1 for o in offsets for offset in o if offset < 0) if has_raw else -1,
+        "response_outlier_ms": settings["response_outlier_ms"],
+        "response_limit_ms": settings["response_limit_ms"],
+        "datetime_iso": data.get("datetime_iso", "")
+    }
+
+
+def load_session_events(path):
+    # ワーカープロセスで実行する。戻り値: (パス, 列 dict) / 読めなければ (パス, None, エラー)
+    try:
+        if path.endswith(ARRAY_SUFFIX):
+            data = compact_to_session(path[:-len(ARRAY_SUFFIX)])
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        return path, session_events(data), None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def find_sources(roots):
+    # セッションJSONとコンパクト形式 (.npy + .meta) の (参加者ID, パス)。同じセッションの JSON があればそちらを使う
+    found = find_session_files(roots)
+    json_bases = {path[:-len(".json")] for _, path in found}
+    for root in roots:
+        root = os.path.abspath(root)
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            relative = os.path.relpath(dirpath, root)
+            participant = os.path.basename(root) if relative == "." else relative.split(os.sep)[0]
+            for name in sorted(filenames):
+                base = os.path.join(dirpath, name[:-len(ARRAY_SUFFIX)])
+                if name.endswith(ARRAY_SUFFIX) and os.path.exists(base + META_SUFFIX) and base not in json_bases:
+                    found.append((participant, base + ARRAY_SUFFIX))
+    return found
+
+
+class EventArchive:
+    # セッション × 試行 (最長のセッションに合わせて詰め物をする) の配列。valid が False の位置は詰め物
+    def __init__(self, participant, source_path, datetime_iso, is_target, rt_ms, observed_ms, valid,
+                 false_starts, response_outlier_ms, response_limit_ms):
+        self.participant = participant
+        self.source_path = source_path
+        self.datetime_iso = datetime_iso
+        self.is_target = is_target
+        self.rt_ms = rt_ms # 無反応・詰め物は NaN
+        self.observed_ms = observed_ms
+        self.valid = valid
+        self.false_starts = false_starts
+        self.response_outlier_ms = response_outlier_ms # 記録時のしきい値
+        self.response_limit_ms = response_limit_ms
+
+    def __len__(self):
+        return len(self.participant)
+
+    @classmethod
+    def from_events(cls, events, participants=None, source_paths=None):
+        # events: session_events の戻り値のリスト
+        n_sessions = len(events)
+        width = max((len(e["rt_ms"]) for e in events), default=0)
+        is_target = np.zeros((n_sessions, width), dtype=bool)
+        rt = np.full((n_sessions, width), np.nan)
+        observed = np.full((n_sessions, width), np.nan)
+        valid = np.zeros((n_sessions, width), dtype=bool)
+        for row, e in enumerate(events):
+            n = len(e["rt_ms"])
+            is_target[row, :n] = e["is_target"]
+            rt[row, :n] = e["rt_ms"]
+            observed[row, :n] = e["observed_ms"]
+            valid[row, :n] = True
+        return cls(
+            participant=np.array(participants if participants is not None else [""] * n_sessions, dtype=str),
+            source_path=np.array(source_paths if source_paths is not None else [""] * n_sessions, dtype=str),
+            datetime_iso=np.array([e["datetime_iso"] for e in events], dtype=str),
+            is_target=is_target,
+            rt_ms=rt,
+            observed_ms=observed,
+            valid=valid,
+            false_starts=np.array([e["false_starts"] for e in events], dtype=np.int64),
+            response_outlier_ms=np.array([e["response_outlier_ms"] for e in events], dtype=np.float64),
+            response_limit_ms=np.array([e["response_limit_ms"] for e in events], dtype=np.float64)
+        )
+
+    @classmethod
+    def from_sessions(cls, sessions, participants=None):
+        return cls.from_events([session_events(s) for s in sessions], participants)
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, format_version=ARCHIVE_FORMAT_VERSION,
+                            **{name: value for name, value in vars(self).items()})
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz["format_version"]) != ARCHIVE_FORMAT_VERSION:
+                raise ValueError(f"対応していないアーカイブ形式です: {path}")
+            return cls(**{name: npz[name] for name in npz.files if name != "format_version"})
+
+
+def build_archive(roots, jobs=None):
+    # 戻り値: (EventArchive, {パス: エラー})
+    sources = find_sources(roots)
+    participants = {path: participant for participant, path in sources}
+    loaded = {}
+    errors = {}
+    if sources:
+        paths = [path for _, path in sources]
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            chunksize = max(1, len(paths) // ((jobs or os.cpu_count() or 1) * 4))
+            for path, events, error in pool.map(load_session_events, paths, chunksize=chunksize):
+                if events is None:
+                    errors[path] = error
+                    print(f"読み込めませんでした: {path}: {error}")
+                else:
+                    loaded[path] = events
+    ordered = sorted(loaded, key=lambda path: (participants[path], loaded[path]["datetime_iso"], path))
+    archive = EventArchive.from_events([loaded[path] for path in ordered],
+                                       [participants[path] for path in ordered], ordered)
+    return archive, errors
+
+
+def _count(values, thresholds, inclusive):
+    # (しきい値, セッション) ごとに values (セッション × 試行) のうち threshold 未満 (inclusive なら以下) の数
+    thresholds = thresholds[:, None, None]
+    hits = values[None] <= thresholds if inclusive else values[None] < thresholds
+    return hits.sum(axis=2)
+
+
+def rescore(archive, anticipation_ms=(100,), lapse_ms=(LAPSE_THRESHOLD_MS,), response_limit_ms=(1500,)):
+    # 3つのしきい値の直積で全セッションを採点し直す。戻り値: 名前 -> 配列
+    #   anticipation_ms / lapse_ms / response_limit_ms: 長さ C (組み合わせ)
+    #   SCORE_FIELDS: (C, セッション数)。false_starts / total_trials はしきい値によらないので (セッション数,)
+    # 判定は PVTEngine と同じ: 反応窓以内の反応のうち anticipation 未満は TooFast、NoGo 試行なら誤反応、
+    # Go 試行なら正反応。ラプスは pvt_analytics と同じく lapse より遅い正反応 + Go 試行の見逃し
+    combos = np.array(list(itertools.product(np.atleast_1d(anticipation_ms), np.atleast_1d(lapse_ms),
+                                             np.atleast_1d(response_limit_ms))), dtype=np.float64).reshape(-1, 3)
+    anticipations, ia = np.unique(combos[:, 0], return_inverse=True)
+    lapses, ip = np.unique(combos[:, 1], return_inverse=True)
+    limits, il = np.unique(combos[:, 2], return_inverse=True)
+
+    responded = archive.valid & ~np.isnan(archive.rt_ms)
+    go = archive.valid & ~archive.is_target
+    nogo = archive.valid & archive.is_target
+    # 反応した試行の RT をセッションごとに昇順に並べる (反応していない位置は inf で末尾へ)
+    go_rt = np.sort(np.where(go & responded, archive.rt_ms, np.inf), axis=1)
+    nogo_rt = np.where(nogo & responded, archive.rt_ms, np.inf)
+    timeout_window = np.where(archive.valid & ~responded, archive.observed_ms, np.inf)
+
+    go_below = _count(go_rt, anticipations, False)[ia]
+    go_within = _count(go_rt, limits, True)[il]
+    go_fast_enough = np.minimum(go_below, go_within)
+    nogo_below = _count(nogo_rt, anticipations, False)[ia]
+    nogo_within = _count(nogo_rt, limits, True)[il]
+    nogo_fast_enough = np.minimum(nogo_below, nogo_within)
+    go_not_slow = _count(go_rt, lapses, True)[ip]
+
+    correct_go = go_within - go_fast_enough
+    omissions = go.sum(axis=1) - go_within
+    # 正反応は並べた go_rt の [go_fast_enough, go_within) の範囲。平均は累積和、中央値は位置で取る
+    width = go_rt.shape[1]
+    cumulative = np.zeros((len(archive), width + 1))
+    np.cumsum(np.where(np.isinf(go_rt), 0.0, go_rt), axis=1, out=cumulative[:, 1:])
+    sessions = np.arange(len(archive))[None, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_rt = np.where(correct_go > 0, (cumulative[sessions, go_within] - cumulative[sessions, go_fast_enough])
+                           / np.maximum(correct_go, 1), np.nan)
+    if width:
+        lower = np.minimum(go_fast_enough + (correct_go - 1) // 2, width - 1)
+        upper = np.minimum(go_fast_enough + correct_go // 2, width - 1)
+        median_rt = np.where(correct_go > 0, (go_rt[sessions, lower] + go_rt[sessions, upper]) / 2, np.nan)
+    else:
+        median_rt = np.full(correct_go.shape, np.nan)
+
+    return {
+        "anticipation_ms": combos[:, 0],
+        "lapse_ms": combos[:, 1],
+        "response_limit_ms": combos[:, 2],
+        "correct_go_responses": correct_go,
+        "correct_no_go_responses": nogo.sum(axis=1) - nogo_within,
+        "commission_errors": nogo_within - nogo_fast_enough,
+        "outliers_commission_too_fast": go_fast_enough + nogo_fast_enough,
+        "outliers_omission_too_late": omissions,
+        "lapses": np.maximum(go_within - np.maximum(go_fast_enough, go_not_slow), 0) + omissions,
+        # 記録時より長い反応窓を指定した場合、実際にはそこまで待っていない無反応の試行の数
+        "censored_trials": _count(timeout_window, limits, False)[il],
+        "mean_rt_ms": mean_rt,
+        "median_rt_ms": median_rt,
+        "false_starts": archive.false_starts,
+        "total_trials": archive.valid.sum(axis=1)
+    }
+
+
+def sweep_summary(scores):
+    # 組み合わせごとに全セッションをまとめた行 (dict) のリスト
+    rows = []
+    n_sessions = len(scores["total_trials"])
+
+    def mean(name, c):
+        return round(float(scores[name][c].mean()), 3) if n_sessions else None
+
+    for c in range(len(scores["anticipation_ms"])):
+        median_rt = scores["median_rt_ms"][c]
+        has_rt = ~np.isnan(median_rt)
+        rows.append({
+            "anticipation_ms": float(scores["anticipation_ms"][c]),
+            "lapse_ms": float(scores["lapse_ms"][c]),
+            "response_limit_ms": float(scores["response_limit_ms"][c]),
+            "sessions": n_sessions,
+            "mean_lapses": mean("lapses", c),
+            "mean_too_fast": mean("outliers_commission_too_fast", c),
+            "mean_commission_errors": mean("commission_errors", c),
+            "mean_omissions": mean("outliers_omission_too_late", c),
+            "median_of_median_rt_ms": round(float(np.median(median_rt[has_rt])), 3) if has_rt.any() else None,
+            "censored_trials": int(scores["censored_trials"][c].sum())
+        })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="記録済みセッションを別のしきい値で採点し直す")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack = commands.add_parser("pack", help="セッションJSON / コンパクト形式のツリーをアーカイブ (NPZ) にまとめる")
+    pack.add_argument("roots", nargs="+", help="参加者ごとのディレクトリを含むルート")
+    pack.add_argument("-o", "--output", default="archive.npz")
+    pack.add_argument("-j", "--jobs", type=int, help="ワーカープロセス数 (既定: CPU数)")
+    sweep = commands.add_parser("sweep", help="しきい値の組み合わせごとに採点し直す")
+    sweep.add_argument("archive", help="pack で作ったアーカイブ")
+    sweep.add_argument("--anticipation", type=float, nargs="+", default=[100], help="フライング (TooFast) とする RT 未満 (ms)")
+    sweep.add_argument("--lapse", type=float, nargs="+", default=[LAPSE_THRESHOLD_MS], help="ラプスとする RT 超 (ms)")
+    sweep.add_argument("--limit", type=float, nargs="+", default=[1500], help="反応窓 (ms)")
+    sweep.add_argument("--csv", help="組み合わせごとの集計を書き出す CSV")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        archive, errors = build_archive(args.roots, args.jobs)
+        archive.save(args.output)
+        print(f"{len(archive)} 件のセッションを {args.output} にまとめました (失敗 {len(errors)} 件)。")
+        return archive
+
+    archive = EventArchive.load(args.archive)
+    rows = sweep_summary(rescore(archive, args.anticipation, args.lapse, args.limit))
+    for row in rows:
+        print(f"anticipation {row['anticipation_ms']:g} ms, lapse {row['lapse_ms']:g} ms, limit {row['response_limit_ms']:g} ms: "
+              f"ラプス平均 {row['mean_lapses']}, TooFast平均 {row['mean_too_fast']}, "
+              f"RT中央値 {row['median_of_median_rt_ms']} ms, 打ち切り {row['censored_trials']} 試行")
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
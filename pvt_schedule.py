@@ -0,0 +1,209 @@
+# pvt_schedule.py
+# セッション全体の試行計画 (刺激・ISI・期待される反応) を記録したシードから事前に生成する。
+# ターゲットの最大連続数や非ターゲット数字の均等化などの制約を満たすように組み立て、検証する。
+
+import argparse
+import json
+import math
+import random
+
+ISI_DISTRIBUTIONS = ("uniform", "exponential")
+EXPONENTIAL_MEAN_FRACTION = 0.5 # 打ち切り指数分布の平均 (範囲幅に対する比)
+
+
+class TrialSchedule:
+    def __init__(self, seed, target_number, stimuli, isi_ms, constraints=None):
+        self.seed = seed
+        self.target_number = target_number
+        self.stimuli = stimuli # 提示順
+        self.isi_ms = isi_ms # 各試行の刺激前間隔 (ms, 整数)
+        self.constraints = constraints or {}
+
+    def __len__(self):
+        return len(self.stimuli)
+
+    @property
+    def expected_responses(self):
+        # 1: 押すべき (Go), 0: 押さない (NoGo)
+        return [0 if stimulus == self.target_number else 1 for stimulus in self.stimuli]
+
+    def to_dict(self):
+        return {
+            "seed": self.seed,
+            "target_number": self.target_number,
+            "constraints": self.constraints,
+            "stimuli": self.stimuli,
+            "isi_ms": self.isi_ms
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["seed"], data["target_number"], list(data["stimuli"]), list(data["isi_ms"]),
+                   data.get("constraints"))
+
+
+def _target_positions(rng, n_trials, n_targets, max_consecutive_targets):
+    # 非ターゲットの間 (両端を含む n_go + 1 箇所) にターゲットを最大 max_consecutive_targets 個ずつ配る
+    n_go = n_trials - n_targets
+    if max_consecutive_targets is None:
+        return set(rng.sample(range(n_trials), n_targets))
+    if n_targets > max_consecutive_targets * (n_go + 1):
+        raise ValueError(f"ターゲット {n_targets} 個を最大連続 {max_consecutive_targets} 個で配置できません (非ターゲット {n_go} 個)")
+    slots = [gap for gap in range(n_go + 1) for _ in range(max_consecutive_targets)]
+    per_gap = [0] * (n_go + 1)
+    for gap in rng.sample(slots, n_targets):
+        per_gap[gap] += 1
+    positions = set()
+    index = 0
+    for gap, count in enumerate(per_gap):
+        positions.update(range(index, index + count))
+        index += count + 1 # ターゲットの後に非ターゲットが1つ入る
+    return positions
+
+
+def _non_target_digits(rng, target_number, n_go, balance_digits):
+    other_numbers = [n for n in range(1, 10) if n != target_number]
+    if not balance_digits:
+        return [rng.choice(other_numbers) for _ in range(n_go)]
+    # 各数字を n_go // 8 回ずつ、余りはランダムに選んだ数字に1回ずつ
+    digits = other_numbers * (n_go // len(other_numbers)) + rng.sample(other_numbers, n_go % len(other_numbers))
+    rng.shuffle(digits)
+    return digits
+
+
+def _isi_sampler(rng, min_isi_ms, max_isi_ms, isi_distribution):
+    if isi_distribution == "uniform":
+        return lambda: rng.randint(min_isi_ms, max_isi_ms)
+    if isi_distribution == "exponential":
+        # [min, max] で打ち切った指数分布 (逆関数法)。次の刺激がいつ来るか予測しにくくなる
+        span = max_isi_ms - min_isi_ms
+        if span <= 0:
+            return lambda: min_isi_ms
+        rate = 1 / (span * EXPONENTIAL_MEAN_FRACTION)
+        tail = 1 - math.exp(-rate * span)
+        return lambda: min_isi_ms + min(span, round(-math.log(1 - rng.random() * tail) / rate))
+    raise ValueError(f"未対応のISI分布です: {isi_distribution}")
+
+
+def _isi_values(rng, n_trials, min_isi_ms, max_isi_ms, isi_distribution):
+    sample = _isi_sampler(rng, min_isi_ms, max_isi_ms, isi_distribution)
+    return [sample() for _ in range(n_trials)]
+
+
+def generate_schedule(seed, target_number, n_trials, n_targets, min_isi_ms, max_isi_ms,
+                      max_consecutive_targets=None, balance_digits=False, isi_distribution="uniform"):
+    if not 0 <= n_targets <= n_trials:
+        raise ValueError(f"ターゲット数 {n_targets} は 0〜{n_trials} の範囲で指定してください")
+    rng = random.Random(seed)
+    positions = _target_positions(rng, n_trials, n_targets, max_consecutive_targets)
+    digits = iter(_non_target_digits(rng, target_number, n_trials - n_targets, balance_digits))
+    stimuli = [target_number if i in positions else next(digits) for i in range(n_trials)]
+    isi_ms = _isi_values(rng, n_trials, min_isi_ms, max_isi_ms, isi_distribution)
+    constraints = {
+        "n_targets": n_targets,
+        "min_isi_ms": min_isi_ms,
+        "max_isi_ms": max_isi_ms,
+        "max_consecutive_targets": max_consecutive_targets,
+        "balance_digits": balance_digits,
+        "isi_distribution": isi_distribution
+    }
+    return TrialSchedule(seed, target_number, stimuli, isi_ms, constraints)
+
+
+def stimulus_stream(seed, target_number, target_ratio, min_isi_ms, max_isi_ms,
+                    max_consecutive_targets=None, balance_digits=False, isi_distribution="uniform"):
+    # 時間制モード用: (ISI, 刺激) を終わりなく1つずつ生成する。事前に列を作らないのでメモリは一定。
+    # ターゲットは確率 target_ratio で出し、連続数の上限に達したら非ターゲットにする。
+    # balance_digits では非ターゲット数字を8個ずつの袋から取り出し、出現回数の差を1以内に保つ
+    rng = random.Random(seed)
+    sample_isi = _isi_sampler(rng, min_isi_ms, max_isi_ms, isi_distribution)
+    other_numbers = [n for n in range(1, 10) if n != target_number]
+    bag = []
+    run = 0
+    while True:
+        is_target = rng.random() < target_ratio and (max_consecutive_targets is None or run < max_consecutive_targets)
+        if is_target:
+            stimulus = target_number
+            run += 1
+        else:
+            if not balance_digits:
+                stimulus = rng.choice(other_numbers)
+            else:
+                if not bag:
+                    bag = rng.sample(other_numbers, len(other_numbers))
+                stimulus = bag.pop()
+            run = 0
+        yield sample_isi(), stimulus
+
+
+def validate_schedule(schedule):
+    # 制約違反の説明のリストを返す (空なら妥当)
+    constraints = schedule.constraints
+    errors = []
+    if len(schedule.isi_ms) != len(schedule.stimuli):
+        errors.append(f"ISI の数 {len(schedule.isi_ms)} が試行数 {len(schedule.stimuli)} と一致しません")
+    if any(not 1 <= stimulus <= 9 for stimulus in schedule.stimuli):
+        errors.append("1〜9 以外の刺激が含まれています")
+
+    n_targets = schedule.stimuli.count(schedule.target_number)
+    if constraints.get("n_targets") is not None and n_targets != constraints["n_targets"]:
+        errors.append(f"ターゲット数 {n_targets} が指定 {constraints['n_targets']} と一致しません")
+
+    max_run = constraints.get("max_consecutive_targets")
+    if max_run is not None:
+        run = longest = 0
+        for stimulus in schedule.stimuli:
+            run = run + 1 if stimulus == schedule.target_number else 0
+            longest = max(longest, run)
+        if longest > max_run:
+            errors.append(f"ターゲットが {longest} 回連続しています (上限 {max_run})")
+
+    if constraints.get("balance_digits"):
+        counts = [schedule.stimuli.count(n) for n in range(1, 10) if n != schedule.target_number]
+        if max(counts) - min(counts) > 1:
+            errors.append(f"非ターゲット数字の回数が均等ではありません: {counts}")
+
+    min_isi, max_isi = constraints.get("min_isi_ms"), constraints.get("max_isi_ms")
+    if min_isi is not None and max_isi is not None and any(not min_isi <= isi <= max_isi for isi in schedule.isi_ms):
+        errors.append(f"ISI が {min_isi}〜{max_isi}ms の範囲外です")
+    return errors
+
+
+def generate_schedule_bank(base_seed, count, **kwargs):
+    # オフライン用: base_seed から派生させたシードで count 個の計画を作る
+    seeds = random.Random(base_seed)
+    return [generate_schedule(seeds.getrandbits(32), **kwargs) for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="試行計画のバンクを生成・検証して JSON Lines に書き出す")
+    parser.add_argument("output")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--target", type=int, default=0, help="ターゲット数字 (0 は計画ごとにランダム)")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--targets", type=int, default=25)
+    parser.add_argument("--min-isi-ms", type=int, default=500)
+    parser.add_argument("--max-isi-ms", type=int, default=5000)
+    parser.add_argument("--max-consecutive-targets", type=int)
+    parser.add_argument("--balance-digits", action="store_true")
+    parser.add_argument("--isi-distribution", choices=ISI_DISTRIBUTIONS, default="uniform")
+    args = parser.parse_args(argv)
+
+    seeds = random.Random(args.seed)
+    invalid = 0
+    with open(args.output, 'w', encoding='utf-8') as f:
+        for _ in range(args.count):
+            seed = seeds.getrandbits(32)
+            target_number = args.target or random.Random(seed).randint(1, 9)
+            schedule = generate_schedule(seed, target_number, args.trials, args.targets, args.min_isi_ms, args.max_isi_ms,
+                                         args.max_consecutive_targets, args.balance_digits, args.isi_distribution)
+            if validate_schedule(schedule):
+                invalid += 1
+                continue
+            f.write(json.dumps(schedule.to_dict(), separators=(",", ":")) + "\n")
+    print(f"{args.count - invalid} 件の試行計画を {args.output} に書き出しました (不正 {invalid} 件)。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# pvt_session.py
+# 試行記録 (trials) から save_data_to_json と同じ形式のセッションデータを組み立てる。
+# 実行中のアプリ・ストリームログからの復旧のどちらからも使う。
+
+import json
+import os
+import statistics
+
+from pvt_engine import timer_drift_summary
+
+
+def count_outcomes(trials, response_outlier_ms):
+    # 試行記録だけから PVTEngine のカウンタと同じ分類を復元する
+    counts = {
+        "total_trials_conducted": len(trials),
+        "correct_go_responses": 0,
+        "correct_no_go_responses": 0,
+        "commission_errors": 0, # Pressed on target
+        "outliers_commission_too_fast": 0, # Pressed too fast
+        "outliers_omission_too_late": 0 # Timed out on non-target
+    }
+    for trial in trials:
+        rt_ms = trial["reaction_time_ms"]
+        if rt_ms is None:
+            if trial["is_target"]:
+                counts["correct_no_go_responses"] += 1
+            else:
+                counts["outliers_omission_too_late"] += 1
+        elif trial["is_correct"]:
+            counts["correct_go_responses"] += 1
+        elif trial["is_target"] and rt_ms >= response_outlier_ms:
+            counts["commission_errors"] += 1
+        else:
+            counts["outliers_commission_too_fast"] += 1
+    return counts
+
+
+def _mean_and_max(values, digits):
+    if not values:
+        return None, None
+    return round(statistics.mean(values), digits), round(max(values), digits)
+
+
+def build_session_data(timestamp_iso, test_settings, trials, counts=None, rt_values=None):
+    # counts / rt_values (平均, 最悪, 標準偏差) を省略すると trials から求める
+    from pvt_analytics import rt_summary, summarize_trials # NumPy は保存時まで読み込まない
+    if counts is None:
+        counts = count_outcomes(trials, test_settings["response_outlier_ms"])
+    if rt_values is None:
+        rt_values = rt_summary([t["reaction_time_ms"] for t in trials if t["reaction_time_ms"] is not None])
+
+    total_trials_conducted = counts["total_trials_conducted"]
+    total_correct_responses = counts["correct_go_responses"] + counts["correct_no_go_responses"]
+    accuracy_percent = round((total_correct_responses / total_trials_conducted) * 100, 2) if total_trials_conducted > 0 else 0.0
+
+    avg_rt, worst_rt, rt_std_dev_ms = rt_values
+
+    mean_paint_latency_ms, max_paint_latency_ms = _mean_and_max(
+        [t["paint_latency_ns"] / 1_000_000 for t in trials if t.get("paint_latency_ns") is not None], 3)
+    mean_dispatch_latency_ms, max_dispatch_latency_ms = _mean_and_max(
+        [t["dispatch_latency_ms"] for t in trials if t.get("dispatch_latency_ms") is not None], 3)
+
+    return {
+        "datetime_iso": timestamp_iso,
+        "test_settings": test_settings,
+        "summary_results": {
+            **counts,
+            "accuracy_percentage": accuracy_percent,
+            "average_reaction_time_ms": avg_rt,
+            "worst_reaction_time_ms": worst_rt,
+            "reaction_time_std_dev_ms": rt_std_dev_ms,
+            "mean_paint_latency_ms": mean_paint_latency_ms,
+            "max_paint_latency_ms": max_paint_latency_ms,
+            "mean_dispatch_latency_ms": mean_dispatch_latency_ms,
+            "max_dispatch_latency_ms": max_dispatch_latency_ms,
+            "timer_drift": timer_drift_summary(trials, test_settings["response_limit_ms"], test_settings["feedback_duration_ms"]),
+            "extended_metrics": summarize_trials(trials) # 正反応RTのみを使う標準PVT/GNG指標
+        },
+        "trials": trials
+    }
+
+
+def write_session_json(filepath, data):
+    # 一時ファイルに書いてから置き換える (書き込み途中で落ちても壊れた JSON が残らない)
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, filepath)
+
+
+def session_base_filename(data_dir, timestamp_obj, reserved=()):
+    # YYYY-MM-DD_HH-MM。同じ分に保存済みのセッションがあれば連番を付けて上書きを防ぐ
+    # reserved: まだ書き込まれていない (保存待ちの) ベース名
+    timestamp_str = timestamp_obj.strftime("%Y-%m-%d_%H-%M")
+    base_filename = os.path.join(data_dir, timestamp_str)
+    suffix = 2
+    while os.path.exists(f"{base_filename}.json") or base_filename in reserved:
+        base_filename = os.path.join(data_dir, f"{timestamp_str}_{suffix}")
+        suffix += 1
+    return base_filename
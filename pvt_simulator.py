@@ -0,0 +1,85 @@
+# pvt_simulator.py
+# モデル被験者で PVTEngine (PVTApp と同じ試行ロジック) を仮想時間で回すシミュレータ。
+# 反応時間は ex-Gaussian (正規分布 + 指数分布) で、見逃し・フライング・NoGo での誤反応を確率で起こす。
+
+import random
+
+from pvt_engine import NullView, PVTEngine, VirtualClock
+
+
+class ParticipantModel:
+    def __init__(self, mu_ms=280.0, sigma_ms=30.0, tau_ms=60.0, lapse_rate=0.03, commission_prob=0.15,
+                 anticipation_rate=0.01, nogo_rt_scale=0.9):
+        self.mu_ms = mu_ms
+        self.sigma_ms = sigma_ms
+        self.tau_ms = tau_ms # 指数成分の平均 (右裾の長さ)
+        self.lapse_rate = lapse_rate # Go試行で反応しない確率
+        self.commission_prob = commission_prob # NoGo試行で押してしまう確率
+        self.anticipation_rate = anticipation_rate # 刺激を見る前に押す確率 (RT < 100ms)
+        self.nogo_rt_scale = nogo_rt_scale # 誤反応は速い反応で起こりやすい
+
+    def sample_rt_ms(self, rng):
+        return max(1.0, rng.gauss(self.mu_ms, self.sigma_ms) + rng.expovariate(1 / self.tau_ms))
+
+    def response_ms(self, rng, is_target, response_outlier_ms):
+        # 押すまでの時間 (ms)。押さない場合は None
+        if rng.random() < self.anticipation_rate:
+            return rng.uniform(1, response_outlier_ms)
+        if is_target:
+            return self.sample_rt_ms(rng) * self.nogo_rt_scale if rng.random() < self.commission_prob else None
+        return None if rng.random() < self.lapse_rate else self.sample_rt_ms(rng)
+
+
+class SimulatedParticipant(NullView):
+    # ビューとしてエンジンに渡し、刺激が出たら反応をスケジューラに登録する
+    def __init__(self, model, rng):
+        self.model = model
+        self.rng = rng
+        self.engine = None
+        self.press_timer_id = None
+        self.finished = False
+
+    def show_stimulus(self, stimulus):
+        engine = self.engine
+        delay_ms = self.model.response_ms(self.rng, stimulus == engine.target_number, engine.response_outlier_ms)
+        if delay_ms is not None:
+            self.press_timer_id = engine.scheduler.after(delay_ms, self.press)
+
+    def clear_stimulus(self):
+        if self.press_timer_id is not None: # 反応窓が閉じたら押下は取り消す
+            self.engine.scheduler.after_cancel(self.press_timer_id)
+            self.press_timer_id = None
+
+    def press(self):
+        self.press_timer_id = None
+        self.engine.handle_response()
+
+    def test_finished(self):
+        self.finished = True
+
+
+def build_simulated_session(model, seed, max_trials=100, target_trials=25, target_number=0,
+                            response_limit_ms=1500, feedback_duration_ms=1000, min_interval_s=0.5, max_interval_s=5.0):
+    # 開始前のエンジンと仮想時計を返す (リスナーを足してから engine.start() / clock.run() する)
+    rng = random.Random(seed)
+    clock = VirtualClock()
+    participant = SimulatedParticipant(model, random.Random(rng.getrandbits(32)))
+    engine = PVTEngine(scheduler=clock, clock=clock, view=participant, rng=random.Random(rng.getrandbits(32)))
+    participant.engine = engine
+    engine.max_trials = max_trials
+    engine.target_trials = target_trials
+    engine.target_number = target_number
+    engine.response_limit_ms = response_limit_ms
+    engine.feedback_duration_ms = feedback_duration_ms
+    engine.min_interval_s = min_interval_s
+    engine.max_interval_s = max_interval_s
+    engine.choose_target_number()
+    engine.generate_sequence()
+    return engine, clock
+
+
+def simulate_session(model, seed, **settings):
+    engine, clock = build_simulated_session(model, seed, **settings)
+    engine.start()
+    clock.run()
+    return engine
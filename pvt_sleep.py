@@ -0,0 +1,258 @@
+# pvt_sleep.py
+# 睡眠記録の取り込みと、セッションとの結合・解析。
+# 睡眠トラッカーのCSV (Fitbit / Oura / 汎用) や手入力の記録を「夜」単位でセッションストアに保存し、
+# 各セッションを直前の夜の主睡眠 (夜ごとに最も長い記録のうち、セッション開始前に起床した最新のもの) と結び付けて
+# 相関と回帰を求める。昼寝などの短い記録は同じ夜の主睡眠を置き換えない。
+# 使い方:
+#   python pvt_sleep.py import sleep.csv [--db recoded_data/sessions.sqlite3]
+#   python pvt_sleep.py add 2025-01-01T23:30 2025-01-02T07:00 [--asleep-minutes 420]
+#   python pvt_sleep.py report
+
+import argparse
+import csv
+import datetime
+import json
+import os
+
+import numpy as np
+
+from pvt_store import STORE_FILENAME, SessionStore
+
+NIGHT_BOUNDARY_HOURS = 12 # 正午より前の就寝は前日の夜として扱う
+MAX_WAKE_TO_SESSION_HOURS = 24 # これより前に起床した記録はセッションに結び付けない
+
+# ヘッダー (小文字) -> 項目。トラッカーごとの列名の違いを吸収する
+COLUMN_ALIASES = {
+    "bedtime": ("start time", "bedtime_start", "bedtime", "sleep start", "start", "from"),
+    "wake": ("end time", "bedtime_end", "wake_time", "wake", "sleep end", "end", "to"),
+    "asleep_minutes": ("minutes asleep", "asleep_minutes"),
+    "asleep_seconds": ("total_sleep_duration", "total sleep duration"),
+    "asleep_hours": ("asleep_hours", "hours asleep", "hours"),
+    "time_in_bed_minutes": ("time in bed", "time_in_bed_minutes"),
+    "time_in_bed_seconds": ("time_in_bed",)
+}
+DATETIME_FORMATS = ("%Y-%m-%d %I:%M%p", "%Y-%m-%d %I:%M %p", "%Y-%m-%d %H:%M", "%Y/%m/%d %H:%M", "%d. %m. %Y %H:%M")
+
+SLEEP_VARIABLES = ("sleep_hours", "time_in_bed_hours", "bedtime_hour", "wake_hour", "hours_awake")
+PERFORMANCE_VARIABLES = ("median_rt_ms", "lapses", "accuracy_percentage")
+
+
+def parse_datetime(text):
+    # タイムゾーン付きの値はその土地の時刻 (壁時計) のまま扱う。セッションの時刻もローカル時刻のため
+    text = text.strip()
+    try:
+        value = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in DATETIME_FORMATS:
+            try:
+                value = datetime.datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"日時として読めません: {text!r}")
+    return value.replace(tzinfo=None)
+
+
+def night_date(bedtime):
+    return (bedtime - datetime.timedelta(hours=NIGHT_BOUNDARY_HOURS)).date().isoformat()
+
+
+def make_sleep_record(bedtime, wake, asleep_minutes=None, time_in_bed_minutes=None, source="manual"):
+    if wake <= bedtime:
+        raise ValueError(f"起床時刻 {wake} が就寝時刻 {bedtime} より前です")
+    if time_in_bed_minutes is None:
+        time_in_bed_minutes = (wake - bedtime).total_seconds() / 60
+    return {
+        "night_date": night_date(bedtime),
+        "bedtime_iso": bedtime.isoformat(timespec="minutes"),
+        "wake_iso": wake.isoformat(timespec="minutes"),
+        "asleep_minutes": asleep_minutes if asleep_minutes is not None else time_in_bed_minutes,
+        "time_in_bed_minutes": time_in_bed_minutes,
+        "source": source
+    }
+
+
+def _find_columns(fieldnames):
+    normalized = {name.strip().lower(): name for name in fieldnames if name}
+    columns = {}
+    for key, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                columns[key] = normalized[alias]
+                break
+    if "bedtime" not in columns or "wake" not in columns:
+        raise ValueError(f"就寝・起床時刻の列が見つかりません: {fieldnames}")
+    return columns
+
+
+def _number(row, columns, key, scale):
+    column = columns.get(key)
+    if column is None or not (row.get(column) or "").strip():
+        return None
+    return float(row[column].replace(",", "")) * scale
+
+
+def read_sleep_csv(path, source=None):
+    # 戻り値: (記録のリスト, 読めなかった行のリスト)
+    source = source or os.path.basename(path)
+    records = []
+    skipped = []
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        columns = _find_columns(reader.fieldnames or [])
+        for line_number, row in enumerate(reader, start=2):
+            try:
+                bedtime = parse_datetime(row[columns["bedtime"]])
+                wake = parse_datetime(row[columns["wake"]])
+                asleep = next((v for v in (_number(row, columns, "asleep_minutes", 1),
+                                           _number(row, columns, "asleep_seconds", 1 / 60),
+                                           _number(row, columns, "asleep_hours", 60)) if v is not None), None)
+                in_bed = next((v for v in (_number(row, columns, "time_in_bed_minutes", 1),
+                                           _number(row, columns, "time_in_bed_seconds", 1 / 60)) if v is not None), None)
+                records.append(make_sleep_record(bedtime, wake, asleep, in_bed, source))
+            except (ValueError, TypeError, AttributeError) as e:
+                skipped.append((line_number, str(e)))
+    return records, skipped
+
+
+def _hours_of_day(iso_values, noon_based=False):
+    # 時刻 (時間単位)。noon_based=True なら正午からの時間 (23:30 -> 11.5, 01:00 -> 13.0) で就寝時刻を連続にする
+    hours = np.array([int(v[11:13]) + int(v[14:16]) / 60 for v in iso_values], dtype=np.float64)
+    return (hours - 12) % 24 if noon_based else hours
+
+
+def _to_datetime64(iso_values):
+    return np.array([v[:16] for v in iso_values], dtype="datetime64[m]")
+
+
+def main_sleep_episodes(sleep_records):
+    # 夜 (night_date) ごとに眠った時間 (無ければ床にいた時間) が最も長い記録を主睡眠とする。起床時刻の昇順で返す
+    main = {}
+    for record in sleep_records:
+        length = record["asleep_minutes"] if record["asleep_minutes"] is not None else record["time_in_bed_minutes"] or 0
+        night = record["night_date"]
+        if night not in main or length > main[night][0]:
+            main[night] = (length, record)
+    return sorted((record for _, record in main.values()), key=lambda r: r["wake_iso"])
+
+
+def join_sessions_to_sleep(sessions, sleep_records, max_gap_hours=MAX_WAKE_TO_SESSION_HOURS):
+    # sessions: SessionStore.query_sessions() の行, sleep_records: SessionStore.sleep_records() の行
+    # 各セッションに、開始前に起床した最新の夜の主睡眠を二分探索でまとめて対応させる (昼寝には結び付けない)。
+    # 戻り値は列 (NumPy 配列) の dict
+    n = len(sessions)
+    table = {
+        "datetime_iso": np.array([s["datetime_iso"] for s in sessions], dtype=str),
+        **{name: np.array([np.nan if s.get(name) is None else s[name] for s in sessions], dtype=np.float64)
+           for name in PERFORMANCE_VARIABLES},
+        **{name: np.full(n, np.nan) for name in SLEEP_VARIABLES},
+        "night_date": np.full(n, "", dtype=object)
+    }
+    if n == 0 or not sleep_records:
+        return table
+
+    sleep_records = main_sleep_episodes(sleep_records)
+    wake_times = _to_datetime64([r["wake_iso"] for r in sleep_records]) # 起床時刻の昇順
+    session_times = _to_datetime64(table["datetime_iso"])
+    index = np.searchsorted(wake_times, session_times, side="right") - 1
+    hours_awake = (session_times - wake_times[np.maximum(index, 0)]).astype(np.float64) / 60
+    matched = (index >= 0) & (hours_awake <= max_gap_hours)
+    rows = index[matched]
+
+    asleep = np.array([np.nan if r["asleep_minutes"] is None else r["asleep_minutes"] for r in sleep_records]) / 60
+    in_bed = np.array([np.nan if r["time_in_bed_minutes"] is None else r["time_in_bed_minutes"] for r in sleep_records]) / 60
+    bedtime_hour = _hours_of_day([r["bedtime_iso"] for r in sleep_records], noon_based=True)
+    wake_hour = _hours_of_day([r["wake_iso"] for r in sleep_records])
+    nights = np.array([r["night_date"] for r in sleep_records], dtype=object)
+
+    table["sleep_hours"][matched] = asleep[rows]
+    table["time_in_bed_hours"][matched] = in_bed[rows]
+    table["bedtime_hour"][matched] = bedtime_hour[rows] # 正午からの時間
+    table["wake_hour"][matched] = wake_hour[rows]
+    table["hours_awake"][matched] = hours_awake[matched]
+    table["night_date"][matched] = nights[rows]
+    return table
+
+
+def correlation_summary(table, sleep_variables=SLEEP_VARIABLES, performance_variables=PERFORMANCE_VARIABLES):
+    # 全ての (睡眠変数, 成績変数) の組について Pearson r と単回帰 (成績 = 切片 + 傾き × 睡眠) を求める
+    x = np.column_stack([table[name] for name in sleep_variables]) # (n, p)
+    y = np.column_stack([table[name] for name in performance_variables]) # (n, q)
+    valid = ~np.isnan(x)[:, :, None] & ~np.isnan(y)[:, None, :] # (n, p, q)
+    xs = np.where(valid, x[:, :, None], 0.0)
+    ys = np.where(valid, y[:, None, :], 0.0)
+    count = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x = xs.sum(axis=0) / count
+        mean_y = ys.sum(axis=0) / count
+        dx = np.where(valid, xs - mean_x, 0.0)
+        dy = np.where(valid, ys - mean_y, 0.0)
+        sxx = (dx * dx).sum(axis=0)
+        syy = (dy * dy).sum(axis=0)
+        sxy = (dx * dy).sum(axis=0)
+        r = sxy / np.sqrt(sxx * syy)
+        slope = sxy / sxx
+        intercept = mean_y - slope * mean_x
+
+    summary = []
+    for i, x_name in enumerate(sleep_variables):
+        for j, y_name in enumerate(performance_variables):
+            enough = count[i, j] >= 3
+            summary.append({
+                "sleep_variable": x_name,
+                "performance_variable": y_name,
+                "n": int(count[i, j]),
+                "pearson_r": _rounded(r[i, j]) if enough else None,
+                "r_squared": _rounded(r[i, j] ** 2) if enough else None,
+                "slope": _rounded(slope[i, j]) if enough else None, # 睡眠変数1単位 (時間) あたりの変化
+                "intercept": _rounded(intercept[i, j]) if enough else None
+            })
+    return summary
+
+
+def _rounded(value):
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else round(value, 4)
+
+
+def sleep_report(store, start=None, end=None):
+    sessions = store.query_sessions(start=start, end=end)
+    table = join_sessions_to_sleep(sessions, store.sleep_records())
+    matched = int((~np.isnan(table["sleep_hours"])).sum())
+    return {"sessions": len(sessions), "sessions_with_sleep": matched, "correlations": correlation_summary(table)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="睡眠記録の取り込みとセッションとの結合解析")
+    parser.add_argument("--db", default=os.path.join("recoded_data", STORE_FILENAME))
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="睡眠トラッカーのCSVを取り込む")
+    import_parser.add_argument("csv_files", nargs="+")
+    add_parser = commands.add_parser("add", help="睡眠を手入力で記録する")
+    add_parser.add_argument("bedtime", help="就寝時刻 (例: 2025-01-01T23:30)")
+    add_parser.add_argument("wake", help="起床時刻 (例: 2025-01-02T07:00)")
+    add_parser.add_argument("--asleep-minutes", type=float)
+    report_parser = commands.add_parser("report", help="直前の睡眠と成績の相関・回帰を表示する")
+    report_parser.add_argument("--start")
+    report_parser.add_argument("--end")
+    args = parser.parse_args(argv)
+
+    with SessionStore(args.db) as store:
+        if args.command == "import":
+            for path in args.csv_files:
+                records, skipped = read_sleep_csv(path)
+                store.add_sleep_records(records)
+                print(f"{path}: {len(records)} 件の睡眠記録を取り込みました (読めなかった行 {len(skipped)} 件)。")
+                for line_number, error in skipped:
+                    print(f"  {line_number} 行目: {error}")
+        elif args.command == "add":
+            record = make_sleep_record(parse_datetime(args.bedtime), parse_datetime(args.wake), args.asleep_minutes)
+            store.add_sleep_records([record])
+            print(f"{record['night_date']} の夜の睡眠を記録しました。")
+        else:
+            print(json.dumps(sleep_report(store, args.start, args.end), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# pvt_stats.py
+# 試行ごとに O(1) で更新するオンライン統計。長時間セッションでもRTの配列を再集計せずに
+# 平均・分散・最大/最小・分位点 (P² アルゴリズム) を随時参照できる。
+
+import math
+
+LAPSE_THRESHOLD_MS = 500
+
+
+class RunningStats:
+    # Welford 法による平均・分散と最大/最小
+    def __init__(self, values=()):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        # 標本分散 (statistics.variance と同じ n-1)
+        return self._m2 / (self.count - 1) if self.count >= 2 else None
+
+    @property
+    def stdev(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+
+class P2Quantile:
+    # Jain & Chlamtac の P² アルゴリズム。5つのマーカーだけで分位点を推定する (メモリ O(1))
+    def __init__(self, q):
+        self.q = q
+        self.count = 0
+        self._heights = []
+        self._positions = [1, 2, 3, 4, 5]
+        self._desired = [1, 1 + 2 * q, 1 + 4 * q, 3 + 2 * q, 5]
+        self._increments = [0, q / 2, q, (1 + q) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        if self.count <= 5:
+            self._heights.append(value)
+            self._heights.sort()
+            return
+
+        heights = self._heights
+        if value < heights[0]:
+            heights[0] = value
+            k = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            k = 3
+        else:
+            k = 0
+            while value >= heights[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            self._positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - self._positions[i]
+            if (d >= 1 and self._positions[i + 1] - self._positions[i] > 1) or (d <= -1 and self._positions[i - 1] - self._positions[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if not heights[i - 1] < candidate < heights[i + 1]:
+                    candidate = heights[i] + step * (heights[i + step] - heights[i]) / (self._positions[i + step] - self._positions[i])
+                heights[i] = candidate
+                self._positions[i] += step
+
+    def _parabolic(self, i, step):
+        n = self._positions
+        h = self._heights
+        return h[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+
+    @property
+    def value(self):
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # 少数のうちは保持している値から線形補間で求める
+            position = (self.count - 1) * self.q
+            lower = int(position)
+            upper = min(lower + 1, self.count - 1)
+            return self._heights[lower] + (self._heights[upper] - self._heights[lower]) * (position - lower)
+        return self._heights[2]
+
+
+class LiveSessionStats:
+    # PVTEngine が試行を記録するたびに更新するセッション統計
+    QUANTILES = (0.1, 0.5, 0.9)
+
+    def __init__(self, reaction_times=(), lapse_threshold_ms=LAPSE_THRESHOLD_MS):
+        self.lapse_threshold_ms = lapse_threshold_ms
+        self.all_rt = RunningStats(reaction_times) # 全ての押下 (既存の reaction_times と同じ対象)
+        self.go_rt = RunningStats() # 正反応 (Go) のRT
+        self.go_rt_quantiles = {q: P2Quantile(q) for q in self.QUANTILES}
+        self.trials = 0
+        self.correct = 0
+        self.lapses = 0
+
+    def add_trial(self, trial_outcome):
+        self.trials += 1
+        self.correct += trial_outcome["is_correct"]
+        rt_ms = trial_outcome["reaction_time_ms"]
+        if rt_ms is not None:
+            self.all_rt.add(rt_ms)
+        if trial_outcome["is_target"]:
+            return
+        if rt_ms is None:
+            self.lapses += 1 # Go試行の見逃し
+        elif trial_outcome["is_correct"]:
+            self.go_rt.add(rt_ms)
+            for quantile in self.go_rt_quantiles.values():
+                quantile.add(rt_ms)
+            if rt_ms > self.lapse_threshold_ms:
+                self.lapses += 1
+
+    def rt_summary(self):
+        # pvt_analytics.rt_summary と同じ (平均, 最悪, 標準偏差) を O(1) で返す
+        if self.all_rt.count == 0:
+            return None, None, None
+        stdev = self.all_rt.stdev
+        return round(self.all_rt.mean), round(self.all_rt.max), round(stdev) if stdev is not None else None
+
+    def snapshot(self):
+        return {
+            "trials": self.trials,
+            "accuracy_percentage": round(self.correct / self.trials * 100, 2) if self.trials else 0.0,
+            "mean_go_rt_ms": round(self.go_rt.mean, 3) if self.go_rt.count else None,
+            "median_go_rt_ms": self._quantile(0.5),
+            "p10_go_rt_ms": self._quantile(0.1),
+            "p90_go_rt_ms": self._quantile(0.9),
+            "go_rt_std_dev_ms": round(self.go_rt.stdev, 3) if self.go_rt.stdev is not None else None,
+            "lapses": self.lapses
+        }
+
+    def _quantile(self, q):
+        value = self.go_rt_quantiles[q].value
+        return round(value, 3) if value is not None else None
@@ -0,0 +1,306 @@
+# pvt_store.py
+# recoded_data のセッションJSONをまとめて引けるようにする SQLite ストア。
+# セッションと試行をインデックス付きのテーブルに持ち、日付範囲・ターゲット数字・正答率で検索する。
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import statistics
+
+STORE_FILENAME = "sessions.sqlite3"
+
+TRIAL_COLUMNS = ("trial_number", "pre_stimulus_interval_ms", "stimulus", "is_target", "is_correct", "reaction_time_ms")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    source_path TEXT UNIQUE,
+    station TEXT,
+    datetime_iso TEXT NOT NULL,
+    session_date TEXT NOT NULL,
+    target_number INTEGER,
+    total_trials_conducted INTEGER,
+    correct_go_responses INTEGER,
+    correct_no_go_responses INTEGER,
+    commission_errors INTEGER,
+    outliers_commission_too_fast INTEGER,
+    outliers_omission_too_late INTEGER,
+    accuracy_percentage REAL,
+    average_reaction_time_ms NUMERIC,
+    worst_reaction_time_ms NUMERIC,
+    reaction_time_std_dev_ms NUMERIC,
+    median_rt_ms NUMERIC,
+    lapses INTEGER,
+    test_settings_json TEXT,
+    summary_json TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_datetime ON sessions(datetime_iso);
+CREATE INDEX IF NOT EXISTS idx_sessions_date ON sessions(session_date);
+CREATE INDEX IF NOT EXISTS idx_sessions_target ON sessions(target_number, datetime_iso);
+CREATE INDEX IF NOT EXISTS idx_sessions_accuracy ON sessions(accuracy_percentage);
+
+CREATE TABLE IF NOT EXISTS trials (
+    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    trial_number INTEGER NOT NULL,
+    pre_stimulus_interval_ms INTEGER,
+    stimulus INTEGER,
+    is_target INTEGER,
+    is_correct INTEGER,
+    reaction_time_ms NUMERIC,
+    extra_json TEXT,
+    PRIMARY KEY (session_id, trial_number)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_trials_stimulus ON trials(stimulus);
+
+CREATE TABLE IF NOT EXISTS sleep_records (
+    id INTEGER PRIMARY KEY,
+    night_date TEXT NOT NULL,
+    bedtime_iso TEXT NOT NULL UNIQUE,
+    wake_iso TEXT NOT NULL,
+    asleep_minutes REAL,
+    time_in_bed_minutes REAL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sleep_night ON sleep_records(night_date);
+CREATE INDEX IF NOT EXISTS idx_sleep_wake ON sleep_records(wake_iso);
+"""
+
+SUMMARY_COLUMNS = (
+    "total_trials_conducted", "correct_go_responses", "correct_no_go_responses", "commission_errors",
+    "outliers_commission_too_fast", "outliers_omission_too_late", "accuracy_percentage",
+    "average_reaction_time_ms", "worst_reaction_time_ms", "reaction_time_std_dev_ms"
+)
+# 履歴画面用にセッションごとに持っておく集計 (extended_metrics から)。追加時に1回だけ計算する
+AGGREGATE_COLUMNS = ("median_rt_ms", "lapses")
+
+
+class SessionStore:
+    def __init__(self, db_path, check_same_thread=True):
+        # check_same_thread=False: 複数スレッドから使う場合 (呼び出し側で排他すること。pvt_collector)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_station ON sessions(station, datetime_iso)")
+
+    def _migrate(self):
+        # 集計列・計測端末 (station) 列の無い古いストアには列を足し、集計は保存済みの試行から埋める
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(sessions)")}
+        if "station" not in existing:
+            with self.conn:
+                self.conn.execute("ALTER TABLE sessions ADD COLUMN station TEXT")
+        missing = [column for column in AGGREGATE_COLUMNS if column not in existing]
+        if not missing:
+            return
+        with self.conn:
+            for column in missing:
+                self.conn.execute(f"ALTER TABLE sessions ADD COLUMN {column} {'INTEGER' if column == 'lapses' else 'NUMERIC'}")
+            session_ids = [row[0] for row in self.conn.execute("SELECT id FROM sessions")]
+            for session_id in session_ids:
+                aggregates = self._aggregates({}, self.trials_for_session(session_id))
+                self.conn.execute("UPDATE sessions SET median_rt_ms = ?, lapses = ? WHERE id = ?",
+                                  (*aggregates, session_id))
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_session(self, data, source_path=None, station=None):
+        # 同じ source_path のセッションは置き換える (再インポートしても重複しない)
+        # station: 収集サーバー (pvt_collector) 経由で受け取ったセッションの計測端末名
+        with self.conn:
+            return self._insert_session(data, source_path, station)
+
+    def _insert_session(self, data, source_path, station=None):
+        if source_path is not None:
+            source_path = os.path.abspath(source_path)
+            self.conn.execute("DELETE FROM sessions WHERE source_path = ?", (source_path,))
+        settings = data.get("test_settings", {})
+        summary = data.get("summary_results", {})
+        cursor = self.conn.execute(
+            "INSERT INTO sessions (source_path, station, datetime_iso, session_date, target_number, "
+            + ", ".join(SUMMARY_COLUMNS + AGGREGATE_COLUMNS) + ", test_settings_json, summary_json) VALUES ("
+            + ", ".join("?" * (7 + len(SUMMARY_COLUMNS) + len(AGGREGATE_COLUMNS))) + ")",
+            (source_path, station, data["datetime_iso"], data["datetime_iso"][:10], settings.get("target_number"),
+             *(summary.get(column) for column in SUMMARY_COLUMNS),
+             *self._aggregates(summary, data.get("trials", [])),
+             json.dumps(settings, ensure_ascii=False), json.dumps(summary, ensure_ascii=False)))
+        session_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO trials (session_id, " + ", ".join(TRIAL_COLUMNS) + ", extra_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((session_id, *(trial.get(column) for column in TRIAL_COLUMNS), self._extra_json(trial))
+             for trial in data.get("trials", [])))
+        return session_id
+
+    @staticmethod
+    def _aggregates(summary, trials):
+        # 保存時に計算済みの extended_metrics を使い、無い (古い) セッションだけ試行から計算する
+        metrics = summary.get("extended_metrics")
+        if metrics is None:
+            if not trials:
+                return None, None
+            from pvt_analytics import summarize_trials # NumPy は古いデータの取り込み時だけ
+            metrics = summarize_trials(trials)
+        return tuple(metrics.get(column) for column in AGGREGATE_COLUMNS)
+
+    @staticmethod
+    def _extra_json(trial):
+        extra = {k: v for k, v in trial.items() if k not in TRIAL_COLUMNS}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    def import_json_files(self, paths):
+        # 既存の recoded_data/*.json を一括で取り込む。読めないファイルは飛ばして件数を返す
+        imported = 0
+        with self.conn:
+            for path in paths:
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    self._insert_session(data, path)
+                    imported += 1
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"インポートできませんでした: {path}: {e}")
+        return imported
+
+    def import_json_dir(self, data_dir):
+        return self.import_json_files(sorted(glob.glob(os.path.join(data_dir, "*.json"))))
+
+    def query_sessions(self, start=None, end=None, target_number=None, min_accuracy=None, max_accuracy=None,
+                       station=None):
+        # start/end: "YYYY-MM-DD" (両端を含む) または ISO 日時文字列
+        clauses = []
+        params = []
+        if station is not None:
+            clauses.append("station = ?")
+            params.append(station)
+        if start is not None:
+            clauses.append("datetime_iso >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("datetime_iso <= ?")
+            params.append(end + "T99" if len(end) == 10 else end) # 日付だけなら当日中を含める
+        if target_number is not None:
+            clauses.append("target_number = ?")
+            params.append(target_number)
+        if min_accuracy is not None:
+            clauses.append("accuracy_percentage >= ?")
+            params.append(min_accuracy)
+        if max_accuracy is not None:
+            clauses.append("accuracy_percentage <= ?")
+            params.append(max_accuracy)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = self.conn.execute(
+            "SELECT id, source_path, station, datetime_iso, session_date, target_number, " + ", ".join(SUMMARY_COLUMNS + AGGREGATE_COLUMNS)
+            + " FROM sessions" + where + " ORDER BY datetime_iso", params)
+        return [dict(row) for row in rows]
+
+    def sessions_between(self, start, end):
+        return self.query_sessions(start=start, end=end)
+
+    def sessions_by_target(self, target_number):
+        return self.query_sessions(target_number=target_number)
+
+    def sessions_by_accuracy(self, min_accuracy=None, max_accuracy=None):
+        return self.query_sessions(min_accuracy=min_accuracy, max_accuracy=max_accuracy)
+
+    def trials_for_session(self, session_id):
+        rows = self.conn.execute(
+            "SELECT " + ", ".join(TRIAL_COLUMNS) + ", extra_json FROM trials WHERE session_id = ? ORDER BY trial_number",
+            (session_id,))
+        trials = []
+        for row in rows:
+            trial = {column: row[column] for column in TRIAL_COLUMNS}
+            if row["extra_json"]:
+                trial.update(json.loads(row["extra_json"]))
+            trials.append(trial)
+        return trials
+
+    def daily_trends(self, start=None, end=None):
+        # 日ごとの推移: 中央反応時間 (セッション中央値の中央値)・ラプス (合計)・正答率 (平均)。
+        # セッション行の集計列だけを読むので、履歴が長くてもセッションJSONは読み直さない
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("session_date >= ?")
+            params.append(start[:10])
+        if end is not None:
+            clauses.append("session_date <= ?")
+            params.append(end[:10])
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = self.conn.execute(
+            "SELECT session_date, median_rt_ms, lapses, accuracy_percentage FROM sessions" + where
+            + " ORDER BY session_date", params)
+
+        days = []
+        for row in rows:
+            if not days or days[-1]["session_date"] != row["session_date"]:
+                days.append({"session_date": row["session_date"], "sessions": 0, "_medians": [], "_accuracies": [], "lapses": None})
+            day = days[-1]
+            day["sessions"] += 1
+            if row["median_rt_ms"] is not None:
+                day["_medians"].append(row["median_rt_ms"])
+            if row["accuracy_percentage"] is not None:
+                day["_accuracies"].append(row["accuracy_percentage"])
+            if row["lapses"] is not None:
+                day["lapses"] = (day["lapses"] or 0) + row["lapses"]
+        for day in days:
+            medians = day.pop("_medians")
+            accuracies = day.pop("_accuracies")
+            day["median_rt_ms"] = round(statistics.median(medians), 3) if medians else None
+            day["accuracy_percentage"] = round(statistics.mean(accuracies), 2) if accuracies else None
+        return days
+
+    def add_sleep_records(self, records, source=None):
+        # records: pvt_sleep.SleepRecord の dict 形式。同じ就寝時刻の記録は置き換える
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO sleep_records (night_date, bedtime_iso, wake_iso, asleep_minutes, "
+                "time_in_bed_minutes, source) VALUES (?, ?, ?, ?, ?, ?)",
+                ((r["night_date"], r["bedtime_iso"], r["wake_iso"], r.get("asleep_minutes"),
+                  r.get("time_in_bed_minutes"), r.get("source", source)) for r in records))
+        return len(records)
+
+    def sleep_records(self, start=None, end=None):
+        # start/end: 夜の日付 "YYYY-MM-DD" (両端を含む)
+        clauses = []
+        params = []
+        if start is not None:
+            clauses.append("night_date >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("night_date <= ?")
+            params.append(end)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        rows = self.conn.execute(
+            "SELECT night_date, bedtime_iso, wake_iso, asleep_minutes, time_in_bed_minutes, source FROM sleep_records"
+            + where + " ORDER BY wake_iso", params)
+        return [dict(row) for row in rows]
+
+    def session_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="recoded_data のセッションJSONを SQLite ストアに取り込む")
+    parser.add_argument("data_dir", nargs="?", default="recoded_data")
+    parser.add_argument("--db", help=f"データベースのパス (既定: <data_dir>/{STORE_FILENAME})")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(args.data_dir, STORE_FILENAME)
+    with SessionStore(db_path) as store:
+        imported = store.import_json_dir(args.data_dir)
+        print(f"{imported} 件のセッションを {db_path} に取り込みました (合計 {store.session_count()} 件)。")
+
+
+if __name__ == "__main__":
+    main()
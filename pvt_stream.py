@@ -0,0 +1,177 @@
+# pvt_stream.py
+# 試行ごとに追記する JSON Lines ログ。アプリが落ちても記録済みの試行は失われず、
+# 次回起動時に終了記録のないストリームからセッションJSONを復旧する。
+# 終了記録を書いたストリームは completed/ に移すので、起動時に調べるのは中断されたものだけ (それも最終行だけ読む)。
+
+import json
+import os
+
+from pvt_session import build_session_data, write_session_json
+
+STREAM_DIRNAME = "streams"
+STREAM_SUFFIX = ".jsonl"
+STREAM_FORMAT_VERSION = 1
+COMPLETED_DIRNAME = "completed" # 終了記録を書いたストリームの移動先
+
+
+class TrialStream:
+    def __init__(self, path, fsync_every=10):
+        self.path = path
+        self.fsync_every = fsync_every # fsync をまとめて行う行数 (flush は毎行)
+        self._file = None
+        self._unsynced_lines = 0
+
+    @property
+    def is_open(self):
+        return self._file is not None
+
+    def open(self, timestamp_iso, test_settings):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._write({"type": "session_start", "format_version": STREAM_FORMAT_VERSION,
+                     "datetime_iso": timestamp_iso, "test_settings": test_settings})
+        self._sync()
+
+    def resume(self):
+        # 既存のストリームに追記を再開する。書きかけの行があれば改行で区切る
+        torn = False
+        with open(self.path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if torn:
+            self._file.write("\n")
+
+    def append_trial(self, trial):
+        self._write({"type": "trial", "trial": trial})
+
+    def update_trial(self, trial_number, fields):
+        # 記録後に確定する値 (フィードバックタイマーの実測値など) を追記する
+        self._write({"type": "trial_update", "trial_number": trial_number, **fields})
+
+    def close(self, status="completed", archive=True):
+        # 終了記録を fsync してから completed/ に移す (path は移動先に変わる)
+        if self._file is None:
+            return
+        self._write({"type": "session_end", "status": status})
+        self._sync()
+        self._file.close()
+        self._file = None
+        if archive:
+            self.path = archive_stream(self.path)
+
+    def _write(self, record):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush() # プロセスが落ちてもOSには渡っている
+        self._unsynced_lines += 1
+        if self._unsynced_lines >= self.fsync_every:
+            self._sync()
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced_lines = 0
+
+
+def read_stream(path):
+    # 戻り値: {"header", "trials", "end"}。書きかけの最終行は無視する
+    header = None
+    end = None
+    trials = []
+    trials_by_number = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # Torn write at crash time
+            record_type = record.get("type")
+            if record_type == "session_start":
+                header = record
+            elif record_type == "trial":
+                trial = record["trial"]
+                trials.append(trial)
+                trials_by_number[trial["trial_number"]] = trial
+            elif record_type == "trial_update":
+                trial = trials_by_number.get(record["trial_number"])
+                if trial is not None:
+                    trial.update({k: v for k, v in record.items() if k not in ("type", "trial_number")})
+            elif record_type == "session_end":
+                end = record
+    return {"header": header, "trials": trials, "end": end}
+
+
+def read_last_record(path, block_size=4096):
+    # 最終行だけを読んで返す。書きかけ (改行で終わっていない) や空のファイルは None
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        while True:
+            start = max(0, size - block_size)
+            f.seek(start)
+            lines = f.read().rstrip(b"\n").split(b"\n")
+            if len(lines) > 1 or start == 0:
+                break
+            block_size *= 2 # 最終行がブロックより長い
+    try:
+        return json.loads(lines[-1])
+    except ValueError:
+        return None
+
+
+def archive_stream(path):
+    completed_dir = os.path.join(os.path.dirname(path), COMPLETED_DIRNAME)
+    os.makedirs(completed_dir, exist_ok=True)
+    archived_path = os.path.join(completed_dir, os.path.basename(path))
+    os.replace(path, archived_path)
+    return archived_path
+
+
+def session_from_stream(path):
+    stream = read_stream(path)
+    header = stream["header"]
+    if header is None:
+        return None
+    return build_session_data(header["datetime_iso"], header["test_settings"], stream["trials"])
+
+
+def _scan_streams(stream_dir):
+    # 戻り値: (中断されたストリーム, 終了記録があるのに移していないストリーム)
+    if not stream_dir or not os.path.isdir(stream_dir):
+        return [], []
+    interrupted = []
+    completed = []
+    for name in sorted(os.listdir(stream_dir)):
+        if not name.endswith(STREAM_SUFFIX):
+            continue
+        path = os.path.join(stream_dir, name)
+        last = read_last_record(path)
+        if last is not None and last.get("type") == "session_end":
+            completed.append(path)
+        else:
+            interrupted.append(path)
+    return interrupted, completed
+
+
+def find_interrupted_streams(stream_dir):
+    return _scan_streams(stream_dir)[0]
+
+
+def recover_interrupted_sessions(stream_dir, data_dir):
+    # 中断されたセッションを data_dir にJSONとして書き出し、ストリームを復旧済みとして閉じる
+    recovered = []
+    interrupted, completed = _scan_streams(stream_dir)
+    for path in completed: # completed/ に移す前の形式で残っているもの
+        archive_stream(path)
+    for path in interrupted:
+        data = session_from_stream(path)
+        if data is not None and data["trials"]:
+            data["session_status"] = "recovered"
+            stem = os.path.basename(path)[:-len(STREAM_SUFFIX)]
+            json_filepath = os.path.join(data_dir, f"{stem}_recovered.json")
+            write_session_json(json_filepath, data)
+            recovered.append(json_filepath)
+        stream = TrialStream(path)
+        stream.resume()
+        stream.close(status="recovered" if data is not None and data["trials"] else "discarded")
+    return recovered
@@ -0,0 +1,478 @@
+# pvt_web.py
+# ブラウザ版 GNG-PVT。asyncio の HTTP サーバーが試行計画 (PVTEngine.generate_sequence と同じ規則) を配り、
+# 刺激の提示と反応時間の計測はブラウザ側で performance.now() を使って行う。
+# ブラウザは試行ごとの時刻 (提示・反応・フィードバック終了) をまとめて送り、サーバーはその時刻を時計として
+# 同じ PVTEngine に再生させて採点する。カウンタ・試行記録・セッションJSONの形式はデスクトップ版と同じ。
+# 1プロセスで多数の参加者を受けられるように、リクエストの処理は試行数に比例する軽い計算だけにし、
+# セッションJSONの組み立てと書き込みはスレッドプールで行う。ルートごとの処理時間は /api/stats で確認できる。
+# 使い方: python pvt_web.py [--host 127.0.0.1] [--port 8080] [--data-dir recoded_data]
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import time
+import urllib.parse
+import uuid
+
+from pvt_engine import NullView, PVTEngine
+from pvt_profile import LatencyHistogram
+from pvt_session import build_session_data, session_base_filename, write_session_json
+
+DEFAULT_PORT = 8080
+MAX_BODY_BYTES = 1024 * 1024
+MAX_HEADER_BYTES = 16 * 1024
+SESSION_IDLE_TIMEOUT_S = 2 * 60 * 60 # これより長く何も届かないセッションは破棄する
+DEFAULT_BATCH_SIZE = 10 # ブラウザが一度に送る試行数
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large"}
+
+
+class ClientTimeline:
+    # 参加者のブラウザの performance.now() (ms) を時計にする。エンジンのタイマーは登録だけして発火させず、
+    # 送られてきた時刻の順に WebSession がハンドラを呼ぶ
+    def __init__(self):
+        self._now_ns = 0
+        self._ids = itertools.count()
+
+    def now(self):
+        return self._now_ns / 1_000_000_000
+
+    def now_ns(self):
+        return self._now_ns
+
+    def set_ms(self, time_ms):
+        time_ns = round(float(time_ms) * 1_000_000)
+        if time_ns < self._now_ns:
+            raise ValueError(f"時刻が戻っています: {time_ms}")
+        self._now_ns = time_ns
+
+    def after(self, delay_ms, callback, *args):
+        return f"client#{next(self._ids)}"
+
+    def after_cancel(self, timer_id):
+        pass
+
+
+class WebSession(NullView):
+    def __init__(self, settings, rng=None, participant=None):
+        self.session_id = uuid.uuid4().hex
+        self.participant = participant
+        self.clock = ClientTimeline()
+        self.engine = PVTEngine(scheduler=self.clock, clock=self.clock, view=self, rng=rng)
+        for name, value in settings.items():
+            setattr(self.engine, name, value)
+        self.engine.precise_onset = True # 提示・反応とも performance.now() の値 (ms 未満まで) を使う
+        self.engine.choose_target_number()
+        self.engine.generate_sequence()
+        self.datetime_iso = datetime.datetime.now().isoformat()
+        self.started = False
+        self.finished = False
+        self.last_activity = time.monotonic()
+
+    def plan(self):
+        # ブラウザに渡す内容。刺激とISIは提示順
+        engine = self.engine
+        return {
+            "session_id": self.session_id,
+            "target_number": engine.target_number,
+            "response_limit_ms": engine.response_limit_ms,
+            "response_outlier_ms": engine.response_outlier_ms,
+            "feedback_duration_ms": engine.feedback_duration_ms,
+            "batch_size": DEFAULT_BATCH_SIZE,
+            "trials": [{"stimulus": stimulus, "isi_ms": isi_ms}
+                       for stimulus, isi_ms in zip(engine.schedule.stimuli, engine.schedule.isi_ms)]
+        }
+
+    def test_finished(self):
+        self.finished = True
+
+    def start(self, started_ms):
+        self.clock.set_ms(started_ms)
+        self.started = True
+        self.engine.start()
+
+    def apply_event(self, event):
+        # 1試行分: {trial_number, stimulus, onset_ms, response_ms (無反応なら null), feedback_end_ms}
+        engine = self.engine
+        clock = self.clock
+        if not engine.test_in_progress:
+            raise ValueError("セッションは終了しています")
+        if event["trial_number"] != engine.total_trials_conducted + 1:
+            raise ValueError(f"試行番号が連続していません: {event['trial_number']}")
+        onset_ms = float(event["onset_ms"])
+        clock.set_ms(onset_ms)
+        engine.display_stimulus()
+        if not engine.stimulus_on_screen:
+            raise ValueError("計画より多い試行が送られました")
+        if event.get("stimulus") != engine.current_stimulus:
+            raise ValueError(f"試行 {event['trial_number']} の刺激が計画と一致しません")
+        response_ms = event.get("response_ms")
+        if response_ms is not None and float(response_ms) - onset_ms < engine.response_limit_ms:
+            clock.set_ms(response_ms)
+            engine.handle_response()
+        else: # 反応なし (制限時間を過ぎた反応はデスクトップ版と同じくタイムアウトとして扱う)
+            clock.set_ms(onset_ms + engine.response_limit_ms)
+            engine.handle_timeout()
+        clock.set_ms(max(float(event["feedback_end_ms"]), clock.now_ns() / 1_000_000))
+        engine.clear_feedback_and_proceed()
+
+    def apply_batch(self, batch):
+        if not self.started:
+            self.start(batch["started_ms"])
+        for event in batch.get("events", []):
+            if event["trial_number"] <= self.engine.total_trials_conducted:
+                continue # 応答が届かずに再送されたバッチ (適用済み)
+            self.apply_event(event)
+        if batch.get("complete") and self.engine.test_in_progress: # 途中でやめた
+            self.engine.end_test()
+        self.last_activity = time.monotonic()
+
+    def session_data(self):
+        engine = self.engine
+        counts = {
+            "total_trials_conducted": engine.total_trials_conducted,
+            "correct_go_responses": engine.correct_go_responses,
+            "correct_no_go_responses": engine.correct_no_go_responses,
+            "commission_errors": engine.commission_errors,
+            "outliers_commission_too_fast": engine.commission_outliers,
+            "outliers_omission_too_late": engine.omission_outliers
+        }
+        settings = {**engine.test_settings(), "client": "web"}
+        data = build_session_data(self.datetime_iso, settings, engine.all_trial_data, counts=counts,
+                                  rt_values=engine.rt_summary())
+        if self.participant:
+            data["participant"] = self.participant
+        return data
+
+
+def _json_response(status, payload):
+    return status, "application/json; charset=utf-8", json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+class WebPVTServer:
+    def __init__(self, data_dir="recoded_data", settings=None, seed=None):
+        self.data_dir = data_dir
+        self.settings = settings or {} # PVTEngine の設定 (max_trials など)
+        self.rng = random.Random(seed)
+        self.sessions = {}
+        self.completed_sessions = 0
+        self.route_timings = {}
+        self._reserved_bases = set()
+        self._save_tasks = set()
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        if self.data_dir:
+            os.makedirs(self.data_dir, exist_ok=True)
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        await self.wait_saved()
+
+    async def wait_saved(self):
+        if self._save_tasks:
+            await asyncio.gather(*list(self._save_tasks))
+
+    async def _handle_connection(self, reader, writer):
+        # HTTP/1.1 (keep-alive 対応) の最小限の実装
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                if len(head) > MAX_HEADER_BYTES:
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    return
+                headers = {}
+                for line in header_lines:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    length = None
+                if length is None:
+                    # 本文の終わりが分からないので応答したら接続を閉じる
+                    status, content_type, body = _json_response(400, {"error": "invalid content-length"})
+                    keep_alive = False
+                elif length > MAX_BODY_BYTES:
+                    status, content_type, body = _json_response(413, {"error": "too large"})
+                else:
+                    request_body = await reader.readexactly(length) if length else b""
+                    status, content_type, body = await self._dispatch(method, target, request_body)
+                writer.write((f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                              f"Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                              f"Cache-Control: no-store\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                              ).encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        path = urllib.parse.urlsplit(target).path
+        parts = [part for part in path.split("/") if part]
+        start_ns = time.perf_counter_ns()
+        if method == "GET" and path == "/":
+            route, response = "page", (200, "text/html; charset=utf-8", PAGE_HTML.encode("utf-8"))
+        elif method == "GET" and path == "/api/stats":
+            route, response = "stats", _json_response(200, self.stats())
+        elif method == "POST" and parts == ["api", "sessions"]:
+            route, response = "create", self._create_session(body)
+        elif method == "POST" and len(parts) == 4 and parts[:2] == ["api", "sessions"] and parts[3] == "events":
+            route, response = "events", self._post_events(parts[2], body)
+        else:
+            route = "other"
+            response = _json_response(404, {"error": "not found"}) if method in ("GET", "POST") \
+                else _json_response(405, {"error": "method not allowed"})
+        # サーバー側の処理時間 (ネットワークとブラウザの時間は含まない)
+        self.route_timings.setdefault(route, LatencyHistogram()).add(time.perf_counter_ns() - start_ns,
+                                                                     {"active_sessions": len(self.sessions)})
+        return response
+
+    def _create_session(self, body):
+        self._expire_idle_sessions()
+        try:
+            request = json.loads(body) if body else {}
+            session = WebSession(self.settings, rng=random.Random(self.rng.getrandbits(64)),
+                                 participant=request.get("participant"))
+        except (ValueError, TypeError, AttributeError) as e:
+            return _json_response(400, {"error": str(e)})
+        self.sessions[session.session_id] = session
+        return _json_response(200, session.plan())
+
+    def _post_events(self, session_id, body):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return _json_response(404, {"error": "unknown session"})
+        try:
+            session.apply_batch(json.loads(body))
+        except (ValueError, KeyError, TypeError) as e:
+            return _json_response(400, {"error": str(e), "trials": session.engine.total_trials_conducted})
+        engine = session.engine
+        response = {"trials": engine.total_trials_conducted, "finished": session.finished}
+        if session.finished:
+            del self.sessions[session_id]
+            self.completed_sessions += 1
+            response["summary"] = {"live_metrics": engine.live_metrics(), "trials": engine.total_trials_conducted}
+            self._save_in_background(session)
+        return _json_response(200, response)
+
+    def _save_in_background(self, session):
+        # 組み立て (NumPy) と書き込みはイベントループの外で行う。保存名は書き込み待ちのものと重ならないように決める
+        if not self.data_dir:
+            return
+        base = session_base_filename(self.data_dir, datetime.datetime.fromisoformat(session.datetime_iso),
+                                     reserved=self._reserved_bases)
+        self._reserved_bases.add(base)
+
+        def save():
+            write_session_json(f"{base}.json", session.session_data())
+            return f"{base}.json"
+
+        task = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, save))
+        self._save_tasks.add(task)
+
+        def done(finished_task):
+            self._save_tasks.discard(finished_task)
+            self._reserved_bases.discard(base)
+            if finished_task.exception() is not None:
+                print(f"JSON保存エラー: {finished_task.exception()}")
+
+        task.add_done_callback(done)
+
+    def _expire_idle_sessions(self):
+        deadline = time.monotonic() - SESSION_IDLE_TIMEOUT_S
+        for session_id in [sid for sid, s in self.sessions.items() if s.last_activity < deadline]:
+            del self.sessions[session_id]
+
+    def stats(self):
+        return {
+            "active_sessions": len(self.sessions),
+            "completed_sessions": self.completed_sessions,
+            "pending_saves": len(self._save_tasks),
+            "routes": {route: histogram.summary() for route, histogram in self.route_timings.items()}
+        }
+
+
+PAGE_HTML = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>GNG-PVT</title>
+<style>
+  html, body { height: 100%; margin: 0; font-family: Helvetica, Arial, sans-serif; background: #fff; }
+  #screen { height: 100%; display: flex; flex-direction: column; align-items: center; justify-content: center; }
+  #stimulus { font: bold 72pt Arial, sans-serif; height: 110pt; visibility: hidden; }
+  #feedback { font: bold 20pt Helvetica, sans-serif; height: 30pt; }
+  #respond { font-size: 14pt; padding: 10px 40px; margin-top: 20px; }
+  #intro { font-size: 12pt; line-height: 1.6; white-space: pre-line; max-width: 40em; }
+</style>
+</head>
+<body>
+<div id="screen">
+  <h1>GNG-PVT</h1>
+  <div id="intro">読み込み中…</div>
+  <div id="stimulus">0</div>
+  <div id="feedback"></div>
+  <button id="start" disabled>スタート</button>
+  <button id="respond" hidden>反応</button>
+</div>
+<script>
+"use strict";
+const $ = (id) => document.getElementById(id);
+let plan = null, trialIndex = 0, pending = [], current = null, startedMs = null, sending = Promise.resolve();
+
+async function post(url, body) {
+  // 送れなければ少し待って再送する (試行の記録はブラウザ側に残っている)
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, {method: "POST", headers: {"Content-Type": "application/json"},
+                                         body: JSON.stringify(body), keepalive: true});
+      if (response.ok || response.status < 500) return await response.json();
+    } catch (e) {}
+    await new Promise((resolve) => setTimeout(resolve, Math.min(10000, 500 * 2 ** attempt)));
+  }
+}
+
+function flush(complete) {
+  const batch = {events: pending.splice(0), complete: complete};
+  if (startedMs !== null) { batch.started_ms = startedMs; startedMs = null; }
+  sending = sending.then(() => post(`/api/sessions/${plan.session_id}/events`, batch));
+  return sending;
+}
+
+function nextTrial() {
+  if (trialIndex >= plan.trials.length) { finish(); return; }
+  const trial = plan.trials[trialIndex];
+  setTimeout(() => {
+    $("stimulus").textContent = trial.stimulus;
+    $("stimulus").style.visibility = "visible";
+    // 描画が反映されるフレームで提示時刻を取る
+    requestAnimationFrame(() => {
+      current = {trial_number: trialIndex + 1, stimulus: trial.stimulus, onset_ms: performance.now(), response_ms: null};
+      current.timer = setTimeout(() => endTrial(null), plan.response_limit_ms);
+    });
+  }, trial.isi_ms);
+}
+
+function endTrial(responseMs) {
+  const trial = current;
+  current = null;
+  clearTimeout(trial.timer);
+  $("stimulus").style.visibility = "hidden";
+  trial.response_ms = responseMs;
+  // 表示用の判定 (正式な採点はサーバーが同じ規則で行う)
+  const isTarget = trial.stimulus === plan.target_number;
+  let message, color;
+  if (responseMs === null) { [message, color] = isTarget ? ["Good!", "green"] : ["TooLate!", "orange"]; }
+  else if (responseMs - trial.onset_ms < plan.response_outlier_ms) { [message, color] = ["TooFast!", "orange"]; }
+  else if (isTarget) { [message, color] = ["Bad!", "red"]; }
+  else { [message, color] = ["Good!", "green"]; }
+  $("feedback").textContent = message;
+  $("feedback").style.color = color;
+  setTimeout(() => {
+    $("feedback").textContent = "";
+    trial.feedback_end_ms = performance.now();
+    delete trial.timer;
+    pending.push(trial);
+    trialIndex++;
+    if (pending.length >= plan.batch_size) { flush(false); }
+    nextTrial();
+  }, plan.feedback_duration_ms);
+}
+
+function respond(event) {
+  if (!current) return;
+  // event.timeStamp は performance.now() と同じ基準 (ハンドラが呼ばれるまでの遅れを含まない)
+  endTrial(event.timeStamp || performance.now());
+}
+
+async function finish() {
+  $("respond").hidden = true;
+  const result = await flush(true);
+  const metrics = result.summary ? result.summary.live_metrics : null;
+  $("intro").hidden = false;
+  $("intro").textContent = metrics
+    ? `終了しました。\\n試行数: ${metrics.trials}\\n正答率: ${metrics.accuracy_percentage} %\\n` +
+      `中央反応時間: ${metrics.median_go_rt_ms === null ? "N/A" : Math.round(metrics.median_go_rt_ms) + " ms"}\\n` +
+      `ラプス: ${metrics.lapses}`
+    : "終了しました。";
+}
+
+async function init() {
+  const participant = new URLSearchParams(location.search).get("participant");
+  plan = await post("/api/sessions", {participant: participant});
+  $("intro").textContent =
+    "画面に1から9までの数字が順番に表示されます。\\n" +
+    `ターゲット数字（今回は「${plan.target_number}」）以外の数字が表示されたら、\\n` +
+    "できるだけ速く「反応」ボタン (またはスペース/Enter キー) を押してください。\\n" +
+    `ターゲット数字「${plan.target_number}」が表示された場合は、ボタンを押さないでください。`;
+  $("start").disabled = false;
+  $("start").onclick = () => {
+    $("start").hidden = true; $("intro").hidden = true; $("respond").hidden = false;
+    if (document.documentElement.requestFullscreen) { document.documentElement.requestFullscreen().catch(() => {}); }
+    startedMs = performance.now();
+    nextTrial();
+  };
+  $("respond").addEventListener("pointerdown", respond);
+  document.addEventListener("keydown", (event) => {
+    if ([" ", "Enter"].includes(event.key) && !event.repeat) { event.preventDefault(); respond(event); }
+  });
+}
+init();
+</script>
+</body>
+</html>
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ブラウザ版 GNG-PVT のサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--data-dir", default="recoded_data")
+    parser.add_argument("--trials", type=int, default=100)
+    parser.add_argument("--targets", type=int, default=25)
+    parser.add_argument("--response-limit-ms", type=int, default=1500)
+    args = parser.parse_args(argv)
+
+    settings = {"max_trials": args.trials, "target_trials": args.targets, "response_limit_ms": args.response_limit_ms}
+
+    async def serve():
+        server = WebPVTServer(args.data_dir, settings)
+        host, port = await server.start(args.host, args.port)
+        print(f"ブラウザ版を http://{host}:{port}/ で公開しました。Ctrl+C で停止します。")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
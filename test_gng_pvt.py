@@ -2,6 +2,7 @@ import os
 import json
 import tkinter as tk
 import time
+import threading
 import pytest
 import matplotlib
 matplotlib.use('Agg')
@@ -119,6 +120,7 @@ def test_mixed_performance_summary(app, tmp_path):
         {'trial_number':5, 'pre_stimulus_interval_ms':200, 'stimulus':3, 'is_target':0, 'is_correct':0, 'reaction_time_ms':None}
     ]
     app.end_test()
+    assert app.persistence.wait(timeout=30)
     json_file = next(f for f in os.listdir(app.data_dir) if f.endswith('.json'))
     with open(os.path.join(app.data_dir, json_file), 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -144,6 +146,7 @@ def test_end_test_saves_json_and_graph(app):
         {'trial_number':2, 'pre_stimulus_interval_ms':200, 'stimulus':2, 'is_target':1, 'is_correct':0, 'reaction_time_ms':None}
     ]
     app.end_test()
+    assert app.persistence.wait(timeout=30) # JSON and PNG are written in the background
     files = os.listdir(app.data_dir)
     assert any(f.endswith('.json') for f in files)
     assert any(f.endswith('.png') for f in files)
@@ -160,6 +163,7 @@ def test_single_rt_statistics(app, tmp_path):
         {'trial_number':1, 'pre_stimulus_interval_ms':100, 'stimulus':1, 'is_target':0, 'is_correct':1, 'reaction_time_ms':250}
     ]
     app.end_test()
+    assert app.persistence.wait(timeout=30)
     json_file = next(f for f in os.listdir(app.data_dir) if f.endswith('.json'))
     with open(os.path.join(app.data_dir, json_file), 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -178,6 +182,7 @@ def test_no_trials_statistics(app, tmp_path):
     app.reaction_times = []
     app.all_trial_data = []
     app.end_test()
+    assert app.persistence.wait(timeout=30)
     json_file = next(f for f in os.listdir(app.data_dir) if f.endswith('.json'))
     with open(os.path.join(app.data_dir, json_file), 'r', encoding='utf-8') as f:
         data = json.load(f)
@@ -186,3 +191,310 @@ def test_no_trials_statistics(app, tmp_path):
     assert summary['average_reaction_time_ms'] is None
     assert summary['worst_reaction_time_ms'] is None
     assert summary['reaction_time_std_dev_ms'] is None
+
+
+def test_key_dispatch_timer_measures_against_fastest_event():
+    timer = gng_pvt.KeyDispatchTimer()
+    # 受信時刻(ns)とevent.time(ms)の差が最小のイベントを遅延ゼロの基準とする
+    assert timer.observe(1000, 5_000_000_000) == 0
+    assert timer.observe(2000, 6_004_000_000) == 4_000_000
+    assert timer.observe(3000, 6_999_000_000) == 0
+    assert timer.observe(4000, 8_002_500_000) == 3_500_000
+    assert timer.observe(0, 9_000_000_000) is None
+
+
+def test_response_key_uses_event_timestamp(app, root, monkeypatch):
+    app.target_number = 9
+    app.sequence = [1]
+    simulate_rt(monkeypatch, 0.0, 0.2)
+    app.start_test()
+    app.display_stimulus()
+    app.key_dispatch_timer.base_offset_ms = 0.0
+    monkeypatch.setattr(app.engine.clock, 'now_ns', lambda: 1_010_000_000)
+    event = type("Event", (), {"keysym": "space", "time": 1000})()
+    app.handle_response_key(event)
+    trial = app.all_trial_data[0]
+    assert trial['dispatch_latency_ms'] == 10.0
+    assert trial['reaction_time_ms'] == 200 # 既定では補正しない
+    assert app.correct_go_responses == 1
+    assert app.test_settings()['correct_dispatch_latency'] is False
+
+
+def test_response_key_latency_correction_is_opt_in(app, root, monkeypatch):
+    app.target_number = 9
+    app.sequence = [1]
+    app.correct_dispatch_latency = True
+    simulate_rt(monkeypatch, 0.0, 0.2)
+    app.start_test()
+    app.display_stimulus()
+    app.key_dispatch_timer.base_offset_ms = 0.0
+    monkeypatch.setattr(app.engine.clock, 'now_ns', lambda: 1_010_000_000)
+    event = type("Event", (), {"keysym": "space", "time": 1000})()
+    app.handle_response_key(event)
+    trial = app.all_trial_data[0]
+    assert trial['dispatch_latency_ms'] == 10.0
+    assert trial['reaction_time_ms'] == 190
+    assert app.test_settings()['correct_dispatch_latency'] is True
+
+
+def test_session_streams_trials_and_saves_from_stream(app, root):
+    app.target_number = 4
+    app.sequence = [5, 4]
+    app.start_test()
+    assert app.trial_stream is not None
+    app.display_stimulus()
+    app.handle_timeout()
+    app.clear_feedback_and_proceed()
+    app.display_stimulus()
+    app.handle_timeout()
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    stream_dir = os.path.join(app.data_dir, 'streams', 'completed')
+    stream_file = next(f for f in os.listdir(stream_dir) if f.endswith('.jsonl'))
+    with open(os.path.join(stream_dir, stream_file), 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [r['type'] for r in records] == ['session_start', 'trial', 'trial_update', 'trial', 'session_end']
+    json_file = next(f for f in os.listdir(app.data_dir) if f.endswith('.json'))
+    with open(os.path.join(app.data_dir, json_file), 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['summary_results']['correct_no_go_responses'] == 1
+    assert data['summary_results']['outliers_omission_too_late'] == 1
+
+
+def test_end_test_indexes_session_in_store(app):
+    from pvt_store import SessionStore
+    app.test_in_progress = True
+    app.total_trials_conducted = 1
+    app.correct_go_responses = 1
+    app.reaction_times = [250]
+    app.all_trial_data = [
+        {'trial_number':1, 'pre_stimulus_interval_ms':100, 'stimulus':1, 'is_target':0, 'is_correct':1, 'reaction_time_ms':250}
+    ]
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    with SessionStore(os.path.join(app.data_dir, 'sessions.sqlite3')) as store:
+        sessions = store.query_sessions()
+    assert len(sessions) == 1
+    assert sessions[0]['average_reaction_time_ms'] == 250
+
+
+def test_recovered_session_is_added_to_existing_store(app):
+    from pvt_store import SessionStore
+    from pvt_stream import TrialStream
+    store, _ = app.open_session_store() # ストアは作成済み
+    store.close()
+    os.makedirs(app.stream_dir())
+    stream = TrialStream(os.path.join(app.stream_dir(), '2025-01-01_08-00-00.jsonl'))
+    stream.open('2025-01-01T08:00:00', app.test_settings())
+    stream.append_trial({'trial_number':1, 'pre_stimulus_interval_ms':100, 'stimulus':1, 'is_target':0,
+                         'is_correct':1, 'reaction_time_ms':250})
+    stream._file.flush() # ここでクラッシュ
+    app.recover_interrupted_sessions()
+    with SessionStore(os.path.join(app.data_dir, 'sessions.sqlite3')) as store:
+        sessions = store.query_sessions()
+    assert len(sessions) == 1
+    assert sessions[0]['source_path'].endswith('2025-01-01_08-00-00_recovered.json')
+
+
+def test_end_test_saves_compact_copy(app):
+    import pvt_compact
+    app.save_compact = True
+    app.test_in_progress = True
+    app.total_trials_conducted = 1
+    app.correct_go_responses = 1
+    app.reaction_times = [250]
+    app.all_trial_data = [
+        {'trial_number':1, 'pre_stimulus_interval_ms':100, 'stimulus':1, 'is_target':0, 'is_correct':1, 'reaction_time_ms':250}
+    ]
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    bases = pvt_compact.find_compact_sessions(app.data_dir)
+    assert len(bases) == 1
+    with open(bases[0] + '.json', encoding='utf-8') as f:
+        assert pvt_compact.compact_to_session(bases[0]) == json.load(f)
+
+
+def test_history_window_reads_store(app, root):
+    from pvt_store import SessionStore
+    trials = [{'trial_number':1, 'pre_stimulus_interval_ms':100, 'stimulus':1, 'is_target':0, 'is_correct':1, 'reaction_time_ms':250}]
+    with SessionStore(os.path.join(app.data_dir, 'sessions.sqlite3')) as store:
+        for day in ('2025-01-01', '2025-01-02'):
+            store.add_session({'datetime_iso': f'{day}T08:00:00', 'test_settings': {},
+                               'summary_results': {'accuracy_percentage': 100.0}, 'trials': trials})
+    window = app.show_history_window()
+    assert window is not None
+    window.destroy()
+
+
+def test_duration_mode_streams_trials_and_reloads_them(app, root, monkeypatch):
+    reader_threads = []
+    original_read_stream = gng_pvt.read_stream
+
+    def read_stream(path):
+        reader_threads.append(threading.current_thread())
+        return original_read_stream(path)
+
+    monkeypatch.setattr(gng_pvt, 'read_stream', read_stream)
+    app.duration_s = 300
+    app.target_number = 9
+    app.generate_sequence()
+    app.start_test()
+    assert app.engine.retain_trials is False
+    app.display_stimulus()
+    app.handle_response_button()
+    assert app.all_trial_data == []
+    app.end_test()
+    assert app.trial_reload is not None # 読み戻しは保存ジョブで行い、結果画面は後から更新する
+    assert app.persistence.wait(timeout=30)
+    app.persistence.drain()
+    assert app.trial_reload is None
+    assert reader_threads and threading.main_thread() not in reader_threads
+    assert len(app.all_trial_data) == 1
+    assert len(app.reaction_times) == 1
+    json_files = [n for n in os.listdir(app.data_dir) if n.endswith('.json')]
+    with open(os.path.join(app.data_dir, json_files[0]), encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['test_settings']['duration_s'] == 300
+    assert data['summary_results']['total_trials_conducted'] == 1
+    assert any(n.endswith('.png') for n in os.listdir(app.data_dir)) # グラフも読み戻した試行記録から作る
+
+
+def test_test_screen_is_reused_and_render_cost_saved(app, root):
+    app.target_number = 9
+    app.sequence = [1]
+    app.start_test()
+    screen, canvas = app.test_screen, app.stimulus_canvas
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    json_files = [n for n in os.listdir(app.data_dir) if n.endswith('.json')]
+    with open(os.path.join(app.data_dir, json_files[0]), encoding='utf-8') as f:
+        render_cost = json.load(f)['summary_results']['stimulus_render_cost']
+    assert render_cost['update']['1']['count'] == 1
+    app.show_start_screen()
+    app.start_test()
+    assert app.test_screen is screen and app.stimulus_canvas is canvas
+    assert canvas.cost_summary() == {'update': {}, 'paint': {}}
+
+
+def test_precision_mode_restores_gc_and_saves_report(app, root):
+    import gc
+    app.precision_mode = True
+    app.target_number = 9
+    app.sequence = [1]
+    app.start_test()
+    assert not gc.isenabled()
+    assert app.engine.defer_listeners is True
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    assert gc.isenabled()
+    json_files = [n for n in os.listdir(app.data_dir) if n.endswith('.json')]
+    with open(os.path.join(app.data_dir, json_files[0]), encoding='utf-8') as f:
+        data = json.load(f)
+    report = data['summary_results']['precision_session']
+    assert report['gc_disabled'] is True
+    assert {'pause_count', 'max_lag_ms', 'pauses', 'gc_collections_in_isi'} <= set(report)
+    assert len(data['trials']) == 1
+
+
+def test_fatigue_report_saved_with_session(app, root):
+    assert app.fatigue_monitoring is False # 既定では無効
+    app.fatigue_monitoring = True
+    app.target_number = 9
+    app.sequence = [1]
+    app.start_test()
+    assert app.fatigue_monitor is not None and app.fatigue_monitor.active
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    assert not app.fatigue_monitor.active
+    json_files = [n for n in os.listdir(app.data_dir) if n.endswith('.json')]
+    with open(os.path.join(app.data_dir, json_files[0]), encoding='utf-8') as f:
+        data = json.load(f)
+    report = data['summary_results']['fatigue']
+    assert report['trials_monitored'] == 0 # すぐに押したのでフライング (対象外)
+    assert report['alert_count'] == 0 and report['alerts'] == []
+    assert report['rt_cusum']['baseline_ready'] is False
+
+
+def test_profile_written_next_to_session_json(app, root):
+    app.profile_handlers = True
+    app.target_number = 9
+    app.sequence = [1]
+    app.start_test()
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.persistence.wait(timeout=30)
+    assert 'handle_response' not in app.engine.__dict__
+    profiles = [n for n in os.listdir(app.data_dir) if n.endswith('.profile')]
+    assert len(profiles) == 1
+    assert profiles[0][:-len('.profile')] + '.json' in os.listdir(app.data_dir)
+    with open(os.path.join(app.data_dir, profiles[0]), encoding='utf-8') as f:
+        profile = json.load(f)
+    assert profile['handlers']['handle_response']['count'] == 1
+    assert profile['handlers']['end_test']['count'] == 1
+
+
+def test_restart_does_not_wait_for_pending_save(app, root):
+    gate = threading.Event()
+    app.persistence.submit(lambda progress: gate.wait(30)) # 遅いディスクの代わり
+    app.target_number = 9
+    app.sequence = [1]
+    app.start_test()
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.save_job is not None and not app.save_job.finished.is_set()
+    assert app.save_status_label is not None
+    first_job = app.save_job
+    app.show_start_screen() # もう一度行う
+    app.sequence = [2]
+    app.start_test()
+    app.display_stimulus()
+    app.handle_response_button()
+    app.end_test()
+    assert app.save_job is not first_job
+    gate.set()
+    assert app.persistence.wait(timeout=30)
+    json_files = sorted(n for n in os.listdir(app.data_dir) if n.endswith('.json'))
+    assert len(json_files) == 2 # 同じ分でも保存待ちの名前とは重ならない
+    assert not any(n.endswith('.tmp') for n in os.listdir(app.data_dir))
+    assert app.save_status_label.cget('text') == "保存しました。"
+
+
+def test_session_is_pushed_to_collector(app, root, tmp_path):
+    from pvt_collector import start_collector
+    server, _ = start_collector(str(tmp_path / 'collector.sqlite3'))
+    try:
+        app.collector_url = server.url
+        app.station_id = 'lab-7'
+        app.target_number = 9
+        app.sequence = [1]
+        app.start_test()
+        app.display_stimulus()
+        app.handle_response_button()
+        app.end_test()
+        assert app.persistence.wait(timeout=30)
+        assert app.collector_client.close(timeout=10)
+        sessions = server.collector.sessions(station='lab-7')
+        assert len(sessions) == 1
+        assert sessions[0]['total_trials_conducted'] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_import_does_not_load_heavy_modules():
+    import subprocess
+    import sys
+    code = "import sys, gng_pvt; print(sorted(m for m in ('numpy', 'matplotlib', 'PIL') if m in sys.modules))"
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(gng_pvt.__file__))).stdout
+    assert out.strip() == '[]'
+    assert gng_pvt.MATPLOTLIB_AVAILABLE is True
+    gng_pvt.prewarm_heavy_modules().join(timeout=30)
@@ -0,0 +1,87 @@
+import random
+import statistics
+import numpy as np
+import pytest
+
+from pvt_analytics import TrialColumns, norm_ppf, rt_summary, session_metrics, summarize_trials
+
+
+def trial(n, is_target, is_correct, rt):
+    return {'trial_number': n, 'pre_stimulus_interval_ms': 1000, 'stimulus': 3 if is_target else 1,
+            'is_target': is_target, 'is_correct': is_correct, 'reaction_time_ms': rt}
+
+
+def random_session(rng, n_trials=60):
+    trials = []
+    for i in range(n_trials):
+        is_target = 1 if rng.random() < 0.25 else 0
+        if is_target:
+            rt = rng.choice([None, None, None, 320])
+            trials.append(trial(i + 1, 1, 1 if rt is None else 0, rt))
+        else:
+            rt = rng.choice([None, 80, rng.randint(150, 700), rng.randint(150, 700), rng.randint(150, 700)])
+            trials.append(trial(i + 1, 0, 1 if rt is not None and rt >= 100 else 0, rt))
+    return trials
+
+
+def test_single_session_metrics():
+    trials = [
+        trial(1, 0, 1, 200),
+        trial(2, 1, 0, 300),  # commission (false alarm)
+        trial(3, 0, 1, 400),  # post-error trial
+        trial(4, 0, 1, 600),  # lapse
+        trial(5, 0, 0, None), # omission -> lapse
+        trial(6, 1, 1, None),
+        trial(7, 0, 0, 50),   # anticipation
+        trial(8, 0, 1, 300),
+    ]
+    m = summarize_trials(trials)
+    assert m['go_trials'] == 6
+    assert m['nogo_trials'] == 2
+    assert m['median_rt_ms'] == 350
+    assert m['mean_rt_ms'] == 375
+    assert m['mean_reciprocal_rt'] == pytest.approx(round(np.mean([5, 2.5, 1000 / 600, 1000 / 300]), 3))
+    assert m['lapses'] == 2
+    assert m['omissions'] == 1
+    assert m['anticipations'] == 1
+    assert m['false_alarm_rate'] == 0.5
+    assert m['fastest_10pct_rt_ms'] == 200
+    assert m['slowest_10pct_reciprocal_rt'] == pytest.approx(1000 / 600, abs=1e-3)
+    # after error: trial 3 (400), trial 8 (300, after anticipation) / after correct: trial 4 (600)
+    assert m['post_error_slowing_ms'] == pytest.approx(350 - 600)
+    nd = statistics.NormalDist()
+    assert m['d_prime'] == pytest.approx(nd.inv_cdf(4.5 / 7) - nd.inv_cdf(1.5 / 3), abs=1e-3)
+
+
+def test_vectorized_matches_per_session():
+    rng = random.Random(11)
+    sessions = [random_session(rng) for _ in range(40)]
+    batch = session_metrics(TrialColumns.from_sessions(sessions))
+    for i, trials in enumerate(sessions):
+        single = summarize_trials(trials)
+        for name, value in single.items():
+            if value is None:
+                assert np.isnan(batch[name][i])
+            else:
+                assert round(float(batch[name][i]), 3) == pytest.approx(value)
+        valid = [t['reaction_time_ms'] for t in trials if not t['is_target'] and t['is_correct']]
+        assert single['median_rt_ms'] == pytest.approx(statistics.median(valid))
+
+
+def test_empty_session():
+    m = summarize_trials([])
+    assert m['median_rt_ms'] is None
+    assert m['lapses'] == 0
+
+
+def test_norm_ppf_accuracy():
+    nd = statistics.NormalDist()
+    ps = np.array([0.001, 0.02, 0.3, 0.5, 0.9, 0.999])
+    assert norm_ppf(ps) == pytest.approx([nd.inv_cdf(p) for p in ps], abs=1e-8)
+
+
+def test_rt_summary_matches_statistics():
+    rts = [180, 220, 251, 199]
+    assert rt_summary(rts) == (round(statistics.mean(rts)), 251, round(statistics.stdev(rts)))
+    assert rt_summary([250]) == (250, 250, None)
+    assert rt_summary([]) == (None, None, None)
@@ -0,0 +1,106 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import pvt_batch
+from pvt_session import write_session_json
+from pvt_simulator import ParticipantModel, simulate_session
+
+
+def write_session(path, seed, legacy=False):
+    engine = simulate_session(ParticipantModel(), seed, max_trials=30, target_trials=8, feedback_duration_ms=10)
+    settings = {"target_number": engine.target_number, "response_limit_ms": 1500, "feedback_duration_ms": 10,
+                "min_interval_s": 0.5, "max_interval_s": 5.0, "configured_max_trials": 30}
+    if not legacy:
+        settings["response_outlier_ms"] = 100
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_session_json(path, {"datetime_iso": f"2025-01-{seed + 1:02d}T08:00:00", "test_settings": settings,
+                              "summary_results": {}, "trials": engine.all_trial_data})
+    return engine
+
+
+def test_batch_recomputes_and_caches(tmp_path):
+    root = tmp_path / "data"
+    engines = {
+        "alice": [write_session(str(root / "alice" / f"{i}.json"), i) for i in range(3)],
+        "bob": [write_session(str(root / "bob" / "recoded_data" / "0.json"), 5, legacy=True)]
+    }
+    (root / "bob" / "broken.json").write_text("{", encoding="utf-8")
+    output = str(tmp_path / "analysis.npz")
+
+    stats = pvt_batch.run_batch([str(root)], output, jobs=2)
+    assert stats == {"files": 5, "analyzed": 4, "cached": 0, "failed": 1, "sessions": 4}
+    columns = pvt_batch.load_batch(output)
+    assert list(columns["participant"]) == ["alice", "alice", "alice", "bob"]
+    assert columns["total_trials_conducted"].tolist() == [30, 30, 30, 30]
+    alice0 = engines["alice"][0]
+    assert columns["correct_go_responses"][0] == alice0.correct_go_responses
+    assert columns["average_reaction_time_ms"][0] == alice0.rt_summary()[0]
+    assert not np.isnan(columns["d_prime"]).any()
+
+    stats = pvt_batch.run_batch([str(root)], output, jobs=2)
+    assert stats["analyzed"] == 0 and stats["cached"] == 4
+
+    write_session(str(root / "alice" / "1.json"), 7)
+    stats = pvt_batch.run_batch([str(root)], output, jobs=2)
+    assert stats["analyzed"] == 1 and stats["cached"] == 3
+
+    stats = pvt_batch.run_batch([str(root)], output, jobs=1, force=True)
+    assert stats["analyzed"] == 4
+
+
+def test_cache_invalidated_by_analysis_version(tmp_path, monkeypatch):
+    write_session(str(tmp_path / "p" / "0.json"), 0)
+    output = str(tmp_path / "out.npz")
+    pvt_batch.run_batch([str(tmp_path / "p")], output, jobs=1)
+    with open(output + pvt_batch.CACHE_SUFFIX, encoding="utf-8") as f:
+        assert json.load(f)["analysis_version"] == pvt_batch.ANALYSIS_VERSION
+    monkeypatch.setattr(pvt_batch, "ANALYSIS_VERSION", pvt_batch.ANALYSIS_VERSION + 1)
+    assert pvt_batch.load_cache(output + pvt_batch.CACHE_SUFFIX) == {}
+
+
+def test_unreadable_files_fail_without_aborting_the_batch(tmp_path, monkeypatch):
+    root = tmp_path / "data"
+    for i in range(2):
+        write_session(str(root / "alice" / f"{i}.json"), i)
+    output = str(tmp_path / "out.npz")
+    missing = str(root / "alice" / "gone.json")
+    path, sha256, row, error = pvt_batch.analyze_file(missing) # 一覧の後に消えたファイル
+    assert (path, sha256, row) == (missing, None, None) and error.startswith("FileNotFoundError")
+
+    pvt_batch.run_batch([str(root)], output, jobs=1)
+    unreadable = os.path.join(str(root), "alice", "1.json")
+    file_sha256 = pvt_batch.file_sha256
+
+    def fail_on_unreadable(path):
+        if path == unreadable:
+            raise PermissionError("denied")
+        return file_sha256(path)
+
+    monkeypatch.setattr(pvt_batch, "file_sha256", fail_on_unreadable) # キャッシュ済みのファイルが読めない
+    stats = pvt_batch.run_batch([str(root)], output, jobs=1)
+    assert stats == {"files": 2, "analyzed": 0, "cached": 1, "failed": 1, "sessions": 1}
+    assert len(pvt_batch.load_batch(output)["participant"]) == 1
+
+
+def test_interrupted_npz_write_keeps_previous_output_and_cache(tmp_path, monkeypatch):
+    write_session(str(tmp_path / "p" / "0.json"), 0)
+    output = str(tmp_path / "out.npz")
+    pvt_batch.run_batch([str(tmp_path / "p")], output, jobs=1)
+    write_session(str(tmp_path / "p" / "1.json"), 1)
+    with open(output + pvt_batch.CACHE_SUFFIX, encoding="utf-8") as f:
+        cache_before = f.read()
+
+    def fail(file, **columns):
+        file.write(b"PK")
+        raise OSError("disk full")
+
+    monkeypatch.setattr(pvt_batch.np, "savez_compressed", fail)
+    with pytest.raises(OSError):
+        pvt_batch.run_batch([str(tmp_path / "p")], output, jobs=1)
+    monkeypatch.undo()
+    assert len(pvt_batch.load_batch(output)["participant"]) == 1 # 前回の NPZ のまま
+    with open(output + pvt_batch.CACHE_SUFFIX, encoding="utf-8") as f:
+        assert f.read() == cache_before
@@ -0,0 +1,167 @@
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pvt_collector import CollectorClient, CollectorStore, start_collector
+from pvt_session import build_session_data
+
+SETTINGS = {'target_number': 3, 'response_limit_ms': 1500, 'response_outlier_ms': 100, 'feedback_duration_ms': 1000}
+
+
+def make_trials(n, rt=300):
+    return [{'trial_number': i, 'pre_stimulus_interval_ms': 1000, 'stimulus': 3 if i % 4 == 0 else 5,
+             'is_target': 1 if i % 4 == 0 else 0, 'is_correct': 1,
+             'reaction_time_ms': None if i % 4 == 0 else rt + i} for i in range(1, n + 1)]
+
+
+def session_records(key, day, n, with_data=True):
+    trials = make_trials(n)
+    records = [{'type': 'session_start', 'session_key': key, 'datetime_iso': f'{day}T09:00:00', 'test_settings': SETTINGS}]
+    records += [{'type': 'trial', 'session_key': key, 'trial': dict(t, feedback_actual_ms=None)} for t in trials]
+    records += [{'type': 'trial_update', 'session_key': key, 'trial_number': t['trial_number'], 'feedback_actual_ms': 1000.5}
+                for t in trials]
+    data = build_session_data(f'{day}T09:00:00', SETTINGS, trials) if with_data else None
+    records.append({'type': 'session_end', 'session_key': key, **({'data': data} if with_data else {})})
+    return records
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=5) as response:
+        return json.loads(response.read())
+
+
+@pytest.fixture
+def server(tmp_path):
+    server, thread = start_collector(str(tmp_path / 'collector.sqlite3'))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_stations_are_collected_into_one_store(server):
+    clients = [CollectorClient(server.url, f'lab-{i}', batch_size=7, flush_interval_s=0.05) for i in range(4)]
+
+    def run(client, index):
+        for session in range(3):
+            for record in session_records(f's{session}', f'2025-05-0{session + 1}', 10 + index):
+                client.send(record)
+
+    threads = [threading.Thread(target=run, args=(client, i)) for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        assert client.close(timeout=10)
+        assert client.sent_records == 3 * (2 + 2 * 10) + 3 * 2 * clients.index(client)
+
+    stations = get_json(server.url + '/stations')
+    assert [s['station'] for s in stations] == ['lab-0', 'lab-1', 'lab-2', 'lab-3']
+    assert all(s['completed'] == 3 and s['running'] == 0 for s in stations)
+    sessions = get_json(server.url + '/sessions?station=lab-2')
+    assert [s['total_trials_conducted'] for s in sessions] == [12, 12, 12]
+    by_station = get_json(server.url + '/aggregates?by=station')
+    assert [a['sessions'] for a in by_station] == [3, 3, 3, 3]
+    by_date = get_json(server.url + '/aggregates?by=date&start=2025-05-02')
+    assert [d['sessions'] for d in by_date] == [4, 4]
+    assert get_json(server.url + '/live') == []
+
+
+def test_resent_batches_do_not_duplicate(tmp_path):
+    collector = CollectorStore(str(tmp_path / 'c.sqlite3'))
+    records = session_records('k', '2025-06-01', 8)
+    collector.ingest('lab', records[:5])
+    collector.ingest('lab', records[:5]) # 応答が届かず再送された
+    assert collector.live_sessions()[0]['trials'] == 4
+    collector.ingest('lab', records)
+    collector.ingest('lab', records)
+    sessions = collector.sessions()
+    assert len(sessions) == 1 and sessions[0]['station'] == 'lab'
+    trials = collector.store.trials_for_session(sessions[0]['id'])
+    assert len(trials) == 8
+    collector.close()
+
+
+def test_session_is_rebuilt_from_streamed_trials_without_data(tmp_path):
+    collector = CollectorStore(str(tmp_path / 'c.sqlite3'))
+    collector.ingest('lab', session_records('k', '2025-06-02', 8, with_data=False))
+    session = collector.sessions()[0]
+    assert session['total_trials_conducted'] == 8
+    trial = collector.store.trials_for_session(session['id'])[0]
+    assert trial['feedback_actual_ms'] == 1000.5
+    collector.close()
+
+
+def test_session_end_builds_outside_lock_and_commits_once(tmp_path, monkeypatch):
+    import pvt_collector
+    collector = CollectorStore(str(tmp_path / 'c.sqlite3'))
+    built_while_locked = []
+
+    def build(*args, **kwargs):
+        built_while_locked.append(collector.lock.locked())
+        return build_session_data(*args, **kwargs)
+
+    monkeypatch.setattr(pvt_collector, 'build_session_data', build)
+    monkeypatch.setattr(collector.store, 'add_session', None) # 内側で別にコミットしない
+    statements = []
+    collector.conn.set_trace_callback(statements.append)
+    collector.ingest('lab', session_records('k', '2025-06-04', 8, with_data=False))
+    collector.conn.set_trace_callback(None)
+    assert built_while_locked == [False]
+    assert sum(s.strip().upper() == 'COMMIT' for s in statements) == 2 # 受信したレコード / session_end の登録
+    collector.ingest('lab', [{'type': 'session_end', 'session_key': 'k'}]) # 登録後の再送で空のセッションに置き換えない
+    assert collector.sessions()[0]['total_trials_conducted'] == 8
+    collector.close()
+
+
+def test_client_retries_until_server_is_up(tmp_path):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    client = CollectorClient(f'http://127.0.0.1:{port}', 'lab', flush_interval_s=0.01, initial_backoff_s=0.05,
+                             max_backoff_s=0.1, timeout_s=1)
+    for record in session_records('k', '2025-06-03', 4):
+        client.send(record)
+    deadline = time.monotonic() + 5
+    while client.failed_attempts == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert client.failed_attempts > 0 and client.sent_records == 0
+    server, _ = start_collector(str(tmp_path / 'c.sqlite3'), port=port)
+    try:
+        while client.sent_records < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.close(timeout=5)
+        assert client.sent_records == 10
+        assert len(get_json(server.url + '/sessions')) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_invalid_batch_is_rejected(server):
+    request = urllib.request.Request(server.url + '/ingest', data=b'{"station": "x", "records": [{"type": "bogus"}]}',
+                                     method='POST')
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request, timeout=5)
+    assert e.value.code == 400
+
+
+@pytest.mark.parametrize('body', [b'{"station": "s", "records": [1]}', b'{"station": "s", "records": "abc"}', b'[1]'])
+def test_malformed_batch_shapes_are_rejected(server, body):
+    request = urllib.request.Request(server.url + '/ingest', data=body, method='POST')
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request, timeout=5)
+    assert e.value.code == 400
+
+
+def test_invalid_content_length_is_rejected(server):
+    port = server.server_address[1]
+    for length in (b'abc', b'-5'):
+        with socket.create_connection(('127.0.0.1', port), timeout=5) as s:
+            s.sendall(b'POST /ingest HTTP/1.1\r\nHost: x\r\nContent-Length: ' + length + b'\r\n\r\n')
+            assert s.recv(1024).startswith(b'HTTP/1.0 400')
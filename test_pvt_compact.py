@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import pvt_compact
+from pvt_analytics import TrialColumns, session_metrics
+from pvt_session import build_session_data, write_session_json
+from pvt_simulator import ParticipantModel, build_simulated_session
+
+SETTINGS = {"target_number": 3, "response_limit_ms": 1500, "response_outlier_ms": 100, "feedback_duration_ms": 10}
+
+
+def simulated_session(seed, precise_onset=False):
+    engine, clock = build_simulated_session(ParticipantModel(), seed, max_trials=40, target_trials=10, feedback_duration_ms=10)
+    engine.precise_onset = precise_onset
+    engine.start()
+    clock.run()
+    return build_session_data(f"2025-02-{seed + 1:02d}T08:00:00", SETTINGS, engine.all_trial_data, rt_values=engine.rt_summary())
+
+
+def round_trip(tmp_path, data):
+    json_path = str(tmp_path / "s.json")
+    write_session_json(json_path, data)
+    with open(json_path, encoding="utf-8") as f:
+        original = json.load(f)
+    base_path = pvt_compact.convert_json_to_compact(json_path)
+    return original, pvt_compact.compact_to_session(base_path), base_path
+
+
+def test_round_trip_is_lossless(tmp_path):
+    original, restored, base_path = round_trip(tmp_path, simulated_session(1))
+    assert restored == original
+    assert json.dumps(restored, indent=4) == json.dumps(original, indent=4) # 型とキー順も同じ
+    assert os.path.getsize(base_path + ".npy") + os.path.getsize(base_path + ".meta") < os.path.getsize(str(tmp_path / "s.json"))
+
+
+def test_interrupted_write_keeps_previous_files(tmp_path, monkeypatch):
+    base_path = str(tmp_path / "s")
+    pvt_compact.session_to_compact(simulated_session(1), base_path)
+    before = pvt_compact.compact_to_session(base_path)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(pvt_compact.json, "dump", fail)
+    with pytest.raises(OSError):
+        pvt_compact.session_to_compact(simulated_session(2), base_path)
+    monkeypatch.undo()
+    assert pvt_compact.compact_to_session(base_path) == before # 配列も .meta も前のまま
+
+
+def test_precise_session_keeps_ns_fields_and_float_rts(tmp_path):
+    original, restored, base_path = round_trip(tmp_path, simulated_session(2, precise_onset=True))
+    assert restored == original
+    meta = pvt_compact.load_meta(base_path)
+    assert meta["columns"]["reaction_time_ms"] == "float"
+    assert "stimulus_onset_ns" in restored["trials"][0]
+
+
+def test_mixed_and_legacy_fields_fall_back_to_extras(tmp_path):
+    trials = [
+        {"trial_number": 1, "pre_stimulus_interval_ms": 800, "stimulus": 3, "is_target": 1, "is_correct": 1, "reaction_time_ms": None},
+        {"trial_number": 2, "pre_stimulus_interval_ms": 900, "stimulus": 4, "is_target": 0, "is_correct": 1, "reaction_time_ms": 250.5},
+        {"trial_number": 3, "pre_stimulus_interval_ms": 700, "stimulus": 5, "is_target": 0, "is_correct": 1, "reaction_time_ms": 301, "note": "x"}
+    ]
+    data = {"datetime_iso": "2024-01-01T00:00:00", "test_settings": {}, "summary_results": {}, "trials": trials}
+    original, restored, base_path = round_trip(tmp_path, data)
+    assert restored == original
+    assert "reaction_time_ms" not in pvt_compact.load_meta(base_path)["columns"]
+    assert np.isnan(pvt_compact.load_trial_array(base_path)["reaction_time_ms"]).all()
+
+
+def test_memmap_columns_match_json_metrics(tmp_path):
+    sessions = [simulated_session(seed) for seed in range(4)]
+    for i, data in enumerate(sessions):
+        pvt_compact.session_to_compact(data, str(tmp_path / f"s{i}"))
+    bases = pvt_compact.find_compact_sessions(str(tmp_path))
+    arrays = [pvt_compact.load_trial_array(base) for base in bases]
+    assert isinstance(arrays[0], np.memmap)
+    from_arrays = session_metrics(TrialColumns.from_trial_arrays(arrays))
+    from_json = session_metrics(TrialColumns.from_sessions(sessions))
+    for name in from_json:
+        np.testing.assert_allclose(from_arrays[name], from_json[name])
@@ -0,0 +1,329 @@
+import random
+import pytest
+
+from pvt_engine import PVTEngine, VirtualClock, timer_drift_summary
+
+
+class RecordingView:
+    def __init__(self):
+        self.events = []
+        self.finished = False
+
+    def show_stimulus(self, stimulus):
+        self.events.append(("stimulus", stimulus))
+
+    def clear_stimulus(self):
+        self.events.append(("clear", None))
+
+    def show_feedback(self, message, color):
+        self.events.append(("feedback", message))
+
+    def clear_feedback(self):
+        self.events.append(("clear_feedback", None))
+
+    def test_finished(self):
+        self.finished = True
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+@pytest.fixture
+def view():
+    return RecordingView()
+
+@pytest.fixture
+def engine(clock, view):
+    engine = PVTEngine(scheduler=clock, clock=clock, view=view, rng=random.Random(1))
+    engine.max_trials = 10
+    engine.target_trials = 3
+    engine.response_limit_ms = 500
+    engine.feedback_duration_ms = 10
+    return engine
+
+
+def test_virtual_clock_runs_timers_in_order(clock):
+    fired = []
+    clock.after(30, fired.append, "b")
+    clock.after(10, fired.append, "a")
+    cancelled = clock.after(20, fired.append, "x")
+    clock.after_cancel(cancelled)
+    clock.advance(25)
+    assert fired == ["a"]
+    assert clock.now_ns() == 25_000_000
+    clock.run()
+    assert fired == ["a", "b"]
+    assert clock.now() == pytest.approx(0.03)
+
+
+def test_go_response_uses_injected_clock(engine, clock):
+    engine.target_number = 9
+    engine.sequence = [1]
+    engine.start()
+    clock.step() # ISI elapses -> stimulus
+    clock.advance(200)
+    engine.handle_response()
+    assert engine.correct_go_responses == 1
+    assert engine.all_trial_data[0]['reaction_time_ms'] == 200
+    assert engine.all_trial_data[0]['is_correct'] == 1
+
+
+def test_too_fast_and_commission(engine, clock):
+    engine.target_number = 2
+    engine.sequence = [2, 2]
+    engine.start()
+    clock.step()
+    clock.advance(50)
+    engine.handle_response()
+    clock.step() # feedback clear -> next ISI
+    clock.step() # stimulus
+    clock.advance(300)
+    engine.handle_response()
+    assert engine.commission_outliers == 1
+    assert engine.commission_errors == 1
+    assert [t['is_correct'] for t in engine.all_trial_data] == [0, 0]
+
+
+def test_timeouts(engine, clock):
+    engine.target_number = 4
+    engine.sequence = [5, 4] # popped from the end
+    engine.start()
+    clock.run()
+    assert engine.correct_no_go_responses == 1
+    assert engine.omission_outliers == 1
+    assert [t['reaction_time_ms'] for t in engine.all_trial_data] == [None, None]
+
+
+def test_full_session_runs_headless(engine, clock, view):
+    engine.choose_target_number()
+    engine.generate_sequence()
+    engine.start()
+    clock.run()
+    assert view.finished
+    assert not engine.test_in_progress
+    assert engine.total_trials_conducted == 10
+    assert len(engine.all_trial_data) == 10
+    assert clock.pending() == 0
+
+
+def test_trial_listeners_receive_each_trial(engine, clock):
+    seen = []
+    engine.trial_listeners.append(seen.append)
+    engine.choose_target_number()
+    engine.generate_sequence()
+    engine.start()
+    clock.run()
+    assert seen == engine.all_trial_data
+
+
+def test_end_test_cancels_pending_timers(engine, clock, view):
+    engine.choose_target_number()
+    engine.generate_sequence()
+    engine.start()
+    assert clock.pending() == 1
+    engine.end_test()
+    assert clock.pending() == 0
+    assert view.finished
+
+
+class PaintingView(RecordingView):
+    # update_idletasks に相当する描画で仮想時間が 3ms 進む
+    def __init__(self, clock):
+        super().__init__()
+        self.clock = clock
+
+    def flush_display(self):
+        self.clock._now_ns += 3_000_000
+
+
+def test_precise_onset_timestamps_after_paint(clock):
+    engine = PVTEngine(scheduler=clock, clock=clock, view=PaintingView(clock), rng=random.Random(1))
+    engine.precise_onset = True
+    engine.target_number = 9
+    engine.sequence = [1]
+    engine.start()
+    clock.step()
+    onset_ns = clock.now_ns()
+    clock.advance(187.25)
+    engine.handle_response()
+    trial = engine.all_trial_data[0]
+    assert trial['paint_latency_ns'] == 3_000_000
+    assert trial['stimulus_onset_ns'] == onset_ns
+    assert trial['response_ns'] - trial['stimulus_onset_ns'] == 187_250_000
+    assert trial['reaction_time_ms'] == 187.25
+
+
+def test_default_mode_keeps_trial_schema(engine, clock):
+    engine.target_number = 9
+    engine.sequence = [1]
+    engine.start()
+    clock.step()
+    clock.advance(200)
+    engine.handle_response()
+    assert 'stimulus_onset_ns' not in engine.all_trial_data[0]
+
+
+def test_raw_press_events_are_recorded(engine, clock):
+    engine.target_number = 9
+    engine.sequence = [2, 1]
+    engine.feedback_duration_ms = 100
+    engine.start()
+    isi_ms = engine.current_isi_ms
+    clock.advance(isi_ms - 50)
+    engine.handle_response() # ISI 中の押下は採点しないが記録する
+    clock.advance(50)
+    onset_ms = clock.now_ns() / 1_000_000
+    clock.advance(230)
+    engine.handle_response()
+    clock.advance(40)
+    engine.handle_response() # フィードバック中
+    clock.advance(60)
+    trial = engine.all_trial_data[0]
+    assert trial['onset_ms'] == onset_ms
+    assert trial['reaction_time_ms'] == 230
+    assert trial['response_offsets_ms'] == [-50.0, 230.0, 270.0]
+    assert engine.total_trials_conducted == 1
+    clock.run()
+    assert engine.all_trial_data[1]['response_offsets_ms'] == [] # 無反応の試行
+
+    engine.reset()
+    engine.record_raw_events = False
+    engine.sequence = [1]
+    engine.start()
+    clock.run()
+    assert 'onset_ms' not in engine.all_trial_data[0] and 'response_offsets_ms' not in engine.all_trial_data[0]
+
+
+class LaggyScheduler:
+    # 負荷の高いマシンを模して、すべてのタイマーが要求より 7ms 遅れて発火する
+    def __init__(self, clock, lag_ms):
+        self.clock = clock
+        self.lag_ms = lag_ms
+
+    def after(self, delay_ms, callback, *args):
+        return self.clock.after(delay_ms + self.lag_ms, callback, *args)
+
+    def after_cancel(self, timer_id):
+        self.clock.after_cancel(timer_id)
+
+
+def test_timer_drift_recorded_per_trial(clock, view):
+    engine = PVTEngine(scheduler=LaggyScheduler(clock, 7), clock=clock, view=view, rng=random.Random(3))
+    engine.max_trials = 4
+    engine.target_trials = 1
+    engine.response_limit_ms = 500
+    engine.feedback_duration_ms = 10
+    engine.choose_target_number()
+    engine.generate_sequence()
+    engine.start()
+    clock.run()
+    for trial in engine.all_trial_data:
+        assert trial['isi_actual_ms'] - trial['pre_stimulus_interval_ms'] == pytest.approx(7)
+        assert trial['response_window_actual_ms'] == pytest.approx(507)
+        assert trial['feedback_actual_ms'] == pytest.approx(17)
+
+    drift = timer_drift_summary(engine.all_trial_data, 500, 10)
+    assert drift['isi']['count'] == 4
+    assert drift['isi']['p95_drift_ms'] == pytest.approx(7)
+    assert drift['response_window']['max_drift_ms'] == pytest.approx(7)
+    assert drift['feedback']['p50_drift_ms'] == pytest.approx(7)
+
+
+def test_timer_drift_summary_percentiles():
+    trials = [{'pre_stimulus_interval_ms': 1000, 'isi_actual_ms': 1000 + d} for d in range(101)]
+    drift = timer_drift_summary(trials, 1500, 1000)
+    assert drift['isi']['p50_drift_ms'] == 50
+    assert drift['isi']['p99_drift_ms'] == 99
+    assert drift['isi']['max_drift_ms'] == 100
+    assert drift['feedback'] == {'count': 0, 'p50_drift_ms': None, 'p95_drift_ms': None, 'p99_drift_ms': None, 'max_drift_ms': None}
+
+
+def test_running_stats_updated_per_trial(engine, clock):
+    engine.choose_target_number()
+    engine.generate_sequence()
+    engine.start()
+    rng = random.Random(9)
+    while clock.step():
+        if engine.accepting_response and rng.random() < 0.8:
+            clock.advance(rng.randint(120, 700))
+            engine.handle_response()
+    from pvt_analytics import rt_summary
+    assert engine.live_stats.trials == engine.total_trials_conducted
+    assert engine.rt_summary() == rt_summary(engine.reaction_times)
+    assert engine.live_metrics()['trials'] == 10
+
+
+def test_reassigned_reaction_times_resync_stats(engine):
+    engine.reaction_times = [180, 220]
+    assert engine.rt_summary() == (200, 220, 28)
+    engine.reaction_times.append(400)
+    assert engine.rt_summary()[1] == 400
+
+
+def test_schedule_seed_reproduces_session():
+    def run(seed):
+        clock = VirtualClock()
+        engine = PVTEngine(scheduler=clock, clock=clock, rng=random.Random())
+        engine.max_trials = 12
+        engine.target_trials = 4
+        engine.target_number = 3
+        engine.schedule_seed = seed
+        engine.generate_sequence()
+        planned = list(engine.schedule.stimuli), list(engine.schedule.isi_ms)
+        engine.start()
+        clock.run()
+        presented = [t['stimulus'] for t in engine.all_trial_data], [t['pre_stimulus_interval_ms'] for t in engine.all_trial_data]
+        return planned, presented
+
+    planned, presented = run(1234)
+    assert presented == planned
+    assert run(1234) == (planned, presented)
+
+
+def test_overriding_sequence_drops_schedule(engine):
+    engine.target_number = 5
+    engine.generate_sequence()
+    assert engine.schedule is not None
+    engine.sequence = [1, 2]
+    assert engine.schedule is None
+
+
+def test_duration_mode_runs_until_deadline(clock, view):
+    engine = PVTEngine(scheduler=clock, clock=clock, view=view, rng=random.Random(2))
+    engine.target_number = 4
+    engine.duration_s = 60
+    engine.feedback_duration_ms = 100
+    engine.min_interval_s = 1.0
+    engine.max_interval_s = 2.0
+    engine.generate_sequence()
+    engine.start()
+    clock.run()
+    assert view.finished
+    assert 15 < engine.total_trials_conducted < 30 # 1試行 = ISI 1〜2s + 反応窓 1.5s + 0.1s
+    assert clock.now() <= 60 + 2 + 1.5 + 0.1 # 最後のISI/反応窓/フィードバックを超えない
+    stimuli = [t['stimulus'] for t in engine.all_trial_data]
+    assert 4 in stimuli and set(stimuli) - {4}
+
+
+def test_duration_mode_without_retained_trials_keeps_memory_flat(clock):
+    engine = PVTEngine(scheduler=clock, clock=clock, rng=random.Random(3))
+    engine.target_number = 2
+    engine.duration_s = 3600
+    engine.retain_trials = False
+    engine.feedback_duration_ms = 10
+    engine.min_interval_s = 0.5
+    engine.max_interval_s = 1.0
+    engine.generate_sequence()
+    seen = []
+    engine.trial_listeners.append(lambda trial: seen.append(trial['trial_number']))
+    engine.start()
+    while clock.step():
+        if engine.accepting_response:
+            clock.advance(300)
+            engine.handle_response()
+    assert engine.total_trials_conducted > 2000
+    assert engine.all_trial_data == [] and engine.reaction_times == []
+    assert seen[-1] == engine.total_trials_conducted
+    assert engine.live_stats.trials == engine.total_trials_conducted
+    assert engine.rt_summary()[0] == 300
@@ -0,0 +1,105 @@
+from pvt_fatigue import FatigueMonitor
+from pvt_simulator import ParticipantModel, build_simulated_session
+
+
+def make_session(seed, max_trials=120, **model):
+    engine, clock = build_simulated_session(ParticipantModel(lapse_rate=0.0, anticipation_rate=0.0, **model), seed,
+                                            max_trials=max_trials, target_trials=max_trials // 5, target_number=3,
+                                            feedback_duration_ms=10)
+    return engine, clock
+
+
+def go_trial(trial_number, rt_ms):
+    return {"trial_number": trial_number, "is_target": 0, "is_correct": 0 if rt_ms is None else 1,
+            "reaction_time_ms": rt_ms}
+
+
+def test_stable_session_raises_no_alerts():
+    for seed in range(3):
+        engine, clock = make_session(seed)
+        monitor = FatigueMonitor(engine).start()
+        engine.start()
+        clock.run()
+        report = monitor.report()
+        assert report["alert_count"] == 0
+        assert report["trials_monitored"] == engine.correct_go_responses + engine.omission_outliers
+        assert report["rt_cusum"]["baseline_ready"] is True
+        assert 2.5 < report["rt_cusum"]["baseline_mean_reciprocal_rt"] < 4
+
+
+def test_false_alarm_rate_with_default_participant():
+    # 見逃しやフライングを含む既定の被験者。変化のない90試行のセッションでアラートが出る割合
+    sessions = 200
+    alerted = 0
+    for seed in range(sessions):
+        engine, clock = build_simulated_session(ParticipantModel(), 10_000 + seed, max_trials=90)
+        monitor = FatigueMonitor(engine).start()
+        engine.start()
+        clock.run()
+        alerted += monitor.report()["alert_count"] > 0
+    assert alerted / sessions < 0.05
+
+
+def test_slowing_detected_after_change_point():
+    engine, clock = make_session(1)
+    model = engine.view.model
+
+    def slow_down(trial_outcome):
+        if trial_outcome["trial_number"] == 60:
+            model.mu_ms += 200
+
+    engine.trial_listeners.append(slow_down)
+    alerts = []
+    monitor = FatigueMonitor(engine, on_alert=alerts.append).start()
+    engine.start()
+    clock.run()
+    report = monitor.report()
+    rt_alerts = [a for a in report["alerts"] if a["detector"] == "rt"]
+    assert rt_alerts and alerts == report["alerts"]
+    first = rt_alerts[0]
+    assert 60 < first["trial_number"] <= 70
+    assert 55 <= first["change_trial_number"] <= first["trial_number"]
+    assert first["mean_rt_since_change_ms"] > 450
+    assert first["onset_ms"] is not None
+
+
+def test_lapse_cusum_alerts_on_run_of_lapses():
+    engine, clock = make_session(0)
+    monitor = FatigueMonitor(engine)
+    monitor.add_trial(go_trial(1, 300))
+    monitor.add_trial(go_trial(2, None))
+    monitor.add_trial(go_trial(3, 620)) # 500ms より遅い正反応もラプス
+    assert monitor.alert_count == 0
+    monitor.add_trial({"trial_number": 4, "is_target": 1, "is_correct": 0, "reaction_time_ms": 250}) # NoGo は対象外
+    monitor.add_trial({"trial_number": 5, "is_target": 0, "is_correct": 0, "reaction_time_ms": 40}) # フライングも対象外
+    monitor.add_trial(go_trial(6, None))
+    assert monitor.alert_count == 0 # 3回続いただけではまだ
+    monitor.add_trial(go_trial(7, None))
+    assert monitor.alert_count == 1
+    alert = monitor.alerts[0]
+    assert (alert["detector"], alert["trial_number"], alert["change_trial_number"]) == ("lapse", 7, 2)
+    assert alert["lapse_rate_since_change"] == 1.0
+    assert monitor.lapse_cusum.statistic == 0.0 # アラートの後は 0 から
+    assert monitor.trials_monitored == 5
+
+
+def test_detector_runs_in_isi_after_next_stimulus_is_scheduled():
+    engine, clock = make_session(2, max_trials=5)
+    monitor = FatigueMonitor(engine).start()
+    seen = []
+    original = monitor.add_trial
+
+    def add_trial(trial_outcome):
+        seen.append((trial_outcome["trial_number"], engine.interval_timer_id is not None, engine.stimulus_on_screen))
+        original(trial_outcome)
+
+    monitor.add_trial = add_trial
+    engine.start()
+    clock.run()
+    assert [s[0] for s in seen] == [1, 2, 3, 4] # 最後の試行は report() で処理する
+    assert all(scheduled and not on_screen for _, scheduled, on_screen in seen)
+    report = monitor.report()
+    assert [s[0] for s in seen] == [1, 2, 3, 4, 5]
+    assert report["trials_monitored"] <= 5
+    monitor.stop()
+    assert monitor._queue_trial not in engine.trial_listeners and monitor._process_in_isi not in engine.isi_listeners
@@ -0,0 +1,57 @@
+import datetime
+import threading
+
+from pvt_persist import PersistenceWorker
+from pvt_session import session_base_filename
+
+
+def test_jobs_run_in_order_and_callbacks_run_on_drain():
+    worker = PersistenceWorker()
+    gate = threading.Event()
+    order = []
+    events = []
+
+    def job(name):
+        def run(progress):
+            gate.wait(5)
+            progress(f"{name}-step")
+            order.append(name)
+            return name
+        return run
+
+    first = worker.submit(job("a"), on_progress=lambda j, m: events.append(m), on_done=lambda j: events.append(j.result))
+    worker.submit(job("b"), on_done=lambda j: events.append(j.result))
+    assert worker.pending() == 2
+    assert worker.drain() == 0 # 書き込みが終わるまでメインスレッドは何も待たない
+    gate.set()
+    assert worker.wait(timeout=5)
+    assert order == ["a", "b"]
+    assert events == ["a-step", "a", "b"]
+    assert first.finished.is_set() and first.progress_message == "a-step"
+    worker.close()
+
+
+def test_job_errors_are_captured():
+    worker = PersistenceWorker()
+    done = []
+
+    def run(progress):
+        raise OSError("disk full")
+
+    worker.submit(run, on_done=done.append)
+    assert worker.wait(timeout=5)
+    assert isinstance(done[0].error, OSError)
+    worker.close()
+
+
+def test_reserved_names_are_skipped_until_saved(tmp_path):
+    worker = PersistenceWorker()
+    gate = threading.Event()
+    now = datetime.datetime(2025, 1, 2, 3, 4)
+    base = session_base_filename(str(tmp_path), now, reserved=worker.reserved())
+    worker.submit(lambda progress: gate.wait(5), reserved=(base,))
+    second = session_base_filename(str(tmp_path), now, reserved=worker.reserved())
+    assert second == base + "_2"
+    gate.set()
+    assert worker.close(timeout=5)
+    assert worker.reserved() == frozenset()
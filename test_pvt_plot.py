@@ -0,0 +1,50 @@
+import os
+
+from pvt_plot import GraphExporter, draw_line_plot, nice_ticks, plot_layout
+
+
+class RecordingCanvas:
+    def __init__(self):
+        self.items = []
+
+    def delete(self, tag):
+        self.items.clear()
+
+    def __getattr__(self, name):
+        if name.startswith('create_'):
+            return lambda *coords, **options: self.items.append((name[7:], coords, options))
+        raise AttributeError(name)
+
+
+def test_nice_ticks_cover_range():
+    assert nice_ticks(180, 620) == [0, 200, 400, 600, 800]
+    ticks = nice_ticks(250, 250)
+    assert ticks[0] <= 250 < ticks[-1]
+
+
+def test_plot_layout_maps_points_inside_box():
+    layout = plot_layout([200, 400, 300], 400, 220)
+    left, top, right, bottom = layout['box']
+    xs = [x for x, _ in layout['points']]
+    assert xs[0] == left and xs[-1] == right
+    for x, y in layout['points']:
+        assert left <= x <= right and top <= y <= bottom
+    # Larger RT is drawn higher up (smaller y)
+    assert layout['points'][1][1] < layout['points'][2][1] < layout['points'][0][1]
+
+
+def test_draw_line_plot_creates_markers():
+    canvas = RecordingCanvas()
+    draw_line_plot(canvas, [200, 250, 300, 260], 400, 220)
+    kinds = [kind for kind, _, _ in canvas.items]
+    assert kinds.count('oval') == 4
+    assert 'line' in kinds
+
+
+def test_graph_exporter_reuses_figure(tmp_path):
+    exporter = GraphExporter()
+    exporter.export([200, 250], str(tmp_path / 'a.png'))
+    figure = exporter._figure
+    exporter.export([300, 310, 320], str(tmp_path / 'b.png'))
+    assert exporter._figure is figure
+    assert os.path.getsize(tmp_path / 'a.png') > 0 and os.path.getsize(tmp_path / 'b.png') > 0
@@ -0,0 +1,82 @@
+import gc
+import os
+import random
+
+from pvt_engine import NullView, PVTEngine, VirtualClock
+from pvt_precision import PrecisionSession
+
+
+class StallingView(NullView):
+    # 刺激を出すたびに仮想時間が stall_ms 止まる (描画の引っかかりの代わり)
+    def __init__(self, clock, stall_ms):
+        self.clock = clock
+        self.stall_ms = stall_ms
+        self.gc_enabled_during_stimulus = []
+
+    def show_stimulus(self, stimulus):
+        self.gc_enabled_during_stimulus.append(gc.isenabled())
+        self.clock._now_ns += self.stall_ms * 1_000_000
+
+
+def make_engine(stall_ms=0):
+    clock = VirtualClock()
+    view = StallingView(clock, stall_ms)
+    engine = PVTEngine(scheduler=clock, clock=clock, view=view, rng=random.Random(4))
+    engine.max_trials = 8
+    engine.target_trials = 2
+    engine.target_number = 6
+    engine.feedback_duration_ms = 50
+    engine.generate_sequence()
+    return engine, clock, view
+
+
+def test_gc_disabled_during_session_and_restored():
+    engine, clock, view = make_engine()
+    was_enabled = gc.isenabled()
+    engine.start()
+    session = PrecisionSession(engine, raise_priority=False, pin_cpu=False).start()
+    clock.run()
+    assert view.gc_enabled_during_stimulus == [False] * 8
+    assert gc.isenabled() == was_enabled
+    assert not session.active # セッション終了で自動的に戻る
+    assert session.report['gc_disabled'] is True
+    assert session.report['gc_collections_in_isi'] == 7 # 最初の ISI は start() より前に始まっている
+    assert session.report['pause_count'] == 0
+
+
+def test_listeners_deferred_to_isi_and_flushed_at_end():
+    engine, clock, view = make_engine()
+    calls = []
+    engine.trial_listeners.append(lambda trial: calls.append(('trial', trial['trial_number'], engine.stimulus_on_screen or engine.feedback_clear_timer_id is not None)))
+    engine.start()
+    PrecisionSession(engine, raise_priority=False, pin_cpu=False).start()
+    clock.run()
+    assert [c[1] for c in calls] == list(range(1, 9))
+    # 反応/タイムアウト処理 (フィードバック表示中) ではなく、次の ISI か終了時に呼ばれる
+    assert not any(c[2] for c in calls)
+    assert engine.defer_listeners is False
+
+
+def test_pauses_above_threshold_are_recorded():
+    engine, clock, view = make_engine(stall_ms=40)
+    engine.start()
+    session = PrecisionSession(engine, pause_threshold_ms=15, raise_priority=False, pin_cpu=False).start()
+    clock.run()
+    report = session.report
+    assert report['pause_count'] == 8
+    assert report['max_lag_ms'] >= 30
+    assert {p['phase'] for p in report['pauses']} == {'stimulus'} # 刺激の描画中に止まった
+    assert [p['trial_number'] for p in report['pauses']] == list(range(1, 9))
+
+
+def test_cpu_affinity_restored():
+    if not hasattr(os, 'sched_getaffinity'):
+        return
+    original = os.sched_getaffinity(0)
+    engine, clock, view = make_engine()
+    engine.start()
+    session = PrecisionSession(engine, raise_priority=False, pin_cpu=True).start()
+    if len(original) > 1:
+        assert os.sched_getaffinity(0) == {max(original)}
+    session.stop()
+    assert os.sched_getaffinity(0) == original
@@ -0,0 +1,71 @@
+import json
+import random
+
+from pvt_engine import NullView, PVTEngine, VirtualClock
+from pvt_profile import HISTOGRAM_EDGES_US, HANDLERS, LatencyHistogram, SessionProfiler
+
+
+class SlowView(NullView):
+    # 刺激の表示に show_ms かかるビュー (仮想時間)
+    def __init__(self, clock, show_ms):
+        self.clock = clock
+        self.show_ms = show_ms
+
+    def show_stimulus(self, stimulus):
+        self.clock._now_ns += self.show_ms * 1_000_000
+
+
+def make_engine(show_ms=0, max_trials=6):
+    clock = VirtualClock()
+    engine = PVTEngine(scheduler=clock, clock=clock, view=SlowView(clock, show_ms), rng=random.Random(2))
+    engine.max_trials = max_trials
+    engine.target_trials = 2
+    engine.target_number = 5
+    engine.feedback_duration_ms = 100
+    engine.generate_sequence()
+    return engine, clock
+
+
+def test_histogram_buckets_and_worst_cases():
+    histogram = LatencyHistogram(worst_cases=2)
+    for duration_us in (5, 15, 150, 150_000):
+        histogram.add(duration_us * 1000, {"trial_number": duration_us})
+    summary = histogram.summary()
+    assert summary["count"] == 4
+    assert sum(summary["histogram"]["counts"]) == 4
+    assert summary["histogram"]["counts"][0] == 1 # < 10 µs
+    assert summary["histogram"]["counts"][len(HISTOGRAM_EDGES_US)] == 1 # 上限なしの区間
+    assert [w["trial_number"] for w in summary["worst"]] == [150_000, 150]
+    assert summary["max_us"] == 150_000
+
+
+def test_profiler_times_handlers_and_completes_once():
+    engine, clock = make_engine(show_ms=3)
+    completed = []
+    profiler = SessionProfiler(engine, heartbeat_ms=10, on_complete=completed.append).start()
+    engine.start()
+    clock.run()
+    assert completed == [profiler]
+    profile = profiler.profile()
+    assert profile["trials"] == 6
+    assert profile["handlers"]["display_stimulus"]["count"] == 6
+    assert profile["handlers"]["display_stimulus"]["max_us"] == 3000
+    assert profile["handlers"]["handle_timeout"]["count"] == 6
+    assert profile["handlers"]["end_test"]["count"] == 1
+    # 表示中の 3ms 分だけハートビートが遅れる
+    assert profile["event_loop_lag"]["max_us"] == 3000
+    # 終了後はクラスのメソッドに戻り、ハートビートも止まる
+    assert not any(name in engine.__dict__ for name in HANDLERS)
+    assert clock.pending() == 0
+
+
+def test_profile_is_written_as_json(tmp_path):
+    engine, clock = make_engine(max_trials=2)
+    profiler = SessionProfiler(engine).start()
+    engine.start()
+    clock.run()
+    path = profiler.write(str(tmp_path / "session.profile"))
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["handlers"]["run_next_trial"]["count"] >= 2
+    assert "edges_us" in data["event_loop_lag"]["histogram"]
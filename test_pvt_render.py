@@ -0,0 +1,67 @@
+from pvt_render import StimulusCanvas
+
+
+class ItemCanvas:
+    def __init__(self):
+        self.items = {}
+        self.configure_calls = 0
+
+    def create_text(self, *coords, **options):
+        item = len(self.items) + 1
+        self.items[item] = dict(options)
+        return item
+
+    def itemconfigure(self, item, **options):
+        self.configure_calls += 1
+        self.items[item].update(options)
+
+    def visible_texts(self):
+        return sorted(item['text'] for item in self.items.values() if item['state'] == 'normal')
+
+
+class StepClock:
+    def __init__(self, step_ns):
+        self.now = 0
+        self.step_ns = step_ns
+
+    def __call__(self):
+        self.now += self.step_ns
+        return self.now
+
+
+def make_canvas(clock=None):
+    canvas = ItemCanvas()
+    return canvas, StimulusCanvas(canvas, 600, 360, 'stimulus', 'feedback', clock_ns=clock or StepClock(1000))
+
+
+def test_items_are_created_once_and_toggled():
+    canvas, stimuli = make_canvas()
+    created = len(canvas.items)
+    assert created == 9 + 4
+    assert canvas.visible_texts() == []
+    stimuli.show_digit(3)
+    stimuli.show_digit(7)
+    assert canvas.visible_texts() == ['7']
+    stimuli.hide_digit()
+    stimuli.show_feedback('Good!', 'green')
+    stimuli.show_feedback('Bad!', 'red')
+    assert canvas.visible_texts() == ['Bad!']
+    stimuli.show_feedback('Late', 'blue') # 未知の組み合わせは初回だけ作る
+    stimuli.show_feedback('Late', 'blue')
+    assert len(canvas.items) == created + 1
+    stimuli.clear()
+    assert canvas.visible_texts() == []
+
+
+def test_costs_are_recorded_per_digit():
+    canvas, stimuli = make_canvas(StepClock(2000))
+    for digit in (1, 1, 5):
+        stimuli.show_digit(digit)
+        stimuli.flush(lambda: None)
+    stimuli.flush(lambda: None) # 数字を出していない flush は計上しない
+    summary = stimuli.cost_summary()
+    assert summary['update']['1'] == {'count': 2, 'mean_us': 2.0, 'max_us': 2.0}
+    assert summary['paint']['5']['count'] == 1
+    assert set(summary['paint']) == {'1', '5'}
+    stimuli.reset_costs()
+    assert stimuli.cost_summary() == {'update': {}, 'paint': {}}
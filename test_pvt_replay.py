@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+import pytest
+
+import pvt_replay
+from pvt_analytics import TrialColumns, session_metrics
+from pvt_compact import convert_json_to_compact
+from pvt_session import build_session_data, count_outcomes, write_session_json
+from pvt_simulator import ParticipantModel, simulate_session
+
+SETTINGS = {"target_number": 3, "response_limit_ms": 1500, "response_outlier_ms": 100, "feedback_duration_ms": 10}
+
+
+def simulated_session(seed, **model):
+    engine = simulate_session(ParticipantModel(**model), seed, max_trials=60, target_trials=15, target_number=3,
+                              feedback_duration_ms=10)
+    return build_session_data(f"2025-03-{seed + 1:02d}T08:00:00", SETTINGS, engine.all_trial_data,
+                              rt_values=engine.rt_summary())
+
+
+def trial(is_target, rt_ms, offsets=None, window_ms=None):
+    return {"trial_number": 1, "pre_stimulus_interval_ms": 1000, "stimulus": 3 if is_target else 4,
+            "is_target": int(is_target), "is_correct": 0, "reaction_time_ms": rt_ms,
+            "response_window_actual_ms": window_ms, "response_offsets_ms": offsets}
+
+
+def test_recorded_thresholds_reproduce_stored_scores():
+    sessions = [simulated_session(seed, anticipation_rate=0.05, lapse_rate=0.1, tau_ms=150) for seed in range(6)]
+    archive = pvt_replay.EventArchive.from_sessions(sessions)
+    scores = pvt_replay.rescore(archive, 100, 500, 1500)
+    metrics = session_metrics(TrialColumns.from_sessions(sessions))
+    for index, session in enumerate(sessions):
+        counts = count_outcomes(session["trials"], 100)
+        for field in ("correct_go_responses", "correct_no_go_responses", "commission_errors",
+                      "outliers_commission_too_fast", "outliers_omission_too_late"):
+            assert scores[field][0, index] == counts[field]
+        assert scores["total_trials"][index] == counts["total_trials_conducted"]
+    assert scores["lapses"][0].tolist() == metrics["lapses"].tolist()
+    np.testing.assert_allclose(scores["median_rt_ms"][0], metrics["median_rt_ms"])
+    np.testing.assert_allclose(scores["mean_rt_ms"][0], metrics["mean_rt_ms"])
+    assert not scores["censored_trials"].any()
+    assert (scores["false_starts"] == 0).all() # シミュレータは ISI 中に押さない
+
+
+def test_alternate_thresholds_move_trials_between_categories():
+    trials = [
+        trial(False, 120.0, [-300.0, -20.0, 120.0]), # 150ms 基準ではフライング
+        trial(False, 280.0, [280.0]),
+        trial(False, 620.0, [620.0]), # ラプス
+        trial(False, None, [1700.0], window_ms=1500.0), # 見逃し (フィードバック中に押した)
+        trial(True, 130.0, [130.0]),
+        trial(True, None, [], window_ms=1500.0)
+    ]
+    archive = pvt_replay.EventArchive.from_sessions([{"test_settings": SETTINGS, "trials": trials}])
+    scores = pvt_replay.rescore(archive, anticipation_ms=[100, 150], lapse_ms=[500, 300, 100], response_limit_ms=[1500, 600, 2000])
+    assert len(scores["anticipation_ms"]) == 18
+    rows = {(a, p, l): c for c, (a, p, l) in enumerate(zip(scores["anticipation_ms"], scores["lapse_ms"],
+                                                           scores["response_limit_ms"]))}
+
+    def score(a, p, l):
+        return {name: scores[name][rows[(a, p, l)], 0] for name in pvt_replay.SCORE_FIELDS}
+
+    recorded = score(100, 500, 1500)
+    assert (recorded["correct_go_responses"], recorded["commission_errors"], recorded["outliers_commission_too_fast"]) == (3, 1, 0)
+    assert recorded["lapses"] == 2 and recorded["median_rt_ms"] == 280.0
+    strict = score(150, 500, 1500)
+    assert (strict["correct_go_responses"], strict["commission_errors"], strict["outliers_commission_too_fast"]) == (2, 0, 2)
+    assert strict["median_rt_ms"] == 450.0 and strict["mean_rt_ms"] == 450.0
+    assert score(100, 300, 1500)["lapses"] == 2 # 620ms と見逃し (280ms はラプスでない)
+    assert score(150, 100, 1500)["lapses"] == 3 # 150ms 未満はフライングなのでラプスに数えない
+    short = score(100, 500, 600)
+    assert (short["correct_go_responses"], short["outliers_omission_too_late"], short["lapses"]) == (2, 2, 2)
+    longer = score(100, 500, 2000)
+    assert longer["censored_trials"] == 2 and recorded["censored_trials"] == 0
+    assert scores["false_starts"].tolist() == [2]
+
+
+def test_legacy_sessions_without_raw_events():
+    trials = [{k: v for k, v in trial(False, 300, [300.0]).items() if k not in ("response_offsets_ms", "response_window_actual_ms")},
+              {k: v for k, v in trial(False, None).items() if k not in ("response_offsets_ms", "response_window_actual_ms")}]
+    archive = pvt_replay.EventArchive.from_sessions([{"test_settings": {}, "trials": trials}, {"trials": []}])
+    assert archive.false_starts.tolist() == [-1, -1]
+    assert archive.response_limit_ms.tolist() == [1500.0, 1500.0]
+    scores = pvt_replay.rescore(archive, 100, 500, 1600)
+    assert scores["censored_trials"][0].tolist() == [1, 0]
+    assert scores["outliers_omission_too_late"][0].tolist() == [1, 0]
+    assert np.isnan(scores["median_rt_ms"][0, 1])
+
+
+def test_pack_and_sweep_cli(tmp_path, capsys):
+    root = tmp_path / "data"
+    for participant, seed in (("alice", 0), ("alice", 1), ("bob", 2)):
+        os.makedirs(root / participant, exist_ok=True)
+        write_session_json(str(root / participant / f"{seed}.json"), simulated_session(seed))
+    os.remove(convert_json_to_compact(str(root / "alice" / "1.json")) + ".json") # alice/1 はコンパクト形式だけ
+    (root / "bob" / "broken.json").write_text("{", encoding="utf-8")
+    output = str(tmp_path / "archive.npz")
+
+    archive = pvt_replay.main(["pack", str(root), "-o", output, "-j", "1"])
+    assert len(archive) == 3
+    assert archive.participant.tolist() == ["alice", "alice", "bob"]
+    assert archive.source_path[1].endswith("1.npy")
+    loaded = pvt_replay.EventArchive.load(output)
+    assert np.array_equal(loaded.rt_ms, archive.rt_ms, equal_nan=True)
+    assert loaded.participant.tolist() == archive.participant.tolist()
+
+    csv_path = str(tmp_path / "sweep.csv")
+    rows = pvt_replay.main(["sweep", output, "--anticipation", "100", "150", "--lapse", "500", "--csv", csv_path])
+    assert [row["anticipation_ms"] for row in rows] == [100.0, 150.0]
+    assert all(row["sessions"] == 3 for row in rows)
+    assert rows[1]["mean_too_fast"] >= rows[0]["mean_too_fast"]
+    with open(csv_path, encoding="utf-8") as f:
+        assert f.readline().startswith("anticipation_ms,lapse_ms,response_limit_ms")
+    assert "anticipation 150 ms" in capsys.readouterr().out
+
+
+def test_archive_format_version_is_checked(tmp_path):
+    archive = pvt_replay.EventArchive.from_sessions([simulated_session(0)])
+    path = archive.save(str(tmp_path / "a.npz"))
+    with np.load(path) as npz:
+        arrays = dict(npz)
+    arrays["format_version"] = np.array(pvt_replay.ARCHIVE_FORMAT_VERSION + 1)
+    np.savez(path, **arrays)
+    with pytest.raises(ValueError):
+        pvt_replay.EventArchive.load(path)
@@ -0,0 +1,74 @@
+import json
+import pytest
+
+import pvt_schedule
+from pvt_schedule import TrialSchedule, generate_schedule, generate_schedule_bank, validate_schedule
+
+
+def longest_target_run(schedule):
+    run = longest = 0
+    for stimulus in schedule.stimuli:
+        run = run + 1 if stimulus == schedule.target_number else 0
+        longest = max(longest, run)
+    return longest
+
+
+def test_same_seed_reproduces_schedule():
+    a = generate_schedule(42, 3, 100, 25, 500, 5000)
+    b = generate_schedule(42, 3, 100, 25, 500, 5000)
+    c = generate_schedule(43, 3, 100, 25, 500, 5000)
+    assert a.stimuli == b.stimuli and a.isi_ms == b.isi_ms
+    assert (a.stimuli, a.isi_ms) != (c.stimuli, c.isi_ms)
+
+
+def test_schedule_respects_counts_and_isi_range():
+    schedule = generate_schedule(1, 7, 100, 25, 500, 5000)
+    assert len(schedule) == 100
+    assert schedule.stimuli.count(7) == 25
+    assert all(500 <= isi <= 5000 for isi in schedule.isi_ms)
+    assert schedule.expected_responses.count(0) == 25
+    assert validate_schedule(schedule) == []
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_max_consecutive_targets_and_balanced_digits(seed):
+    schedule = generate_schedule(seed, 4, 60, 30, 500, 1500, max_consecutive_targets=1, balance_digits=True)
+    assert longest_target_run(schedule) <= 1
+    counts = [schedule.stimuli.count(n) for n in range(1, 10) if n != 4]
+    assert max(counts) - min(counts) <= 1
+    assert validate_schedule(schedule) == []
+
+
+def test_infeasible_constraints_raise():
+    with pytest.raises(ValueError):
+        generate_schedule(0, 1, 10, 8, 500, 1000, max_consecutive_targets=1)
+
+
+def test_exponential_isi_stays_in_range():
+    schedule = generate_schedule(5, 2, 2000, 500, 500, 5000, isi_distribution="exponential")
+    assert all(500 <= isi <= 5000 for isi in schedule.isi_ms)
+    # 打ち切り指数分布は一様分布より短いISIに偏る
+    assert sum(schedule.isi_ms) / len(schedule.isi_ms) < 2750
+
+
+def test_validate_reports_violations():
+    schedule = generate_schedule(0, 5, 20, 5, 500, 1000, max_consecutive_targets=2)
+    schedule.stimuli[:3] = [5, 5, 5]
+    schedule.isi_ms[0] = 100
+    errors = validate_schedule(schedule)
+    assert any("連続" in e for e in errors)
+    assert any("ISI" in e for e in errors)
+
+
+def test_round_trip_and_bank(tmp_path):
+    bank = generate_schedule_bank(9, 50, target_number=6, n_trials=40, n_targets=10, min_isi_ms=500,
+                                  max_isi_ms=2000, max_consecutive_targets=2)
+    assert len({s.seed for s in bank}) == 50
+    assert all(validate_schedule(s) == [] for s in bank)
+    restored = TrialSchedule.from_dict(json.loads(json.dumps(bank[0].to_dict())))
+    assert restored.stimuli == bank[0].stimuli and restored.isi_ms == bank[0].isi_ms
+
+    output = tmp_path / "bank.jsonl"
+    pvt_schedule.main([str(output), "--count", "5", "--trials", "30", "--targets", "8", "--balance-digits"])
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 5
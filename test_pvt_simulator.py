@@ -0,0 +1,46 @@
+import statistics
+
+import bench_engine
+from pvt_simulator import ParticipantModel, build_simulated_session, simulate_session
+
+
+def test_simulated_session_is_reproducible():
+    model = ParticipantModel()
+    a = simulate_session(model, 3, max_trials=40, target_trials=10)
+    b = simulate_session(model, 3, max_trials=40, target_trials=10)
+    assert a.all_trial_data == b.all_trial_data
+    assert a.total_trials_conducted == 40
+    assert a.view.finished
+
+
+def test_ex_gaussian_rts_match_model():
+    model = ParticipantModel(mu_ms=300, sigma_ms=20, tau_ms=80, lapse_rate=0, commission_prob=0, anticipation_rate=0)
+    engine = simulate_session(model, 1, max_trials=400, target_trials=100, response_limit_ms=3000, feedback_duration_ms=10)
+    go_rts = [t['reaction_time_ms'] for t in engine.all_trial_data if not t['is_target']]
+    assert engine.correct_go_responses == 300
+    assert engine.correct_no_go_responses == 100
+    assert abs(statistics.mean(go_rts) - 380) < 15 # mu + tau
+
+
+def test_error_rates_follow_model():
+    model = ParticipantModel(lapse_rate=0.2, commission_prob=0.5, anticipation_rate=0)
+    engine = simulate_session(model, 2, max_trials=400, target_trials=100, feedback_duration_ms=10)
+    assert 40 <= engine.omission_outliers <= 80
+    assert 35 <= engine.commission_errors <= 65
+
+
+def test_presses_after_response_window_are_cancelled():
+    model = ParticipantModel(mu_ms=2000, sigma_ms=1, tau_ms=1, lapse_rate=0, commission_prob=0, anticipation_rate=0)
+    engine, clock = build_simulated_session(model, 4, max_trials=10, target_trials=2, response_limit_ms=500)
+    engine.start()
+    clock.run()
+    assert engine.reaction_times == []
+    assert engine.omission_outliers == 8
+    assert clock.pending() == 0
+
+
+def test_benchmark_suite_reports_numbers():
+    results = bench_engine.run_benchmarks(sessions=10, trials=20, repeats=2, plot=False)
+    assert results['throughput']['sessions_per_s'] > 0
+    assert set(results['handlers']) >= {'run_next_trial', 'display_stimulus', 'clear_feedback_and_proceed'}
+    assert results['end_of_test']['save_ms_median'] > 0
@@ -0,0 +1,110 @@
+import datetime
+
+import numpy as np
+import pytest
+
+import pvt_sleep
+from pvt_store import SessionStore
+
+
+def write(path, text):
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_read_fitbit_oura_and_generic_csv(tmp_path):
+    fitbit = write(tmp_path / 'fitbit.csv', 'Start Time,End Time,Minutes Asleep,Minutes Awake,Time in Bed\n'
+                   '"2025-01-01 11:30PM","2025-01-02 7:00AM","410","40","450"\n'
+                   'bad,row,,,\n')
+    oura = write(tmp_path / 'oura.csv', 'date,bedtime_start,bedtime_end,total_sleep_duration\n'
+                 '2025-01-02,2025-01-03T00:45:00+09:00,2025-01-03T06:15:00+09:00,18000\n')
+    generic = write(tmp_path / 'manual.csv', 'bedtime,wake_time\n2025-01-03 22:00,2025-01-04 06:00\n')
+
+    records, skipped = pvt_sleep.read_sleep_csv(fitbit)
+    assert len(records) == 1 and len(skipped) == 1
+    assert records[0]['night_date'] == '2025-01-01'
+    assert records[0]['asleep_minutes'] == 410 and records[0]['time_in_bed_minutes'] == 450
+
+    records, _ = pvt_sleep.read_sleep_csv(oura)
+    assert records[0]['night_date'] == '2025-01-02' # 0:45 の就寝は前日の夜
+    assert records[0]['bedtime_iso'] == '2025-01-03T00:45'
+    assert records[0]['asleep_minutes'] == 300
+
+    records, _ = pvt_sleep.read_sleep_csv(generic)
+    assert records[0]['asleep_minutes'] == 480
+
+
+def test_unknown_csv_columns_raise(tmp_path):
+    with pytest.raises(ValueError):
+        pvt_sleep.read_sleep_csv(write(tmp_path / 'x.csv', 'a,b\n1,2\n'))
+
+
+def test_sessions_join_previous_night():
+    sleep = [
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 1, 23), datetime.datetime(2025, 1, 2, 7), 420),
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 3, 1), datetime.datetime(2025, 1, 3, 6), 270)
+    ]
+    sessions = [
+        {'datetime_iso': '2025-01-02T08:30:00.123', 'median_rt_ms': 300, 'lapses': 1, 'accuracy_percentage': 95.0},
+        {'datetime_iso': '2025-01-02T21:00:00', 'median_rt_ms': 320, 'lapses': 2, 'accuracy_percentage': 90.0},
+        {'datetime_iso': '2025-01-03T09:00:00', 'median_rt_ms': 350, 'lapses': 4, 'accuracy_percentage': 85.0},
+        {'datetime_iso': '2025-01-10T09:00:00', 'median_rt_ms': 310, 'lapses': 0, 'accuracy_percentage': 99.0}
+    ]
+    table = pvt_sleep.join_sessions_to_sleep(sessions, sleep)
+    assert list(table['night_date']) == ['2025-01-01', '2025-01-01', '2025-01-02', '']
+    np.testing.assert_allclose(table['sleep_hours'], [7, 7, 4.5, np.nan])
+    np.testing.assert_allclose(table['hours_awake'], [1.5, 14, 3, np.nan])
+    np.testing.assert_allclose(table['bedtime_hour'], [11, 11, 13, np.nan]) # 正午からの時間
+
+
+def test_naps_do_not_replace_the_nights_sleep():
+    sleep = [
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 1, 23), datetime.datetime(2025, 1, 2, 7), 420),
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 2, 13), datetime.datetime(2025, 1, 2, 13, 40), 30), # 昼寝
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 2, 23), datetime.datetime(2025, 1, 3, 6), 390),
+        pvt_sleep.make_sleep_record(datetime.datetime(2025, 1, 3, 5), datetime.datetime(2025, 1, 3, 8), 150) # 二度寝
+    ]
+    assert sleep[1]['night_date'] == '2025-01-02' # 昼寝は次の夜と同じ night_date になる
+    sessions = [
+        {'datetime_iso': '2025-01-02T15:00:00', 'median_rt_ms': 300, 'lapses': 1, 'accuracy_percentage': 95.0},
+        {'datetime_iso': '2025-01-03T09:00:00', 'median_rt_ms': 320, 'lapses': 2, 'accuracy_percentage': 90.0}
+    ]
+    table = pvt_sleep.join_sessions_to_sleep(sessions, sleep)
+    assert list(table['night_date']) == ['2025-01-01', '2025-01-02']
+    np.testing.assert_allclose(table['sleep_hours'], [7, 6.5])
+    np.testing.assert_allclose(table['hours_awake'], [8, 3]) # 昼寝からではなく夜の睡眠からの経過時間
+
+
+def test_correlation_summary_recovers_linear_relation():
+    rng = np.random.default_rng(0)
+    sleep_hours = rng.uniform(4, 9, 500)
+    table = {name: np.full(500, np.nan) for name in pvt_sleep.SLEEP_VARIABLES + pvt_sleep.PERFORMANCE_VARIABLES}
+    table['sleep_hours'] = sleep_hours
+    table['median_rt_ms'] = 450 - 20 * sleep_hours + rng.normal(0, 5, 500)
+    table['median_rt_ms'][:10] = np.nan
+    summary = {(s['sleep_variable'], s['performance_variable']): s for s in pvt_sleep.correlation_summary(table)}
+    rt = summary[('sleep_hours', 'median_rt_ms')]
+    assert rt['n'] == 490
+    assert rt['slope'] == pytest.approx(-20, abs=0.5)
+    assert rt['intercept'] == pytest.approx(450, abs=3)
+    assert rt['pearson_r'] < -0.95
+    assert summary[('wake_hour', 'lapses')]['pearson_r'] is None
+
+
+def test_cli_import_and_report(tmp_path, capsys):
+    db = str(tmp_path / 's.sqlite3')
+    with SessionStore(db) as store:
+        for day, minutes in ((2, 480), (3, 360), (4, 300)):
+            trials = [{'trial_number': 1, 'pre_stimulus_interval_ms': 900, 'stimulus': 1, 'is_target': 0,
+                       'is_correct': 1, 'reaction_time_ms': 700 - minutes}]
+            store.add_session({'datetime_iso': f'2025-01-0{day}T08:00:00', 'test_settings': {},
+                               'summary_results': {'accuracy_percentage': 100.0}, 'trials': trials})
+            store.add_sleep_records([pvt_sleep.make_sleep_record(
+                datetime.datetime(2025, 1, day, 7) - datetime.timedelta(minutes=minutes), datetime.datetime(2025, 1, day, 7))])
+    pvt_sleep.main(['--db', db, 'add', '2025-01-04T22:00', '2025-01-05T06:00'])
+    with SessionStore(db) as store:
+        assert len(store.sleep_records()) == 4
+        report = pvt_sleep.sleep_report(store)
+    assert report['sessions_with_sleep'] == 3
+    rt = next(s for s in report['correlations'] if s['sleep_variable'] == 'sleep_hours' and s['performance_variable'] == 'median_rt_ms')
+    assert rt['slope'] == pytest.approx(-60)
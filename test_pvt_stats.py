@@ -0,0 +1,54 @@
+import random
+import statistics
+import pytest
+
+from pvt_stats import LiveSessionStats, P2Quantile, RunningStats
+
+
+def test_running_stats_matches_statistics():
+    rng = random.Random(2)
+    values = [rng.gauss(300, 60) for _ in range(500)]
+    stats = RunningStats(values)
+    assert stats.count == 500
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.stdev == pytest.approx(statistics.stdev(values))
+    assert stats.min == min(values)
+    assert stats.max == max(values)
+    assert RunningStats([250]).stdev is None
+
+
+@pytest.mark.parametrize("q", [0.1, 0.5, 0.9])
+def test_p2_quantile_tracks_large_stream(q):
+    rng = random.Random(4)
+    values = [rng.expovariate(1 / 80) + 200 for _ in range(20000)]
+    sketch = P2Quantile(q)
+    for value in values:
+        sketch.add(value)
+    exact = statistics.quantiles(values, n=100, method="inclusive")[round(q * 100) - 1]
+    assert sketch.value == pytest.approx(exact, rel=0.02)
+
+
+def test_p2_quantile_exact_for_few_values():
+    sketch = P2Quantile(0.5)
+    for value in (300, 100, 200):
+        sketch.add(value)
+    assert sketch.value == 200
+
+
+def test_live_session_stats():
+    stats = LiveSessionStats()
+    trials = [
+        {'is_target': 0, 'is_correct': 1, 'reaction_time_ms': 200},
+        {'is_target': 0, 'is_correct': 1, 'reaction_time_ms': 600},
+        {'is_target': 0, 'is_correct': 0, 'reaction_time_ms': None},
+        {'is_target': 1, 'is_correct': 0, 'reaction_time_ms': 300},
+        {'is_target': 1, 'is_correct': 1, 'reaction_time_ms': None},
+    ]
+    for trial in trials:
+        stats.add_trial(trial)
+    snapshot = stats.snapshot()
+    assert snapshot['trials'] == 5
+    assert snapshot['accuracy_percentage'] == 60.0
+    assert snapshot['median_go_rt_ms'] == 400
+    assert snapshot['lapses'] == 2
+    assert stats.rt_summary() == (round(statistics.mean([200, 600, 300])), 600, round(statistics.stdev([200, 600, 300])))
@@ -0,0 +1,92 @@
+import datetime
+import json
+import os
+import pytest
+
+from pvt_session import session_base_filename
+from pvt_store import SessionStore
+
+
+def make_session(day, target, accuracy, rts=(200, 250)):
+    trials = [
+        {'trial_number': i + 1, 'pre_stimulus_interval_ms': 1000, 'stimulus': 1, 'is_target': 0,
+         'is_correct': 1, 'reaction_time_ms': rt, 'isi_actual_ms': 1001.5}
+        for i, rt in enumerate(rts)
+    ]
+    trials.append({'trial_number': len(rts) + 1, 'pre_stimulus_interval_ms': 800, 'stimulus': target,
+                   'is_target': 1, 'is_correct': 1, 'reaction_time_ms': None})
+    return {
+        'datetime_iso': f'{day}T07:30:00',
+        'test_settings': {'target_number': target},
+        'summary_results': {'total_trials_conducted': len(trials), 'accuracy_percentage': accuracy,
+                            'average_reaction_time_ms': 225},
+        'trials': trials
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    with SessionStore(str(tmp_path / 'sessions.sqlite3')) as store:
+        yield store
+
+
+def test_import_json_dir_and_queries(store, tmp_path):
+    sessions = [make_session('2025-01-01', 3, 90.0), make_session('2025-01-15', 5, 70.0),
+                make_session('2025-02-01', 3, 100.0)]
+    for i, data in enumerate(sessions):
+        with open(tmp_path / f'{i}.json', 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    (tmp_path / 'broken.json').write_text('{', encoding='utf-8')
+
+    assert store.import_json_dir(str(tmp_path)) == 3
+    assert [s['session_date'] for s in store.sessions_between('2025-01-01', '2025-01-15')] == ['2025-01-01', '2025-01-15']
+    assert [s['accuracy_percentage'] for s in store.sessions_by_target(3)] == [90.0, 100.0]
+    assert [s['target_number'] for s in store.sessions_by_accuracy(min_accuracy=80)] == [3, 3]
+    assert len(store.query_sessions(start='2025-01-02', target_number=3, max_accuracy=100)) == 1
+
+    # Re-importing the same files replaces rather than duplicates
+    assert store.import_json_dir(str(tmp_path)) == 3
+    assert store.session_count() == 3
+
+
+def test_trials_round_trip(store):
+    data = make_session('2025-03-01', 7, 100.0, rts=(187.25, 300))
+    session_id = store.add_session(data, 'a.json')
+    assert store.trials_for_session(session_id) == data['trials']
+
+
+def test_session_base_filename_avoids_collisions(tmp_path):
+    now = datetime.datetime(2025, 1, 1, 7, 30, 12)
+    first = session_base_filename(str(tmp_path), now)
+    assert os.path.basename(first) == '2025-01-01_07-30'
+    open(f'{first}.json', 'w').close()
+    second = session_base_filename(str(tmp_path), now)
+    assert os.path.basename(second) == '2025-01-01_07-30_2'
+
+
+def test_daily_trends_from_aggregate_columns(store):
+    store.add_session(make_session('2025-03-01', 3, 80.0, rts=(200, 300, 400)))
+    store.add_session(make_session('2025-03-01', 3, 90.0, rts=(600, 700)))
+    store.add_session(make_session('2025-03-02', 3, 100.0, rts=(250, 260)))
+    days = store.daily_trends()
+    assert [d['session_date'] for d in days] == ['2025-03-01', '2025-03-02']
+    assert days[0]['sessions'] == 2
+    assert days[0]['median_rt_ms'] == 475 # median of session medians 300, 650
+    assert days[0]['lapses'] == 2
+    assert days[0]['accuracy_percentage'] == 85.0
+    assert store.daily_trends(start='2025-03-02') == [days[1]]
+
+
+def test_old_store_is_migrated_and_backfilled(tmp_path):
+    import sqlite3
+    db_path = str(tmp_path / 'old.sqlite3')
+    with SessionStore(db_path) as store:
+        store.add_session(make_session('2025-04-01', 2, 100.0, rts=(310, 330)))
+    # 集計列の無いスキーマに戻す
+    conn = sqlite3.connect(db_path)
+    conn.execute('ALTER TABLE sessions DROP COLUMN median_rt_ms')
+    conn.execute('ALTER TABLE sessions DROP COLUMN lapses')
+    conn.commit()
+    conn.close()
+    with SessionStore(db_path) as store:
+        assert store.daily_trends()[0]['median_rt_ms'] == 320
@@ -0,0 +1,118 @@
+import json
+import os
+import random
+
+from pvt_engine import PVTEngine, VirtualClock
+from pvt_session import build_session_data
+import pvt_stream
+from pvt_stream import TrialStream, find_interrupted_streams, read_last_record, read_stream, recover_interrupted_sessions
+
+SETTINGS = {
+    "target_number": 3,
+    "response_limit_ms": 500,
+    "response_outlier_ms": 100,
+    "feedback_duration_ms": 10,
+    "min_interval_s": 0.5,
+    "max_interval_s": 1.0,
+    "configured_max_trials": 10,
+    "precise_onset": False
+}
+
+
+def run_streamed_session(stream, responses=True):
+    clock = VirtualClock()
+    engine = PVTEngine(scheduler=clock, clock=clock, rng=random.Random(5))
+    engine.max_trials = 10
+    engine.target_trials = 3
+    engine.target_number = 3
+    engine.response_limit_ms = 500
+    engine.feedback_duration_ms = 10
+    engine.trial_listeners.append(stream.append_trial)
+    engine.trial_update_listeners.append(lambda trial, fields: stream.update_trial(trial["trial_number"], fields))
+    engine.generate_sequence()
+    engine.start()
+    rng = random.Random(7)
+    while clock.step():
+        if responses and engine.accepting_response and rng.random() < 0.7:
+            clock.advance(rng.choice([50, 250, 400]))
+            engine.handle_response()
+    return engine
+
+
+def test_stream_round_trip_matches_memory(tmp_path):
+    stream = TrialStream(str(tmp_path / "s.jsonl"), fsync_every=3)
+    stream.open("2025-01-01T08:00:00", SETTINGS)
+    engine = run_streamed_session(stream)
+    stream.close()
+    assert stream.path == str(tmp_path / "completed" / "s.jsonl") # 終了後は completed/ に移る
+    assert not os.path.exists(tmp_path / "s.jsonl")
+
+    streamed = read_stream(stream.path)
+    assert streamed["end"]["status"] == "completed"
+    assert streamed["trials"] == engine.all_trial_data
+    assert all(t["feedback_actual_ms"] is not None for t in streamed["trials"])
+
+    from_stream = build_session_data("t", SETTINGS, streamed["trials"])["summary_results"]
+    assert from_stream["correct_go_responses"] == engine.correct_go_responses
+    assert from_stream["correct_no_go_responses"] == engine.correct_no_go_responses
+    assert from_stream["commission_errors"] == engine.commission_errors
+    assert from_stream["outliers_commission_too_fast"] == engine.commission_outliers
+    assert from_stream["outliers_omission_too_late"] == engine.omission_outliers
+
+
+def test_interrupted_stream_is_recovered_once(tmp_path):
+    stream_dir = tmp_path / "streams"
+    stream_dir.mkdir()
+    stream = TrialStream(str(stream_dir / "2025-01-01_08-00-00.jsonl"))
+    stream.open("2025-01-01T08:00:00", SETTINGS)
+    engine = run_streamed_session(stream, responses=False)
+    # Simulate a crash: the file handle is abandoned mid-write
+    stream._file.write('{"type":"trial","trial":{"trial_nu')
+    stream._file.flush()
+
+    assert find_interrupted_streams(str(stream_dir)) == [stream.path]
+    recovered = recover_interrupted_sessions(str(stream_dir), str(tmp_path))
+    assert recovered == [str(tmp_path / "2025-01-01_08-00-00_recovered.json")]
+    with open(recovered[0], encoding="utf-8") as f:
+        data = json.load(f)
+    assert data["session_status"] == "recovered"
+    assert len(data["trials"]) == engine.total_trials_conducted
+    assert data["summary_results"]["total_trials_conducted"] == engine.total_trials_conducted
+
+    assert find_interrupted_streams(str(stream_dir)) == []
+    assert os.listdir(stream_dir) == ["completed"]
+    assert read_stream(str(stream_dir / "completed" / "2025-01-01_08-00-00.jsonl"))["end"]["status"] == "recovered"
+
+
+def test_empty_interrupted_stream_is_discarded(tmp_path):
+    stream = TrialStream(str(tmp_path / "empty.jsonl"))
+    stream.open("2025-01-01T08:00:00", SETTINGS)
+    assert recover_interrupted_sessions(str(tmp_path), str(tmp_path)) == []
+    assert read_stream(str(tmp_path / "completed" / "empty.jsonl"))["end"]["status"] == "discarded"
+    assert not any(name.endswith(".json") for name in os.listdir(tmp_path))
+
+
+def test_startup_scan_reads_only_last_line(tmp_path, monkeypatch):
+    # 終了記録のある古い形式のストリーム (completed/ に移す前) と中断されたストリーム
+    done = TrialStream(str(tmp_path / "done.jsonl"))
+    done.open("2025-01-01T08:00:00", SETTINGS)
+    run_streamed_session(done)
+    done.close(archive=False)
+    crashed = TrialStream(str(tmp_path / "crashed.jsonl"))
+    crashed.open("2025-01-02T08:00:00", SETTINGS)
+    crashed.append_trial({"trial_number": 1, "pre_stimulus_interval_ms": 800, "stimulus": 4, "is_target": 0,
+                          "is_correct": 1, "reaction_time_ms": 250, "note": "x" * 10000}) # 最終行が読み込みブロックより長い
+    crashed._file.flush()
+
+    def fail(path):
+        raise AssertionError("full parse during scan")
+
+    monkeypatch.setattr(pvt_stream, "read_stream", fail)
+    assert find_interrupted_streams(str(tmp_path)) == [crashed.path]
+    assert read_last_record(crashed.path)["trial"]["trial_number"] == 1
+    assert read_last_record(done.path)["type"] == "session_end"
+    monkeypatch.undo()
+
+    recover_interrupted_sessions(str(tmp_path), str(tmp_path))
+    assert sorted(os.listdir(tmp_path / "completed")) == ["crashed.jsonl", "done.jsonl"]
+    assert find_interrupted_streams(str(tmp_path)) == []
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from pvt_web import WebPVTServer, WebSession
+
+SETTINGS = {'max_trials': 8, 'target_trials': 2, 'response_limit_ms': 500, 'response_outlier_ms': 100,
+            'feedback_duration_ms': 200, 'target_number': 4}
+
+
+def client_events(plan, rt_ms=250, start_ms=1000.0):
+    # ブラウザの動きを模した時刻: ターゲットでは押さず、それ以外は rt_ms で押す
+    events = []
+    now = start_ms
+    for number, trial in enumerate(plan['trials'], start=1):
+        onset = now + trial['isi_ms'] + 3.5 # 描画までの遅れ
+        is_target = trial['stimulus'] == plan['target_number']
+        response = None if is_target else onset + rt_ms
+        feedback_end = (onset + plan['response_limit_ms'] if response is None else response) + plan['feedback_duration_ms']
+        events.append({'trial_number': number, 'stimulus': trial['stimulus'], 'onset_ms': onset,
+                       'response_ms': response, 'feedback_end_ms': feedback_end})
+        now = feedback_end
+    return events
+
+
+def test_client_timestamps_are_scored_by_the_engine():
+    session = WebSession(SETTINGS)
+    plan = session.plan()
+    assert [t['stimulus'] for t in plan['trials']].count(4) == 2
+    events = client_events(plan, rt_ms=250.25)
+    session.apply_batch({'started_ms': 1000.0, 'events': events[:3]})
+    session.apply_batch({'events': events[:5]}) # 再送を含む
+    assert session.engine.total_trials_conducted == 5
+    session.apply_batch({'events': events[5:], 'complete': True})
+    assert session.finished
+    engine = session.engine
+    assert engine.correct_go_responses == 6 and engine.correct_no_go_responses == 2
+    assert engine.reaction_times == [250.25] * 6
+    first = engine.all_trial_data[0]
+    assert first['isi_actual_ms'] == plan['trials'][0]['isi_ms'] + 3.5
+    data = session.session_data()
+    assert data['test_settings']['client'] == 'web'
+    assert data['test_settings']['schedule_seed'] == engine.plan_seed
+    assert data['summary_results']['accuracy_percentage'] == 100.0
+
+
+def test_late_and_mismatched_events():
+    session = WebSession(SETTINGS)
+    plan = session.plan()
+    events = client_events(plan)
+    go = next(e for e in events if e['response_ms'] is not None)
+    session.start(0.0)
+    for event in events[:go['trial_number'] - 1]:
+        session.apply_event(event)
+    late = dict(go, response_ms=go['onset_ms'] + 900) # 制限時間後の反応はタイムアウト
+    session.apply_event(late)
+    assert session.engine.omission_outliers == 1
+    bad = dict(events[go['trial_number']], stimulus=0)
+    with pytest.raises(ValueError):
+        session.apply_event(bad)
+
+
+async def request(host, port, method, path, payload=None):
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: x\r\nConnection: close\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status = int(head.split(b' ')[1])
+    return status, (json.loads(content) if b'application/json' in head else content.decode())
+
+
+def test_server_runs_many_concurrent_participants(tmp_path):
+    async def scenario():
+        server = WebPVTServer(str(tmp_path), SETTINGS, seed=1)
+        host, port = await server.start(port=0)
+
+        async def participant(index):
+            status, plan = await request(host, port, 'POST', '/api/sessions', {'participant': f'p{index}'})
+            assert status == 200
+            events = client_events(plan)
+            url = f"/api/sessions/{plan['session_id']}/events"
+            status, result = await request(host, port, 'POST', url, {'started_ms': 1000.0, 'events': events[:4]})
+            assert status == 200 and result['trials'] == 4
+            status, result = await request(host, port, 'POST', url, {'events': events[4:], 'complete': True})
+            assert status == 200 and result['finished']
+            return result
+
+        results = await asyncio.gather(*(participant(i) for i in range(30)))
+        status, page = await request(host, port, 'GET', '/')
+        status_stats, stats = await request(host, port, 'GET', '/api/stats')
+        await server.close()
+        return results, status, page, stats
+
+    results, status, page, stats = asyncio.run(scenario())
+    assert all(r['summary']['live_metrics']['accuracy_percentage'] == 100.0 for r in results)
+    assert status == 200 and 'performance.now()' in page
+    assert stats['completed_sessions'] == 30 and stats['active_sessions'] == 0
+    assert stats['routes']['events']['count'] == 60
+    saved = sorted(n for n in os.listdir(tmp_path) if n.endswith('.json'))
+    assert len(saved) == 30 # 同じ分に終わったセッションも別名で保存される
+    with open(os.path.join(tmp_path, saved[0]), encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['participant'].startswith('p')
+    assert data['summary_results']['total_trials_conducted'] == 8
+
+
+def test_unknown_session_and_bad_batch(tmp_path):
+    async def scenario():
+        server = WebPVTServer(None, SETTINGS)
+        host, port = await server.start(port=0)
+        missing = await request(host, port, 'POST', '/api/sessions/nope/events', {'events': []})
+        _, plan = await request(host, port, 'POST', '/api/sessions')
+        bad = await request(host, port, 'POST', f"/api/sessions/{plan['session_id']}/events",
+                            {'started_ms': 0, 'events': [{'trial_number': 3}]})
+        await server.close()
+        return missing, bad
+
+    missing, bad = asyncio.run(scenario())
+    assert missing[0] == 404
+    assert bad[0] == 400
+
+
+def test_invalid_content_length_gets_400(tmp_path):
+    async def scenario():
+        server = WebPVTServer(None, SETTINGS)
+        host, port = await server.start(port=0)
+        responses = []
+        for length in ('abc', '-5'):
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f'POST /api/sessions HTTP/1.1\r\nHost: x\r\nContent-Length: {length}\r\n\r\n'.encode())
+            await writer.drain()
+            responses.append(await asyncio.wait_for(reader.read(), 5)) # 応答の後に接続が閉じられる
+            writer.close()
+        await server.close()
+        return responses
+
+    for response in asyncio.run(scenario()):
+        assert response.startswith(b'HTTP/1.1 400')
+        assert b'Connection: close' in response